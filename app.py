@@ -1,4 +1,7 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import (
+    Flask, render_template, request, redirect, url_for, jsonify, g, has_request_context,
+    Response, stream_with_context,
+)
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import (
     LoginManager,
@@ -6,23 +9,36 @@ from flask_login import (
     login_user,
     logout_user,
     login_required,
+    current_user,
 )
-from flask_socketio import SocketIO
-from sqlalchemy import text
+from flask_socketio import SocketIO, join_room
+from sqlalchemy import text, event, case, and_, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 import eventlet
+from eventlet.semaphore import Semaphore
+from functools import wraps
 eventlet.monkey_patch()
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
 import os
 import json
+import csv
 import random
 import string
 from flask_migrate import Migrate
 from urllib.parse import quote
 import uuid
+import queue
+import time
+import tempfile
+import xlsxwriter
+import hmac
+from collections import deque
 from flask import send_file
 from werkzeug.utils import secure_filename
-from io import BytesIO
+from io import BytesIO, StringIO
 import pandas as pd
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
@@ -91,6 +107,18 @@ with app.app_context():
         if "btw_total" not in cols:
             with db.engine.begin() as conn:
                 conn.execute(text("ALTER TABLE orders ADD COLUMN btw_total FLOAT DEFAULT 0"))
+        # Derived money fields, filled at write time (see Order.set_totals)
+        if "subtotal" not in cols:
+            with db.engine.begin() as conn:
+                conn.execute(text("ALTER TABLE orders ADD COLUMN subtotal FLOAT"))
+        if "bezorging" not in cols:
+            with db.engine.begin() as conn:
+                conn.execute(text("ALTER TABLE orders ADD COLUMN bezorging FLOAT"))
+        # Last write time, the cursor for /pos/orders?since=
+        if "updated_at" not in cols:
+            with db.engine.begin() as conn:
+                conn.execute(text("ALTER TABLE orders ADD COLUMN updated_at TIMESTAMP"))
+                conn.execute(text("UPDATE orders SET updated_at = created_at WHERE updated_at IS NULL"))
         cols = {c["name"] for c in inspector.get_columns("reviews")}
         if "rating" not in cols:
             with db.engine.begin() as conn:
@@ -102,6 +130,30 @@ with app.app_context():
         if "idx_orders_created_at" not in idx_names:
             with db.engine.begin() as conn:
                 conn.execute(text("CREATE INDEX idx_orders_created_at ON orders (created_at)"))
+        if "idx_orders_updated_at" not in idx_names:
+            with db.engine.begin() as conn:
+                conn.execute(text("CREATE INDEX idx_orders_updated_at ON orders (updated_at)"))
+        if "uq_orders_order_number" not in idx_names:
+            # Fails while duplicate order numbers exist; lookups then use a
+            # plain index until the duplicates are cleaned up, and bulk
+            # upload skips ON CONFLICT (see order_number_is_unique).
+            try:
+                with db.engine.begin() as conn:
+                    conn.execute(text("CREATE UNIQUE INDEX uq_orders_order_number ON orders (order_number)"))
+            except Exception as e:
+                print(f"⚠️ uq_orders_order_number not created: {e}")
+                if "idx_orders_order_number" not in idx_names:
+                    with db.engine.begin() as conn:
+                        conn.execute(text("CREATE INDEX idx_orders_order_number ON orders (order_number)"))
+        # Payment webhooks and review checks look orders up by order_number.
+        order_number_idx = [
+            i["name"] for i in db.inspect(db.engine).get_indexes("orders")
+            if i["column_names"] == ["order_number"]
+        ]
+        if order_number_idx:
+            print(f"✅ orders.order_number index: {', '.join(order_number_idx)}")
+        else:
+            print("⚠️ orders.order_number has no index")
     except Exception as e:
         print(f"DB init error: {e}")
 
@@ -109,6 +161,152 @@ UTC = timezone.utc
 NL_TZ = ZoneInfo("Europe/Amsterdam")
 
 
+# ----- Admission control -----
+# The app runs on one eventlet worker, so every request shares the same hub
+# and the same connection pool. Order writes go through the 'orders' gate:
+# up to ORDER_CONCURRENCY run at once, a bounded number wait briefly for a
+# slot and the rest get 503 with Retry-After straight away. Report
+# downloads go through the much smaller 'exports' gate and never wait;
+# they are also turned away while orders are queueing, so a slow Excel or
+# PDF build cannot push checkouts into timeouts.
+class AdmissionGate:
+    """Concurrency limit with a bounded wait queue and counters."""
+
+    def __init__(self, name, limit, max_waiting, wait_timeout, retry_after, yield_to=None):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self.yield_to = yield_to
+        self._slots = Semaphore(limit)
+        self.active = 0
+        self.waiting = 0
+        self.peak_active = 0
+        self.peak_waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    def _busy_elsewhere(self) -> bool:
+        other = self.yield_to
+        return other is not None and (other.waiting > 0 or other.active >= other.limit)
+
+    def enter(self) -> bool:
+        """Take a slot, waiting up to wait_timeout; False means rejected."""
+        if self._busy_elsewhere():
+            acquired = False
+        elif self._slots.acquire(blocking=False):
+            acquired = True
+        elif self.waiting >= self.max_waiting or self.wait_timeout <= 0:
+            acquired = False
+        else:
+            self.waiting += 1
+            self.peak_waiting = max(self.peak_waiting, self.waiting)
+            try:
+                acquired = self._slots.acquire(timeout=self.wait_timeout)
+            finally:
+                self.waiting -= 1
+        if not acquired:
+            self.rejected += 1
+            return False
+        self.active += 1
+        self.peak_active = max(self.peak_active, self.active)
+        self.admitted += 1
+        return True
+
+    def leave(self):
+        self.active -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'waiting': self.waiting,
+            'max_waiting': self.max_waiting,
+            'peak_active': self.peak_active,
+            'peak_waiting': self.peak_waiting,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+        }
+
+
+ORDER_CONCURRENCY = int(os.getenv('ORDER_CONCURRENCY', '8'))
+ORDER_QUEUE_LIMIT = int(os.getenv('ORDER_QUEUE_LIMIT', '32'))
+ORDER_QUEUE_TIMEOUT = float(os.getenv('ORDER_QUEUE_TIMEOUT', '5'))
+EXPORT_CONCURRENCY = int(os.getenv('EXPORT_CONCURRENCY', '1'))
+
+_order_gate = AdmissionGate('orders', ORDER_CONCURRENCY, ORDER_QUEUE_LIMIT, ORDER_QUEUE_TIMEOUT, retry_after=2)
+admission_gates = {
+    'orders': _order_gate,
+    'exports': AdmissionGate('exports', EXPORT_CONCURRENCY, 0, 0, retry_after=15, yield_to=_order_gate),
+}
+
+
+def admission(name: str):
+    """Run the view inside the named gate, answering 503 when it is full."""
+    gate = admission_gates[name]
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not gate.enter():
+                response = jsonify({"status": "fail", "error": "Het is even erg druk, probeer het zo opnieuw"})
+                response.headers['Retry-After'] = str(gate.retry_after)
+                return response, 503
+            try:
+                response = view(*args, **kwargs)
+            except BaseException:
+                gate.leave()
+                raise
+            if (isinstance(response, Response) and response.is_streamed
+                    and not response.direct_passthrough):
+                # Generated bodies (CSV/NDJSON exports) keep their slot until
+                # the last chunk is sent. send_file responses are already
+                # built and skip call_on_close, so they release right away.
+                release = _release_once(gate)
+                response.response = _release_after(response.response, release)
+                response.call_on_close(release)
+            else:
+                gate.leave()
+            return response
+        return wrapper
+    return decorator
+
+
+def _release_once(gate):
+    state = {'held': True}
+
+    def release():
+        if state['held']:
+            state['held'] = False
+            gate.leave()
+    return release
+
+
+def _release_after(body, release):
+    """Yield ``body`` and release the admission slot when it ends or is closed."""
+    try:
+        yield from body
+    finally:
+        release()
+
+
+@app.route('/api/metrics/admission')
+@login_required
+def admission_metrics():
+    """Gate and post-commit queue depths for the admin dashboard or curl."""
+    return jsonify({
+        'gates': {name: gate.stats() for name, gate in admission_gates.items()},
+        'post_commit': {
+            'depth': _post_commit['queue'].qsize(),
+            'max_depth': POST_COMMIT_QUEUE_SIZE,
+            'inline': _post_commit['inline'],
+        },
+    })
+
+
+
 @app.route("/")
 def serve_index():
     return render_template("index.html")  # 默认首页（荷兰语）
@@ -138,21 +336,41 @@ def to_nl(dt: datetime) -> datetime:
     if dt.tzinfo is None:
         dt = dt.replace(tzinfo=UTC)
     return dt.astimezone(NL_TZ)
-def generate_excel_today(include_cancelled: bool = False):
-    today = datetime.now(NL_TZ).date()
-    start_local = datetime.combine(today, datetime.min.time(), tzinfo=NL_TZ)
-    start = start_local.astimezone(UTC).replace(tzinfo=None)
 
-    q = Order.query.filter(Order.created_at >= start)
+
+def nl_day_bounds(first, last=None) -> tuple:
+    """Naive-UTC ``(start, end)`` covering the Amsterdam days first..last.
+
+    Takes dates or 'YYYY-MM-DD' strings; ``last`` defaults to ``first`` and
+    a bad string raises ValueError. ``end`` is exclusive (next midnight).
+    """
+    days = []
+    for day in (first, first if last is None else last):
+        if isinstance(day, str):
+            day = datetime.strptime(day, '%Y-%m-%d').date()
+        days.append(day)
+    start_local = datetime.combine(days[0], datetime.min.time(), tzinfo=NL_TZ)
+    end_local = datetime.combine(days[1] + timedelta(days=1), datetime.min.time(), tzinfo=NL_TZ)
+    return start_local.astimezone(UTC).replace(tzinfo=None), end_local.astimezone(UTC).replace(tzinfo=None)
+
+
+def created_between(first, last=None):
+    """Filter for orders placed on the NL days first..last.
+
+    Compares the raw created_at column so idx_orders_created_at is used.
+    """
+    start, end = nl_day_bounds(first, last)
+    return and_(Order.created_at >= start, Order.created_at < end)
+
+
+def generate_excel_today(include_cancelled: bool = False):
+    q = Order.query.filter(created_between(datetime.now(NL_TZ).date()))
     if not include_cancelled:
         q = q.filter(Order.is_cancelled == False)
     orders = q.order_by(Order.created_at.desc()).all()
     data = []
     for o in orders:
-        try:
-            items = json.loads(o.items or "{}")
-        except Exception:
-            items = {}
+        items = o.items_data
 
         summary = ", ".join(f"{k} x {v.get('qty')}" for k, v in items.items())
         status = "Geannuleerd" if o.is_cancelled else ("Voltooid" if o.is_completed else "Open")
@@ -195,22 +413,8 @@ def get_order_by_number(order_number):
         return jsonify({"error": "Order not found"}), 404
 
 def order_to_dict(order):
-    try:
-        items = json.loads(order.items or '{}')
-    except Exception:
-        try:
-            import ast
-            items = ast.literal_eval(order.items)
-        except Exception:
-            items = {}
-
-    subtotal = sum(
-        float(i.get("price", 0)) * int(i.get("qty", 0))
-        for i in items.values()
-    )
-    delivery_calc = order.totaal + (order.discountAmount or 0) - subtotal - order.verpakkingskosten - (order.fooi or 0) - (order.statiegeld or 0)
-    delivery_calc = round(delivery_calc, 2)
-    delivery = order.bezorgkosten if order.bezorgkosten not in [None, 0] else max(delivery_calc, 0)
+    items = order.items_data
+    subtotal, delivery = order.stored_totals()
 
     return {
         "id": order.id,
@@ -251,11 +455,7 @@ def order_to_dict(order):
     }
 
 def generate_pdf_today(include_cancelled: bool = False):
-    today = datetime.now(NL_TZ).date()
-    start_local = datetime.combine(today, datetime.min.time(), tzinfo=NL_TZ)
-    start = start_local.astimezone(UTC).replace(tzinfo=None)
-
-    q = Order.query.filter(Order.created_at >= start)
+    q = Order.query.filter(created_between(datetime.now(NL_TZ).date()))
     if not include_cancelled:
         q = q.filter(Order.is_cancelled == False)
     orders = q.order_by(Order.created_at.desc()).all()
@@ -266,10 +466,7 @@ def generate_pdf_today(include_cancelled: bool = False):
 
     data = [["Datum", "Tijd", "Naam", "Totaal", "Items", "Status"]]
     for o in orders:
-        try:
-            items = json.loads(o.items or "{}")
-        except Exception:
-            items = {}
+        items = o.items_data
 
         summary = ", ".join(f"{k} x {v.get('qty')}" for k, v in items.items())
         status = "Geannuleerd" if o.is_cancelled else ("Voltooid" if o.is_completed else "Open")
@@ -307,6 +504,7 @@ def manifest():
 
 @app.route("/admin/orders/download/pdf")
 @login_required
+@admission('exports')
 def download_pdf():
     include_cancelled = request.args.get('include_cancelled') == '1'
     output = generate_pdf_today(include_cancelled)
@@ -318,18 +516,22 @@ def download_pdf():
     )
 @app.route("/admin/orders/download/excel")
 @login_required
+@admission('exports')
 def download_excel():
     include_cancelled = request.args.get('include_cancelled') == '1'
     date = request.args.get('date')
     start = request.args.get('start')
     end = request.args.get('end')
 
-    if date:
-        output = generate_excel_by_date(date, include_cancelled)
-    elif start and end:
-        output = generate_excel_by_range(start, end, include_cancelled)
-    else:
-        output = generate_excel_today(include_cancelled)
+    try:
+        if date:
+            output = generate_excel_by_date(date, include_cancelled)
+        elif start and end:
+            output = generate_excel_by_range(start, end, include_cancelled)
+        else:
+            output = generate_excel_today(include_cancelled)
+    except ValueError:
+        return jsonify({"status": "fail", "error": "invalid date"}), 400
 
     return send_file(
         output,
@@ -338,78 +540,165 @@ def download_excel():
         download_name='bestellingen.xlsx'
     )
 def generate_excel_by_date(date, include_cancelled=False):
-    query = Order.query.filter(func.date(Order.created_at) == date)
-    if not include_cancelled:
-        query = query.filter(Order.is_cancelled == False)
-    orders = query.order_by(Order.created_at.asc()).all()
-    return build_excel(orders)
+    return build_excel(created_between(date), include_cancelled)
 def generate_excel_by_range(start, end, include_cancelled=False):
-    query = Order.query.filter(
-        func.date(Order.created_at) >= start,
-        func.date(Order.created_at) <= end
-    )
-    if not include_cancelled:
-        query = query.filter(Order.is_cancelled == False)
-    orders = query.order_by(Order.created_at.asc()).all()
-    return build_excel(orders)
-def build_excel(orders):
-    order_dicts = orders_to_dicts(orders)
+    return build_excel(created_between(start, end), include_cancelled)
 
-    if not order_dicts:
-        df = pd.DataFrame([{"Melding": "Geen bestellingen gevonden."}])
-    else:
-        df = pd.DataFrame(order_dicts)
-
-    # Omzet overzicht berekenen
-    total = sum(float(o['totaal']) for o in order_dicts if not o['is_cancelled'])
-    pin = sum(float(o['totaal']) for o in order_dicts if 'pin' in (o['payment_method'] or '').lower() and not o['is_cancelled'])
-    online = sum(float(o['totaal']) for o in order_dicts if 'online' in (o['payment_method'] or '').lower() and not o['is_cancelled'])
-    contant = sum(float(o['totaal']) for o in order_dicts if 'contant' in (o['payment_method'] or '').lower() and not o['is_cancelled'])
-    credit = sum(float(o['totaal']) for o in order_dicts if 'rekening' in (o['payment_method'] or '').lower() and not o['is_cancelled'])
-
-    omzet_data = {
-        'Omschrijving': ['Totale omzet', 'Pin betaling', 'Online betaling', 'Contant', 'Op rekening'],
-        'Bedrag': [total, pin, online, contant, credit]
-    }
-    omzet_df = pd.DataFrame(omzet_data)
 
-    # Excel schrijven
-    output = BytesIO()
-    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-        df.to_excel(writer, index=False, sheet_name='Bestellingen')
-        omzet_df.to_excel(writer, index=False, sheet_name='Omzet Overzicht')
+EXCEL_BATCH = 500
+EXCEL_CURRENCY_COLUMNS = (
+    'total', 'totaal', 'verpakkingskosten', 'bezorgkosten',
+    'btw_9', 'btw_21', 'btw_total', 'fooi', 'statiegeld', 'korting',
+)
 
-        workbook = writer.book
-        orders_ws = writer.sheets['Bestellingen']
-        omzet_ws = writer.sheets['Omzet Overzicht']
 
-        currency_fmt = workbook.add_format({'num_format': '€ #,##0.00'})
-        text_fmt = workbook.add_format({'num_format': '@'})
+def order_batches(period, include_cancelled=False):
+    """Yield orders matching ``period`` as lists of orders_to_dicts rows.
 
-        currency_cols = [
-            'total', 'totaal', 'verpakkingskosten', 'bezorgkosten',
-            'btw_9', 'btw_21', 'btw_total', 'fooi', 'statiegeld', 'korting'
-        ]
-        for col in currency_cols:
-            if col in df.columns:
-                idx = df.columns.get_loc(col)
-                orders_ws.set_column(idx, idx, None, currency_fmt)
+    Orders are read EXCEL_BATCH at a time (yield_per, a server-side cursor
+    on Postgres) and detached from the session once converted, so memory
+    stays flat however long the range is.
+    """
+    stmt = db.select(Order).where(period)
+    if not include_cancelled:
+        stmt = stmt.where(Order.is_cancelled == False)
+    stmt = stmt.order_by(Order.created_at.asc(), Order.id).execution_options(yield_per=EXCEL_BATCH)
+    for batch in db.session.execute(stmt).scalars().partitions():
+        rows = orders_to_dicts(batch)
+        for order in batch:
+            db.session.expunge(order)
+        yield rows
+
+
+def build_excel(period, include_cancelled=False):
+    """Orders matching ``period`` plus an 'Omzet Overzicht' sheet, as xlsx.
+
+    Rows come from order_batches() and xlsxwriter's constant_memory mode
+    flushes each finished row, so memory stays flat for any range.
+    Returns an anonymous temp file at position 0; closing it deletes it.
+    """
+    output = tempfile.TemporaryFile()
+    workbook = xlsxwriter.Workbook(output, {'constant_memory': True})
+    header_fmt = workbook.add_format({'bold': True})
+    currency_fmt = workbook.add_format({'num_format': '€ #,##0.00'})
+    text_fmt = workbook.add_format({'num_format': '@'})
+
+    orders_ws = workbook.add_worksheet('Bestellingen')
+    columns = None
+    row = 0
+    for batch in order_batches(period, include_cancelled):
+        for values in batch:
+            if columns is None:
+                columns = list(values)
+                for col, key in enumerate(columns):
+                    if key in EXCEL_CURRENCY_COLUMNS:
+                        orders_ws.set_column(col, col, None, currency_fmt)
+                    elif key == 'phone':
+                        orders_ws.set_column(col, col, None, text_fmt)
+                orders_ws.write_row(0, 0, columns, header_fmt)
+            row += 1
+            orders_ws.write_row(row, 0, [
+                str(values[key]) if isinstance(values[key], (dict, list)) else values[key]
+                for key in columns
+            ])
+    if columns is None:
+        orders_ws.write_row(0, 0, ['Melding'], header_fmt)
+        orders_ws.write_row(1, 0, ['Geen bestellingen gevonden.'])
+
+    totals = revenue_totals(period)
+    omzet_ws = workbook.add_worksheet('Omzet Overzicht')
+    omzet_ws.set_column(1, 1, None, currency_fmt)
+    omzet_ws.write_row(0, 0, ['Omschrijving', 'Bedrag'], header_fmt)
+    for row, (label, key) in enumerate([
+        ('Totale omzet', 'total'), ('Pin betaling', 'pin'), ('Online betaling', 'online'),
+        ('Contant', 'contant'), ('Op rekening', 'rekening'),
+    ], start=1):
+        omzet_ws.write_row(row, 0, [label, totals[key]])
+
+    workbook.close()
+    output.seek(0)
+    return output
 
-        if 'phone' in df.columns:
-            idx = df.columns.get_loc('phone')
-            orders_ws.set_column(idx, idx, None, text_fmt)
 
-        if 'Bedrag' in omzet_df.columns:
-            idx = omzet_df.columns.get_loc('Bedrag')
-            omzet_ws.set_column(idx, idx, None, currency_fmt)
+# ----- Raw order exports -----
+# CSV and NDJSON for the bookkeeping import and analytics scripts. Same
+# filters as download_excel, but the body is generated while the rows are
+# read, so even multi-year ranges start downloading straight away.
+EXPORT_COLUMNS = (
+    'id', 'order_number', 'created_date', 'created_at', 'order_type', 'bron', 'status',
+    'customer_name', 'phone', 'email', 'payment_method', 'pickup_time', 'delivery_time',
+    'tijdslot_display', 'postcode', 'house_number', 'street', 'city', 'opmerking', 'items',
+    'subtotal', 'verpakkingskosten', 'bezorgkosten', 'korting', 'fooi', 'statiegeld',
+    'btw_9', 'btw_21', 'btw_total', 'totaal', 'is_completed', 'is_cancelled',
+)
 
-    output.seek(0)
 
-    return output
+def export_period(args):
+    """created_between() filter for ?date= or ?start=&end=, else today.
+
+    Raises ValueError on a malformed date.
+    """
+    if args.get('date'):
+        return created_between(args['date'])
+    if args.get('start') and args.get('end'):
+        return created_between(args['start'], args['end'])
+    return created_between(datetime.now(NL_TZ).date())
+
+
+def export_csv_lines(period, include_cancelled=False):
+    buffer = StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    yield buffer.getvalue()
+    for batch in order_batches(period, include_cancelled):
+        buffer.seek(0)
+        buffer.truncate()
+        for row in batch:
+            row['items'] = json.dumps(row['items'], ensure_ascii=False)
+            writer.writerow(row)
+        yield buffer.getvalue()
+
+
+def export_ndjson_lines(period, include_cancelled=False):
+    for batch in order_batches(period, include_cancelled):
+        yield ''.join(
+            json.dumps({key: row[key] for key in EXPORT_COLUMNS}, ensure_ascii=False, default=str) + '\n'
+            for row in batch
+        )
 
 
+def export_response(lines, mimetype, filename):
+    return Response(
+        stream_with_context(lines),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'},
+    )
+
+
+@app.route("/admin/orders/export.csv")
+@login_required
+@admission('exports')
+def export_orders_csv():
+    try:
+        period = export_period(request.args)
+    except ValueError:
+        return jsonify({"status": "fail", "error": "invalid date"}), 400
+    include_cancelled = request.args.get('include_cancelled') == '1'
+    return export_response(export_csv_lines(period, include_cancelled), 'text/csv', 'bestellingen.csv')
 
 
+@app.route("/admin/orders/export.ndjson")
+@login_required
+@admission('exports')
+def export_orders_ndjson():
+    try:
+        period = export_period(request.args)
+    except ValueError:
+        return jsonify({"status": "fail", "error": "invalid date"}), 400
+    include_cancelled = request.args.get('include_cancelled') == '1'
+    return export_response(
+        export_ndjson_lines(period, include_cancelled), 'application/x-ndjson', 'bestellingen.ndjson'
+    )
 
 
 def build_maps_link(street: str, house_number: str, postcode: str, city: str) -> str | None:
@@ -422,39 +711,17 @@ def orders_to_dicts(orders):
     result = []
     for o in orders:
         # items -> dict
-        try:
-            o.items_dict = json.loads(o.items or '{}')
-        except Exception:
-            try:
-                import ast
-                o.items_dict = ast.literal_eval(o.items)
-            except Exception:
-                o.items_dict = {}
+        o.items_dict = o.items_data
 
         totaal = o.totaal or 0
-
-        # 小计
-        subtotal = sum(
-            float(i.get("price", 0)) * int(i.get("qty", 0))
-            for i in (o.items_dict or {}).values()
-        )
-
-        # 计算配送费兜底
         discount = o.discountAmount or 0
         verpakkings = o.verpakkingskosten or 0
         fooi = o.fooi or 0
-        statiegeld = getattr(o, 'statiegeld', 0) or 0
-
-        delivery_calc = totaal + discount - subtotal - verpakkings - fooi - statiegeld
-        delivery_calc = round(delivery_calc, 2)
-        delivery = o.bezorgkosten if o.bezorgkosten not in [None, 0] else max(delivery_calc, 0)
-        o.bezorgkosten = delivery
+        statiegeld = o.statiegeld or 0
+        subtotal, delivery = o.stored_totals()
 
-        # Recalculate BTW if not stored
-        if o.btw_total is None:
-            o.btw_total = (o.btw_9 or 0) + (o.btw_21 or 0)
-
-        btw_total = o.btw_total or 0
+        # BTW total if not stored
+        btw_total = o.btw_total if o.btw_total is not None else (o.btw_9 or 0) + (o.btw_21 or 0)
 
         result.append({
             "id": o.id,
@@ -480,6 +747,7 @@ def orders_to_dicts(orders):
             "items": o.items_dict,
             "total": totaal,
             "totaal": totaal,
+            "subtotal": subtotal,
             "verpakkingskosten": verpakkings,
             "bezorgkosten": delivery,
             "btw_9": o.btw_9 or 0,
@@ -525,31 +793,7 @@ def _in_range(start: str, end: str, now_min: int) -> bool:
 
 
 def order_type_open(order_type: str) -> bool:
-    settings = {s.key: s.value for s in Setting.query.all()}
-    website_on = settings.get('is_open', 'true') != 'false'
-    if not website_on:
-        return False
-    closed_days = [d for d in (settings.get('closed_days') or '').split(',') if d]
-    day_name = datetime.now(NL_TZ).strftime('%A')
-    if day_name in closed_days:
-        return False
-    if order_type == 'afhalen':
-        if settings.get('pickup_enabled', 'true') == 'false':
-            return False
-        start = settings.get('pickup_start', '00:00')
-        end = settings.get('pickup_end', '00:00')
-    else:
-        if settings.get('delivery_enabled', 'true') == 'false':
-            return False
-        start = settings.get('delivery_start', '00:00')
-        end = settings.get('delivery_end', '00:00')
-    now = datetime.now(NL_TZ)
-    now_min = now.hour * 60 + now.minute
-    start_min = _parse_minutes(start)
-    end_min = _parse_minutes(end)
-    if start_min <= end_min:
-        return now_min < end_min
-    return True
+    return get_order_schedule().is_open_now(order_type, datetime.now(NL_TZ))
 
 
 # Socket.IO for real-time updates
@@ -562,9 +806,26 @@ socketio = SocketIO(app, cors_allowed_origins="*", async_mode="eventlet")
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
 
+def parse_items_text(text_value) -> dict:
+    """Parse the legacy orders.items text (JSON, or a Python repr from old clients)."""
+    try:
+        items = json.loads(text_value or '{}')
+    except Exception:
+        try:
+            import ast
+            items = ast.literal_eval(text_value)
+        except Exception:
+            items = {}
+    return items if isinstance(items, dict) else {}
+
+
 # 数据模型
 class Order(db.Model):
     __tablename__ = 'orders'
+    __table_args__ = (
+        db.Index('uq_orders_order_number', 'order_number', unique=True),
+        db.Index('idx_orders_updated_at', 'updated_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     order_number = db.Column(db.String(20))
     order_type = db.Column(db.String(20))
@@ -583,6 +844,7 @@ class Order(db.Model):
     opmerking = db.Column(db.Text)
     items = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     totaal = db.Column(db.Float)
     verpakkingskosten = db.Column(db.Float, default=0.0)
     fooi = db.Column(db.Float, default=0.0)
@@ -598,9 +860,54 @@ class Order(db.Model):
     is_completed = db.Column(db.Boolean, default=False)
     is_cancelled = db.Column(db.Boolean, default=False)
     status = db.Column(db.String(20), default='pending')
+    subtotal = db.Column(db.Float)  # sum of item lines
+    bezorging = db.Column(db.Float)  # delivery fee shown to staff, see set_totals()
+    order_items = db.relationship(
+        'OrderItem', lazy='selectin', order_by='OrderItem.id',
+        cascade='all, delete-orphan', backref='order',
+    )
+
+    @property
+    def items_data(self) -> dict:
+        """Items as ``{name: {'qty', 'price', ...}}``.
+
+        Read from order_items; orders written by clients that only fill the
+        legacy text column fall back to parsing it. Assigning ``items``
+        through the ORM rebuilds order_items (see _sync_order_items); raw
+        SQL writers must update both, or rows would shadow the new text.
+        """
+        if self.order_items:
+            return {i.name: i.to_item() for i in self.order_items}
+        return parse_items_text(self.items)
+
+    def derived_totals(self):
+        """Return ``(subtotal, bezorging)`` computed from the items and amounts.
+
+        An order without a stored delivery fee gets whatever is left of the
+        total after items, packaging, tip and deposit.
+        """
+        subtotal = round(sum(r['price'] * r['qty'] for r in order_item_rows(self.items_data)), 2)
+        if self.bezorgkosten not in [None, 0]:
+            return subtotal, self.bezorgkosten
+        delivery_calc = (
+            (self.totaal or 0) + (self.discountAmount or 0) - subtotal
+            - (self.verpakkingskosten or 0) - (self.fooi or 0) - (self.statiegeld or 0)
+        )
+        return subtotal, max(round(delivery_calc, 2), 0)
+
+    def set_totals(self):
+        """Store the derived money fields; call after any amount or item change."""
+        self.subtotal, self.bezorging = self.derived_totals()
+
+    def stored_totals(self):
+        """``(subtotal, bezorging)`` as stored, computed only for unfilled rows."""
+        if self.bezorging is None or self.subtotal is None:
+            return self.derived_totals()
+        return self.subtotal, self.bezorging
 
 # ✅ 添加的位置
     def to_dict(self):
+        subtotal, bezorging = self.stored_totals()
         return {
             "id": self.id,
             "order_number": self.order_number,
@@ -618,7 +925,7 @@ class Order(db.Model):
             "street": self.street,
             "city": self.city,
             "opmerking": self.opmerking,
-            "items": json.loads(self.items or '{}'),
+            "items": self.items_data,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "totaal": self.totaal,
             "verpakkingskosten": self.verpakkingskosten,
@@ -629,7 +936,8 @@ class Order(db.Model):
             "discount_amount": self.discount_amount,
             "discountCode": self.discountCode,
             "discountAmount": self.discountAmount,
-            "bezorging": self.bezorgkosten,
+            "subtotal": subtotal,
+            "bezorging": bezorging,
             "btw_9": self.btw_9 or 0.0,
             "btw_21": self.btw_21 or 0.0,
             "btw_total": self.btw_total or (self.btw_9 or 0.0) + (self.btw_21 or 0.0),
@@ -638,6 +946,118 @@ class Order(db.Model):
             "status": self.status
         }
 
+class OrderItem(db.Model):
+    """One line of an order; orders.items keeps a JSON copy for older clients."""
+    __tablename__ = 'order_items'
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='CASCADE'), nullable=False, index=True)
+    name = db.Column(db.String(200), nullable=False)
+    qty = db.Column(db.Integer, nullable=False, default=0)
+    price = db.Column(db.Float, nullable=False, default=0.0)
+    extra = db.Column(db.Text)  # JSON of any other per-item fields
+
+    def to_item(self) -> dict:
+        item = {'qty': self.qty, 'price': self.price}
+        if self.extra:
+            item.update(json.loads(self.extra))
+        return item
+
+
+def order_item_rows(items) -> list:
+    """Column values for the order_items rows of an items dict.
+
+    Anything other than a dict gives no rows.
+    """
+    if not isinstance(items, dict):
+        return []
+    rows = []
+    for name, item in items.items():
+        if not isinstance(item, dict):
+            item = {}
+        try:
+            qty = int(float(item.get('qty') or 0))
+        except (TypeError, ValueError):
+            qty = 0
+        try:
+            price = float(item.get('price') or 0)
+        except (TypeError, ValueError):
+            price = 0.0
+        extra = {k: v for k, v in item.items() if k not in ('qty', 'price')}
+        rows.append({
+            'name': str(name)[:200],
+            'qty': qty,
+            'price': price,
+            'extra': json.dumps(extra) if extra else None,
+        })
+    return rows
+
+
+def backfill_order_totals(batch_size=1000) -> int:
+    """Fill subtotal/bezorging for orders stored before they existed.
+
+    Also picks up orders from clients that do not set them. Returns the
+    number of orders updated.
+    """
+    done = 0
+    while True:
+        batch = (Order.query
+                 .filter(or_(Order.bezorging.is_(None), Order.subtotal.is_(None)))
+                 .order_by(Order.id)
+                 .limit(batch_size)
+                 .all())
+        if not batch:
+            return done
+        for order in batch:
+            order.set_totals()
+        db.session.commit()
+        done += len(batch)
+
+
+def backfill_order_items(batch_size=2000) -> int:
+    """Copy orders.items text into order_items for orders without rows.
+
+    Runs at startup: once for the historical orders, and afterwards for any
+    orders written by clients that only fill the text column. Returns the
+    number of orders looked at.
+    """
+    orders = Order.__table__
+    lines = OrderItem.__table__
+    items_text = orders.c['items']  # .c.items is the collection's items() method
+    missing = ~db.exists().where(lines.c.order_id == orders.c.id)
+    last_id, done = 0, 0
+    while True:
+        batch = db.session.execute(
+            db.select(orders.c.id, items_text)
+            .where(orders.c.id > last_id, missing,
+                   items_text.isnot(None), items_text.notin_(['', '{}']))
+            .order_by(orders.c.id)
+            .limit(batch_size)
+        ).all()
+        if not batch:
+            return done
+        rows = [
+            dict(row, order_id=order_id)
+            for order_id, text_value in batch
+            for row in order_item_rows(parse_items_text(text_value))
+        ]
+        if rows:
+            db.session.execute(lines.insert(), rows)
+        db.session.commit()
+        done += len(batch)
+        last_id = batch[-1][0]
+
+
+@event.listens_for(Order.items, 'set')
+def _sync_order_items(order, value, oldvalue, initiator):
+    """Keep order_items in step with the items text on every assignment."""
+    order.order_items = [OrderItem(**row) for row in order_item_rows(parse_items_text(value))]
+
+
+def order_ids(orders) -> list:
+    """Primary keys of orders given as ids or instances, loaded or expired."""
+    return [o if isinstance(o, int) else db.inspect(o).identity[0] for o in orders]
+
+
 class Thuisbezorgd(db.Model):
     __tablename__ = 'thuisbezorgd'
     id = db.Column(db.Integer, primary_key=True)
@@ -658,6 +1078,192 @@ class Thuisbezorgd(db.Model):
             "statiegeld": self.statiegeld or 0.0,
         }
 
+
+# ----- Daily revenue -----
+# daily_revenue keeps one row of omzet totals per Amsterdam calendar day, so
+# period overviews sum a few dozen rows instead of loading every order.
+# Rows are always recomputed from the orders table rather than patched with
+# deltas: for an order's day after every insert, edit or cancel, and for any
+# range through rebuild_daily_revenue() / POST /admin/revenue.
+# Cancelled orders only count towards the cancelled_* columns.
+REVENUE_METHODS = ('pin', 'online', 'contant', 'rekening')
+REVENUE_FIELDS = (
+    'order_count', 'total', *REVENUE_METHODS, 'btw_9', 'btw_21', 'korting', 'fooi',
+    'statiegeld', 'bezorgkosten', 'delivery_count', 'cancelled_count', 'cancelled_total',
+)
+REVENUE_COUNTS = ('order_count', 'delivery_count', 'cancelled_count')
+
+
+class DailyRevenue(db.Model):
+    __tablename__ = 'daily_revenue'
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, unique=True, nullable=False)
+    order_count = db.Column(db.Integer, default=0)
+    total = db.Column(db.Float, default=0.0)
+    pin = db.Column(db.Float, default=0.0)
+    online = db.Column(db.Float, default=0.0)
+    contant = db.Column(db.Float, default=0.0)
+    rekening = db.Column(db.Float, default=0.0)
+    btw_9 = db.Column(db.Float, default=0.0)
+    btw_21 = db.Column(db.Float, default=0.0)
+    korting = db.Column(db.Float, default=0.0)
+    fooi = db.Column(db.Float, default=0.0)
+    statiegeld = db.Column(db.Float, default=0.0)
+    bezorgkosten = db.Column(db.Float, default=0.0)
+    delivery_count = db.Column(db.Integer, default=0)
+    cancelled_count = db.Column(db.Integer, default=0)
+    cancelled_total = db.Column(db.Float, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return dict({f: getattr(self, f) or 0 for f in REVENUE_FIELDS}, date=self.date.isoformat())
+
+
+def fold_daily_revenue(rows) -> dict:
+    """Sum slim order rows (see _revenue_rows) into ``{nl_date: fields}``."""
+    days = {}
+    for created_at, totaal, method, btw_9, btw_21, korting, fooi, statiegeld, bezorg, cancelled in rows:
+        day = to_nl(created_at).date()
+        r = days.get(day)
+        if r is None:
+            r = days[day] = dict.fromkeys(REVENUE_FIELDS, 0)
+        totaal = float(totaal or 0)
+        if cancelled:
+            r['cancelled_count'] += 1
+            r['cancelled_total'] += totaal
+            continue
+        r['order_count'] += 1
+        r['total'] += totaal
+        method = (method or '').lower()
+        for key in REVENUE_METHODS:
+            if key in method:
+                r[key] += totaal
+        r['btw_9'] += float(btw_9 or 0)
+        r['btw_21'] += float(btw_21 or 0)
+        r['korting'] += float(korting or 0)
+        r['fooi'] += float(fooi or 0)
+        r['statiegeld'] += float(statiegeld or 0)
+        bezorg = float(bezorg or 0)
+        r['bezorgkosten'] += bezorg
+        if bezorg > 0:
+            r['delivery_count'] += 1
+    for r in days.values():
+        for key, value in r.items():
+            if isinstance(value, float):
+                r[key] = round(value, 2)
+    return days
+
+
+def _revenue_rows(first, last):
+    start, end = nl_day_bounds(first, last)
+    return db.session.query(
+        Order.created_at, Order.totaal, Order.payment_method, Order.btw_9, Order.btw_21,
+        Order.discountAmount, Order.fooi, Order.statiegeld,
+        func.coalesce(Order.bezorging, Order.bezorgkosten), Order.is_cancelled,
+    ).filter(Order.created_at >= start, Order.created_at < end)
+
+
+def rebuild_daily_revenue(first, last=None) -> int:
+    """Recompute daily_revenue for the NL dates first..last and commit.
+
+    Days without orders lose their row. Returns the number of rows written.
+    """
+    last = first if last is None else last
+    days = fold_daily_revenue(_revenue_rows(first, last))
+    table = DailyRevenue.__table__
+    empty = DailyRevenue.query.filter(DailyRevenue.date >= first, DailyRevenue.date <= last)
+    if days:
+        empty = empty.filter(DailyRevenue.date.notin_(list(days)))
+    empty.delete(synchronize_session=False)
+    if days:
+        stmt = _insert_for_dialect()(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['date'],
+            set_={f: stmt.excluded[f] for f in (*REVENUE_FIELDS, 'updated_at')},
+        )
+        now = datetime.utcnow()
+        db.session.execute(stmt, [dict(r, date=day, updated_at=now) for day, r in days.items()])
+    db.session.commit()
+    return len(days)
+
+
+def revenue_summary(first, last=None) -> dict:
+    """daily_revenue fields summed over the NL dates first..last."""
+    last = first if last is None else last
+    row = db.session.query(
+        *[func.coalesce(func.sum(getattr(DailyRevenue, f)), 0) for f in REVENUE_FIELDS]
+    ).filter(DailyRevenue.date >= first, DailyRevenue.date <= last).one()
+    return {f: round(v, 2) if isinstance(v, float) else v for f, v in zip(REVENUE_FIELDS, row)}
+
+
+def _refresh_revenue_for(ids):
+    days = {to_nl(c).date() for (c,) in db.session.query(Order.created_at).filter(Order.id.in_(ids))}
+    for day in sorted(days):
+        rebuild_daily_revenue(day)
+
+
+def revenue_totals(*criteria) -> dict:
+    """REVENUE_FIELDS for the orders matching ``criteria`` in one query.
+
+    Each field is a SUM(CASE ...) over the same scan, so any period comes
+    back as a single row; used where daily_revenue cannot answer.
+    """
+    cancelled = Order.is_cancelled == True
+    live = or_(Order.is_cancelled.is_(None), Order.is_cancelled == False)
+    method = func.lower(Order.payment_method)
+    totaal = func.coalesce(Order.totaal, 0)
+    bezorg = func.coalesce(Order.bezorging, Order.bezorgkosten, 0)
+
+    def amount(value, *conds):
+        return func.coalesce(func.sum(case((and_(live, *conds), func.coalesce(value, 0)), else_=0)), 0)
+
+    def count(*conds):
+        return func.coalesce(func.sum(case((and_(*conds), 1), else_=0)), 0)
+
+    columns = {
+        'order_count': count(live),
+        'total': amount(totaal),
+        **{key: amount(totaal, method.contains(key)) for key in REVENUE_METHODS},
+        'btw_9': amount(Order.btw_9),
+        'btw_21': amount(Order.btw_21),
+        'korting': amount(Order.discountAmount),
+        'fooi': amount(Order.fooi),
+        'statiegeld': amount(Order.statiegeld),
+        'bezorgkosten': amount(bezorg),
+        'delivery_count': count(live, bezorg > 0),
+        'cancelled_count': count(cancelled),
+        'cancelled_total': func.coalesce(func.sum(case((cancelled, totaal), else_=0)), 0),
+    }
+    row = db.session.query(*[c.label(k) for k, c in columns.items()]).filter(*criteria).one()
+    return {f: round(float(v), 2) if f not in REVENUE_COUNTS else int(v) for f, v in zip(columns, row)}
+
+
+def period_revenue(first, last=None) -> dict:
+    """Totals for the NL dates first..last.
+
+    Closed days come from daily_revenue; today is still changing, so its
+    share is read live with revenue_totals().
+    """
+    last = first if last is None else last
+    today = datetime.now(NL_TZ).date()
+    closed_last = min(last, today - timedelta(days=1))
+    if first <= closed_last:
+        totals = revenue_summary(first, closed_last)
+    else:
+        totals = dict.fromkeys(REVENUE_FIELDS, 0)
+    if first <= today <= last:
+        live = revenue_totals(created_between(today))
+        totals = {f: round(totals[f] + live[f], 2) for f in REVENUE_FIELDS}
+    return totals
+
+
+def refresh_revenue(orders):
+    """Queue a daily_revenue rebuild for the days of committed orders."""
+    ids = order_ids(orders)
+    if ids:
+        defer(_refresh_revenue_for, ids)
+
+
 class Setting(db.Model):
     __tablename__ = 'settings'
     key = db.Column(db.String(50), primary_key=True)
@@ -716,106 +1322,293 @@ class XbentoOption(db.Model):
     price = db.Column(db.Float, default=0.0)
 
 
+class TimeSlot(db.Model):
+    __tablename__ = 'time_slots'
+    __table_args__ = (db.UniqueConstraint('slot_type', 'slot', name='uq_time_slots_type_slot'),)
+    id = db.Column(db.Integer, primary_key=True)
+    slot_type = db.Column(db.String(10), nullable=False)  # pickup, delivery
+    slot = db.Column(db.String(5), nullable=False)  # HH:MM
+    status = db.Column(db.String(20))  # closed, full; NULL while open
+    capacity = db.Column(db.Integer)  # orders per day; NULL for no limit
+    booked = db.Column(db.Integer, default=0, nullable=False)
+    booked_date = db.Column(db.Date)  # NL day that ``booked`` counts
+
+
+class ItemAvailability(db.Model):
+    __tablename__ = 'item_availability'
+    key = db.Column(db.String(60), primary_key=True)
+    name = db.Column(db.String(100))
+    menu_item_id = db.Column(db.Integer, db.ForeignKey('menu_items.id'))
+    sold_out = db.Column(db.Boolean, default=False, nullable=False)
+
+
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_versions'
+    name = db.Column(db.String(30), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+
+# ----- Settings registry -----
+# Every known setting with its type and the default seeded at startup. Values
+# are stored as strings; parse_setting() turns them into Python values:
+#   bool  -> True/False          time  -> minutes since midnight
+#   int   -> int                 price -> float
+#   days  -> frozenset of names  json  -> dict
+#   str   -> str
+# 'price' settings have their own endpoints and are not part of the
+# /dashboard/update form.
+SETTINGS_REGISTRY = {
+    'is_open': ('bool', 'true'),
+    'open_time': ('time', '11:00'),
+    'close_time': ('time', '21:00'),
+    'closed_days': ('days', ''),
+    'pickup_enabled': ('bool', 'true'),
+    'delivery_enabled': ('bool', 'true'),
+    'pickup_start': ('time', '11:00'),
+    'pickup_end': ('time', '21:00'),
+    'pickup_address': ('str', ''),
+    'delivery_start': ('time', '11:00'),
+    'delivery_end': ('time', '21:00'),
+    'delivery_postcodes': ('str', ''),
+    'time_interval': ('int', '15'),
+    'slot_max_orders': ('int', '0'),  # 0 = no automatic limit
+    'slot_max_items': ('int', '0'),
+    'show_zsm_option': ('bool', 'true'),
+    'milktea_soldout': ('bool', 'false'),
+    'milktea_price': ('price', '5'),
+    'price_zalm_crispy_rice_sandwich': ('price', '7'),
+    'price_spicytuna_crispy_rice_sandwich': ('price', '7'),
+    'price_ebi_crispy_rice_sandwich': ('price', '7'),
+    'price_beef_crispy_rice_sandwich': ('price', '7.5'),
+    'price_california_crispy_rice_sandwich': ('price', '7.5'),
+    'price_chicken_crispy_rice_sandwich': ('price', '7'),
+}
+
+
+# Items that can be marked sold out, keyed by their availability key, with the
+# cart name the storefront uses for them (None when it has no fixed name).
+# The flags live in the item_availability table, not in settings; browsers
+# still see them as 'soldout_<key>' settings.
+SOLDOUT_ITEMS = {
+    'japans_chicken_bento': 'Japans Chicken Bento',
+    'korean_chicken_bento': 'Korean Chicken Bento',
+    'korean_beef_bento': 'Korean Beef Bento',
+    'meatlover_bento': 'Meatlover Bento',
+    'zalm_lover_bento': 'Zalm Lover Bento',
+    'ebi_lover_bento': 'Ebi Lover Bento',
+    'surf_turf_bento': 'Surf & Turf Bento',
+    'dimsum_bento': 'Dimsum Bento',
+    'lamskotelet_bento': 'Lamskotelet Bento',
+    'unagi_bento': 'Unagi Bento',
+    'veggie_bento': 'Veggie Bento',
+    'sushi_bento': 'Bento Sushi Omakase',
+    'salmon_roll': 'Salmon Roll Omakase',
+    'dragon_roll': 'Dragon Roll Omakase',
+    'beef_roll': 'Beef Roll Omakase',
+    'chicken_roll': 'Chicken Roll Omakase',
+    'nigiri_box': 'Nigiri Box Omakase',
+    'salmon_sashimi': 'Salmon sashimi',
+    'flamed_salmon_sashimi': 'Flamed salmon sashimi',
+    'tonijn_sashimi': 'Tonijn sashimi',
+    'flamed_tonijn_sashimi': 'Flamed tonijn sashimi',
+    'beef_sashimi': 'Beef sashimi',
+    'zalm_crispy_rice_sandwich': 'Zalm crispy rice sandwich',
+    'spicytuna_crispy_rice_sandwich': None,
+    'ebi_crispy_rice_sandwich': 'Ebi crispy rice sandwich',
+    'beef_crispy_rice_sandwich': 'Beef crispy rice sandwich',
+    'california_crispy_rice_sandwich': 'California crispy rice sandwich',
+    'chicken_crispy_rice_sandwich': 'Chicken crispy rice sandwich',
+    'xbento': 'Xbento',
+    'zalm_bowl': 'Zalm Bowl',
+    'tuna_bowl': 'Tuna Bowl',
+    'ebi_fry_bowl': 'Ebi Fry Bowl',
+    'chicken_karaage_bowl': 'Chicken Karaage Bowl',
+    'spicy_chicken_bowl': 'Spicy Chicken Bowl',
+    'teriyaki_chicken_bowl': 'Teriyaki Chicken Bowl',
+    'teriyaki_beef_bowl': 'Teriyaki Beef Bowl',
+    'california_bowl': 'California Bowl',
+    'vega_bowl': 'Vega Bowl',
+    'meatlover_bowl': 'Meatlover Bowl',
+    'rainbow_bowl': 'Rainbow Bowl',
+    'spicy_tuna_bowl': 'Spicy Tuna Bowl',
+    'flamed_zalm_bowl': 'Flamed Zalm Bowl',
+    'flamed_tuna_bowl': 'Flamed Tuna Bowl',
+    'x_bowl': None,
+    'ebi_ramen': 'Ebi Furai',
+    'chicken_ramen': 'Chicken',
+    'beef_ramen': 'Beef',
+    'ribeye_ramen': 'Ribeye',
+    'chasiu_ramen': 'Chasiu',
+    'karaage': 'Karaage',
+    'ebi_fry': 'Ebi Fry',
+    'spicy_crispy_chicken': 'Spicy Crispy Chicken',
+    'chicken_loempia': 'Chicken Loempia',
+    'gyoza': 'Gyoza',
+    'inktvis_ringen': 'Inktvis Ringen',
+    'sesambal': 'Sesambal – 5 st',
+    'yakitori': 'Yakitori',
+    'mini_loempia': 'Mini Loempia',
+    'edamame': 'Edamame',
+    'kimchi_komkommer': 'Kimchi Komkommer',
+    'kimchi_kool': 'Kimchi Kool',
+    'zeewiersalade': 'Zeewiersalade',
+    'mochi_mango': 'Mochi Mango',
+    'mochi_aardbei': 'Mochi Aardbei',
+    'mochi_matcha': 'Mochi Matcha',
+    'mochi_pistachio': 'Mochi Pistachio',
+    'cola': 'Cola',
+    'cola_zero': 'Cola Zero',
+    'spa_blauw': 'Spa Blauw',
+    'spa_rood': 'Spa Rood',
+    'red_bull': 'Red Bull',
+}
+
+def _parse_bool(raw, default):
+    val = str(raw).strip().lower()
+    if val == 'true':
+        return True
+    if val == 'false':
+        return False
+    return str(default).lower() == 'true'
+
+
+def parse_setting(key: str, raw):
+    """Convert a stored setting string into its registered Python type."""
+    kind, default = SETTINGS_REGISTRY.get(key, ('str', None))
+    if raw is None:
+        raw = default
+    if kind == 'str' or raw is None:
+        return raw
+    if kind == 'bool':
+        return _parse_bool(raw, default)
+    try:
+        if kind == 'time':
+            return _parse_minutes(raw)
+        if kind == 'int':
+            return int(raw)
+        if kind == 'price':
+            return float(raw)
+        if kind == 'days':
+            return frozenset(d.strip() for d in raw.split(',') if d.strip())
+        if kind == 'json':
+            return json.loads(raw or '{}')
+    except (TypeError, ValueError):
+        if raw == default:
+            raise
+        return parse_setting(key, default)
+    return raw
+
+
+def format_setting(key: str, value) -> str:
+    """Convert a Python or request value into the string stored for ``key``."""
+    kind, default = SETTINGS_REGISTRY.get(key, ('str', None))
+    if kind == 'bool':
+        return 'true' if _parse_bool(value, default) else 'false'
+    if kind == 'json' and not isinstance(value, str):
+        return json.dumps(value or {})
+    if kind == 'days' and not isinstance(value, str):
+        return ','.join(value)
+    return '' if value is None else str(value)
+
+
+def _insert_for_dialect():
+    if db.engine.dialect.name == 'sqlite':
+        return sqlite_insert
+    return pg_insert
+
+
+def upsert_settings(values: dict, overwrite: bool = True):
+    """Write ``{key: value}`` pairs with a single INSERT ... ON CONFLICT.
+
+    With ``overwrite=False`` existing rows are left untouched, which is how
+    the startup defaults are seeded. The caller commits.
+    """
+    if not values:
+        return
+    insert = _insert_for_dialect()
+    rows = [{'key': k, 'value': format_setting(k, v)} for k, v in values.items()]
+    stmt = insert(Setting.__table__).values(rows)
+    if overwrite:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['key'], set_={'value': stmt.excluded.value}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=['key'])
+    db.session.execute(stmt)
+
+
 with app.app_context():
     db.create_all()
-    defaults = {
-        "is_open": "true",
-        "open_time": "11:00",
-        "close_time": "21:00",
-        "closed_days": "",
-        "pickup_enabled": "true",
-        "delivery_enabled": "true",
-        "pickup_start": "11:00",
-        "pickup_end": "21:00",
-        "delivery_start": "11:00",
-        "delivery_end": "21:00",
-        "time_interval": "15",
-        "show_zsm_option": "true",
-        "milktea_soldout": "false",
-        "milktea_price": "5",
-        "price_zalm_crispy_rice_sandwich": "7",
-        "price_spicytuna_crispy_rice_sandwich": "7",
-        "price_ebi_crispy_rice_sandwich": "7",
-        "price_beef_crispy_rice_sandwich": "7.5",
-        "price_california_crispy_rice_sandwich": "7.5",
-        "price_chicken_crispy_rice_sandwich": "7",
-        "soldout_japans_chicken_bento": "false",
-        "soldout_korean_chicken_bento": "false",
-        "soldout_korean_beef_bento": "false",
-        "soldout_meatlover_bento": "false",
-        "soldout_zalm_lover_bento": "false",
-        "soldout_ebi_lover_bento": "false",
-        "soldout_surf_turf_bento": "false",
-        "soldout_dimsum_bento": "false",
-        "soldout_lamskotelet_bento": "false",
-        "soldout_unagi_bento": "false",
-        "soldout_veggie_bento": "false",
-        "soldout_sushi_bento": "false",
-        "soldout_salmon_roll": "false",
-        "soldout_dragon_roll": "false",
-        "soldout_beef_roll": "false",
-        "soldout_chicken_roll": "false",
-        "soldout_nigiri_box": "false",
-        "soldout_salmon_sashimi": "false",
-        "soldout_flamed_salmon_sashimi": "false",
-        "soldout_tonijn_sashimi": "false",
-        "soldout_flamed_tonijn_sashimi": "false",
-        "soldout_beef_sashimi": "false",
-        "soldout_zalm_crispy_rice_sandwich": "false",
-        "soldout_spicytuna_crispy_rice_sandwich": "false",
-        "soldout_ebi_crispy_rice_sandwich": "false",
-        "soldout_beef_crispy_rice_sandwich": "false",
-        "soldout_california_crispy_rice_sandwich": "false",
-        "soldout_chicken_crispy_rice_sandwich": "false",
-        "soldout_xbento": "false",
-        "soldout_zalm_bowl": "false",
-        "soldout_tuna_bowl": "false",
-        "soldout_ebi_fry_bowl": "false",
-        "soldout_chicken_karaage_bowl": "false",
-        "soldout_spicy_chicken_bowl": "false",
-        "soldout_teriyaki_chicken_bowl": "false",
-        "soldout_teriyaki_beef_bowl": "false",
-        "soldout_california_bowl": "false",
-        "soldout_vega_bowl": "false",
-        "soldout_meatlover_bowl": "false",
-        "soldout_rainbow_bowl": "false",
-        "soldout_spicy_tuna_bowl": "false",
-        "soldout_flamed_zalm_bowl": "false",
-        "soldout_flamed_tuna_bowl": "false",
-        "soldout_x_bowl": "false",
-        "soldout_ebi_ramen": "false",
-        "soldout_chicken_ramen": "false",
-        "soldout_beef_ramen": "false",
-        "soldout_ribeye_ramen": "false",
-        "soldout_chasiu_ramen": "false",
-        "soldout_karaage": "false",
-        "soldout_ebi_fry": "false",
-        "soldout_spicy_crispy_chicken": "false",
-        "soldout_chicken_loempia": "false",
-        "soldout_gyoza": "false",
-        "soldout_inktvis_ringen": "false",
-        "soldout_sesambal": "false",
-        "soldout_yakitori": "false",
-        "soldout_mini_loempia": "false",
-        "soldout_edamame": "false",
-        "soldout_kimchi_komkommer": "false",
-        "soldout_kimchi_kool": "false",
-        "soldout_zeewiersalade": "false",
-        "soldout_mochi_mango": "false",
-        "soldout_mochi_aardbei": "false",
-        "soldout_mochi_matcha": "false",
-        "soldout_mochi_pistachio": "false",
-        "soldout_cola": "false",
-        "soldout_cola_zero": "false",
-        "soldout_spa_blauw": "false",
-        "soldout_spa_rood": "false",
-        "soldout_red_bull": "false",
+    upsert_settings(
+        {k: default for k, (kind, default) in SETTINGS_REGISTRY.items()},
+        overwrite=False,
+    )
+
+    # Sold-out flags used to be 'soldout_<key>' settings rows; move any that
+    # are left into item_availability and drop them from settings.
+    legacy = {
+        s.key[len('soldout_'):]: s.value == 'true'
+        for s in Setting.query.filter(Setting.key.startswith('soldout_', autoescape=True))
     }
-    for k, v in defaults.items():
-        if not Setting.query.filter_by(key=k).first():
-            db.session.add(Setting(key=k, value=v))
+    avail_keys = list(SOLDOUT_ITEMS) + [k for k in legacy if k not in SOLDOUT_ITEMS]
+    menu_ids = {
+        m.name: m.id
+        for m in MenuItem.query.filter(MenuItem.name.in_([n for n in SOLDOUT_ITEMS.values() if n]))
+    }
+    insert = _insert_for_dialect()
+    db.session.execute(
+        insert(ItemAvailability.__table__).values([
+            {
+                'key': k,
+                'name': SOLDOUT_ITEMS.get(k),
+                'menu_item_id': menu_ids.get(SOLDOUT_ITEMS.get(k)),
+                'sold_out': legacy.get(k, False),
+            }
+            for k in avail_keys
+        ]).on_conflict_do_nothing(index_elements=['key'])
+    )
+    if legacy:
+        Setting.query.filter(
+            Setting.key.startswith('soldout_', autoescape=True)
+        ).delete(synchronize_session=False)
+    db.session.commit()
+
+    # Closed slots used to be JSON maps in the '<type>_closed_slots' settings.
+    legacy_slots = Setting.query.filter(
+        Setting.key.in_(['pickup_closed_slots', 'delivery_closed_slots'])
+    ).all()
+    slot_rows = []
+    for s in legacy_slots:
+        try:
+            closed = json.loads(s.value or '{}')
+        except ValueError:
+            closed = {}
+        slot_type = s.key[:-len('_closed_slots')]
+        slot_rows += [
+            {'slot_type': slot_type, 'slot': slot, 'status': status, 'booked': 0}
+            for slot, status in closed.items()
+        ]
+    if slot_rows:
+        db.session.execute(
+            insert(TimeSlot.__table__).values(slot_rows)
+            .on_conflict_do_nothing(index_elements=['slot_type', 'slot'])
+        )
+    for s in legacy_slots:
+        db.session.delete(s)
     db.session.commit()
 
+    converted = backfill_order_items()
+    if converted:
+        print(f"✅ order_items backfilled for {converted} orders")
+    converted = backfill_order_totals()
+    if converted:
+        print(f"✅ subtotal/bezorging backfilled for {converted} orders")
+    if DailyRevenue.query.first() is None:
+        first_order = db.session.query(func.min(Order.created_at)).scalar()
+        if first_order is not None:
+            built = rebuild_daily_revenue(to_nl(first_order).date(), datetime.now(NL_TZ).date())
+            print(f"✅ daily_revenue built for {built} days")
+
     if BubbleOption.query.count() == 0:
         defaults_base = ['Green Tea', 'Milk Tea', 'Milkshake']
         defaults_smaak = ['Mango', 'Appel', 'Matcha', 'Brown Sugar']
@@ -829,6 +1622,831 @@ with app.app_context():
         db.session.commit()
 
 
+# ----- Settings cache -----
+# One worker serves every request, so a process-wide copy of the settings
+# table is enough. Writers bump the version after committing; the next read
+# reloads the whole table with a single query.
+_settings_cache = {'version': 0, 'loaded': -1, 'values': {}, 'typed': {}}
+
+
+def bump_settings_version():
+    """Mark the cached settings as stale after a committed write."""
+    _settings_cache['version'] += 1
+    bump_content_version('settings')
+
+
+def get_settings() -> dict:
+    """Return all settings as ``{key: value}``, reloading only when stale.
+
+    The returned dict is shared; callers that need to modify it must copy it.
+    """
+    cache = _settings_cache
+    version = cache['version']
+    if cache['loaded'] != version:
+        values = {s.key: s.value for s in Setting.query.all()}
+        cache['values'] = values
+        cache['typed'] = {k: parse_setting(k, values.get(k)) for k in SETTINGS_REGISTRY}
+        cache['loaded'] = version
+    return cache['values']
+
+
+def get_typed_settings() -> dict:
+    """Like get_settings() but with registry keys parsed by parse_setting()."""
+    get_settings()
+    return _settings_cache['typed']
+
+
+# ----- Availability -----
+# Sold-out keys are kept in memory as a set, loaded with one query. Toggles
+# update the table row and the set directly, so checks never hit the DB;
+# a failed commit drops the set so it is reloaded from the table.
+_availability = {'loaded': False, 'sold_out': set(), 'names': {}, 'sold_out_names': frozenset()}
+
+
+def _availability_state() -> dict:
+    state = _availability
+    if not state['loaded']:
+        rows = db.session.query(
+            ItemAvailability.key, ItemAvailability.name, ItemAvailability.sold_out
+        ).all()
+        state['names'] = {key: name for key, name, _ in rows}
+        state['sold_out'] = {key for key, _, sold_out in rows if sold_out}
+        state['sold_out_names'] = frozenset(
+            state['names'][k] for k in state['sold_out'] if state['names'].get(k)
+        )
+        state['loaded'] = True
+    return state
+
+
+def sold_out_keys() -> set:
+    """Availability keys that are currently sold out."""
+    return _availability_state()['sold_out']
+
+
+def sold_out_names() -> frozenset:
+    """Cart names of the items that are currently sold out."""
+    return _availability_state()['sold_out_names']
+
+
+def reset_availability():
+    """Drop the in-memory sold-out set after a failed commit."""
+    _availability['loaded'] = False
+    bump_content_version('settings')
+
+
+def set_sold_out(flags: dict) -> dict:
+    """Apply ``{key: bool}`` sold-out flags and return the ones that flipped.
+
+    Only flipped rows are written. The result uses the browser wire format
+    ``{'soldout_<key>': 'true' | 'false'}``. The caller commits, and calls
+    reset_availability() if that fails.
+    """
+    state = _availability_state()
+    current = state['sold_out']
+    on = [k for k, v in flags.items() if v and k not in current]
+    off = [k for k, v in flags.items() if not v and k in current]
+    table = ItemAvailability.__table__
+    if on:
+        insert = _insert_for_dialect()
+        stmt = insert(table).values(
+            [{'key': k, 'name': SOLDOUT_ITEMS.get(k), 'sold_out': True} for k in on]
+        )
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['key'], set_={'sold_out': True}
+        ))
+    if off:
+        db.session.execute(table.update().where(table.c.key.in_(off)).values(sold_out=False))
+    for k in on:
+        current.add(k)
+        state['names'].setdefault(k, SOLDOUT_ITEMS.get(k))
+    current.difference_update(off)
+    state['sold_out_names'] = frozenset(
+        state['names'][k] for k in current if state['names'].get(k)
+    )
+    changed = {f'soldout_{k}': 'true' for k in on}
+    changed.update({f'soldout_{k}': 'false' for k in off})
+    if changed:
+        bump_content_version('settings')
+    return changed
+
+
+# ----- Time slots -----
+# time_slots has one row per (slot_type, slot). Closures are cached in memory
+# as {'pickup': {slot: status}, 'delivery': {...}} and changed row by row,
+# capacities as {(slot_type, slot): capacity}; reservations are a single
+# conditional upsert on the unique index, for slots with a capacity only.
+SLOT_TYPES = ('pickup', 'delivery')
+_slots = {'loaded': False, 'closed': {t: {} for t in SLOT_TYPES}, 'capacity': {}}
+
+
+def _slot_state() -> dict:
+    if not _slots['loaded']:
+        closed = {t: {} for t in SLOT_TYPES}
+        capacity = {}
+        rows = db.session.query(
+            TimeSlot.slot_type, TimeSlot.slot, TimeSlot.status, TimeSlot.capacity
+        ).filter(or_(TimeSlot.status.isnot(None), TimeSlot.capacity.isnot(None)))
+        for t, slot, status, cap in rows:
+            if status is not None:
+                closed.setdefault(t, {})[slot] = status
+            if cap is not None:
+                capacity[(t, slot)] = cap
+        _slots.update(closed=closed, capacity=capacity, loaded=True)
+    return _slots
+
+
+def closed_slots(slot_type: str) -> dict:
+    """Return ``{slot: status}`` for the closed slots of ``slot_type``."""
+    return _slot_state()['closed'][slot_type]
+
+
+def slot_capacity(slot_type: str, slot: str):
+    """Orders per day allowed in ``slot``, or None when it has no limit."""
+    return _slot_state()['capacity'].get((slot_type, slot))
+
+
+def set_slot_statuses(slot_type: str, statuses: dict, connection=None):
+    """Set ``{slot: status}`` for ``slot_type``; a None status reopens the slot.
+
+    Only the given rows are touched, on ``connection`` or the request
+    session. The caller commits.
+    """
+    if not statuses:
+        return
+    closed = closed_slots(slot_type)
+    table = TimeSlot.__table__
+    insert = _insert_for_dialect()
+    stmt = insert(table).values([
+        {'slot_type': slot_type, 'slot': slot, 'status': status, 'booked': 0}
+        for slot, status in statuses.items()
+    ])
+    (connection or db.session).execute(stmt.on_conflict_do_update(
+        index_elements=['slot_type', 'slot'], set_={'status': stmt.excluded.status}
+    ))
+    for slot, status in statuses.items():
+        if status:
+            closed[slot] = status
+        else:
+            closed.pop(slot, None)
+    bump_content_version('settings')
+
+
+def replace_closed_slots(slot_type: str, mapping: dict) -> bool:
+    """Make the closed slots of ``slot_type`` equal ``mapping``.
+
+    Writes only the slots that differ and returns whether anything changed.
+    """
+    current = closed_slots(slot_type)
+    changes = {slot: None for slot in current if slot not in mapping}
+    changes.update({slot: status for slot, status in mapping.items() if current.get(slot) != status})
+    set_slot_statuses(slot_type, changes)
+    return bool(changes)
+
+
+def set_slot_capacity(slot_type: str, slot: str, capacity):
+    """Limit ``slot`` to ``capacity`` orders per day (None removes the limit)."""
+    table = TimeSlot.__table__
+    insert = _insert_for_dialect()
+    stmt = insert(table).values(slot_type=slot_type, slot=slot, capacity=capacity, booked=0)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['slot_type', 'slot'], set_={'capacity': stmt.excluded.capacity}
+    ))
+    capacities = _slot_state()['capacity']
+    if capacity is None:
+        capacities.pop((slot_type, slot), None)
+    else:
+        capacities[(slot_type, slot)] = capacity
+
+
+def reserve_slot(slot_type: str, slot: str, day) -> bool:
+    """Count one order against ``slot`` on ``day`` if it is open and not full.
+
+    One upsert on the (slot_type, slot) index; the conflict branch only
+    fires while the row is open and below capacity, so concurrent orders
+    cannot overbook. Runs in the caller's transaction; callers skip it for
+    slots without a capacity, where the row lock buys nothing.
+    """
+    table = TimeSlot.__table__
+    insert = _insert_for_dialect()
+    same_day = table.c.booked_date == day
+    stmt = insert(table).values(slot_type=slot_type, slot=slot, booked=1, booked_date=day)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['slot_type', 'slot'],
+        set_={
+            'booked': case((same_day, table.c.booked + 1), else_=1),
+            'booked_date': day,
+        },
+        where=and_(
+            table.c.status.is_(None),
+            or_(
+                table.c.capacity.is_(None),
+                table.c.booked_date.is_(None),
+                table.c.booked_date != day,
+                table.c.booked < table.c.capacity,
+            ),
+        ),
+    ).returning(table.c.id)
+    return db.session.execute(stmt).first() is not None
+
+
+def book_slot(slot_type: str, slot: str, day, delta: int):
+    """Move the booked counter of ``slot`` on ``day`` by ``delta`` without a capacity check.
+
+    Used for orders that did not go through reserve_slot() and for
+    cancellations. Runs in the caller's transaction.
+    """
+    table = TimeSlot.__table__
+    if delta < 0:
+        db.session.execute(table.update().where(
+            table.c.slot_type == slot_type, table.c.slot == slot,
+            table.c.booked_date == day, table.c.booked > 0,
+        ).values(booked=case((table.c.booked + delta > 0, table.c.booked + delta), else_=0)))
+        return
+    insert = _insert_for_dialect()
+    stmt = insert(table).values(slot_type=slot_type, slot=slot, booked=delta, booked_date=day)
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['slot_type', 'slot'],
+        set_={
+            'booked': case((table.c.booked_date == day, table.c.booked + delta), else_=delta),
+            'booked_date': day,
+        },
+    ))
+
+
+# ----- Slot throttling -----
+# Orders and items per slot for the current NL day live in memory, seeded
+# from the orders table once per day. A slot that reaches 'slot_max_orders'
+# or 'slot_max_items' is closed with status 'auto'; the next day's seed
+# reopens it. time_slots.booked follows the same orders: record/release
+# move it along with the counters and every seed rewrites it, in a
+# transaction of its own so a reseed never commits request work.
+SLOT_AUTO_STATUS = 'auto'
+SLOT_SEED_LOCK_TIMEOUT = '2s'
+_slot_load = {'day': None, 'counts': {}}
+
+
+def _order_slot(order_type, pickup_time, delivery_time):
+    """Return the (slot_type, slot) an order books, or None for Z.S.M."""
+    if order_type == 'afhalen':
+        slot_type, slot = 'pickup', pickup_time
+    else:
+        slot_type, slot = 'delivery', delivery_time
+    if not slot or ':' not in slot:
+        return None
+    return slot_type, slot
+
+
+def _item_count(items) -> int:
+    if isinstance(items, str):
+        try:
+            items = json.loads(items or '{}')
+        except ValueError:
+            return 0
+    try:
+        return sum(int(i.get('qty', 0)) for i in (items or {}).values())
+    except (AttributeError, TypeError, ValueError):
+        return 0
+
+
+def _slot_over_limit(load) -> bool:
+    settings = get_typed_settings()
+    max_orders, max_items = settings['slot_max_orders'], settings['slot_max_items']
+    return bool((max_orders and load[0] >= max_orders) or (max_items and load[1] >= max_items))
+
+
+def seed_slot_load(connection, day=None) -> dict:
+    """Rebuild the counters for ``day`` from one query over its orders.
+
+    time_slots.booked is rewritten, stale 'auto' closures are reopened and
+    slots already over the limit are closed, all on ``connection``, which
+    the caller commits. Returns the changed closed-slot maps.
+    """
+    day = day or datetime.now(NL_TZ).date()
+    rows = connection.execute(
+        db.select(Order.order_type, Order.pickup_time, Order.delivery_time, Order.items)
+        .where(created_between(day), Order.is_cancelled == False)
+    )
+    counts = {}
+    for order_type, pickup_time, delivery_time, items in rows:
+        key = _order_slot(order_type, pickup_time, delivery_time)
+        if key:
+            load = counts.setdefault(key, [0, 0])
+            load[0] += 1
+            load[1] += _item_count(items)
+    _slot_load.update(day=day, counts=counts)
+    table = TimeSlot.__table__
+    connection.execute(table.update().where(table.c.booked_date == day).values(booked=0))
+    if counts:
+        insert = _insert_for_dialect()
+        stmt = insert(table).values([
+            {'slot_type': slot_type, 'slot': slot, 'booked': load[0], 'booked_date': day}
+            for (slot_type, slot), load in counts.items()
+        ])
+        connection.execute(stmt.on_conflict_do_update(
+            index_elements=['slot_type', 'slot'],
+            set_={'booked': stmt.excluded.booked, 'booked_date': stmt.excluded.booked_date},
+        ))
+    return apply_slot_limits(connection)
+
+
+def apply_slot_limits(connection=None) -> dict:
+    """Match the 'auto' closures to the counters and the current limits.
+
+    Returns the changed closed-slot maps; the caller commits ``connection``
+    or the request session.
+    """
+    counts = _slot_load['counts']
+    changes = {}
+    for slot_type in SLOT_TYPES:
+        closed = closed_slots(slot_type)
+        statuses = {
+            slot: None for slot, status in closed.items()
+            if status == SLOT_AUTO_STATUS and not _slot_over_limit(counts.get((slot_type, slot), (0, 0)))
+        }
+        statuses.update({
+            slot: SLOT_AUTO_STATUS for (t, slot), load in counts.items()
+            if t == slot_type and slot not in closed and _slot_over_limit(load)
+        })
+        set_slot_statuses(slot_type, statuses, connection)
+        if statuses:
+            changes[f'{slot_type}_closed_slots'] = closed_slots(slot_type)
+    return changes
+
+
+def reseed_slot_load() -> dict:
+    """Run seed_slot_load() in its own transaction, never the request's.
+
+    On Postgres the transaction gives up after SLOT_SEED_LOCK_TIMEOUT
+    instead of waiting on a time_slots row this request already locked.
+    """
+    try:
+        with db.engine.begin() as conn:
+            if conn.dialect.name == 'postgresql':
+                conn.execute(text(f"SET LOCAL lock_timeout = '{SLOT_SEED_LOCK_TIMEOUT}'"))
+            return seed_slot_load(conn)
+    except Exception:
+        reset_slot_state()
+        raise
+
+
+def _slot_counts() -> dict:
+    """Today's ``{(slot_type, slot): [orders, items]}``, reseeded after midnight."""
+    if _slot_load['day'] != datetime.now(NL_TZ).date():
+        changes = reseed_slot_load()
+        if changes:
+            emit_settings_delta(extra=changes)
+    return _slot_load['counts']
+
+
+def reset_slot_state():
+    """Drop the in-memory slot closures and counters after a failed commit."""
+    _slots['loaded'] = False
+    _slot_load['day'] = None
+    bump_content_version('settings')
+
+
+def slot_is_full(slot_type: str, slot: str) -> bool:
+    return _slot_over_limit(_slot_counts().get((slot_type, slot), (0, 0)))
+
+
+def record_slot_order(order, reserved=False) -> dict:
+    """Count a stored order against its slot, closing the slot once full.
+
+    ``reserved`` means reserve_slot() already counted it in time_slots.
+    Returns the changed closed-slot map, if any; the caller commits.
+    """
+    key = _order_slot(order.order_type, order.pickup_time, order.delivery_time)
+    if not key:
+        return {}
+    counts = _slot_counts()
+    if order.created_at and to_nl(order.created_at).date() != _slot_load['day']:
+        return {}
+    if not reserved:
+        book_slot(*key, _slot_load['day'], 1)
+    load = counts.setdefault(key, [0, 0])
+    load[0] += 1
+    load[1] += _item_count(order.items)
+    slot_type, slot = key
+    if slot in closed_slots(slot_type) or not _slot_over_limit(load):
+        return {}
+    set_slot_statuses(slot_type, {slot: SLOT_AUTO_STATUS})
+    return {f'{slot_type}_closed_slots': closed_slots(slot_type)}
+
+
+def release_slot_order(order) -> dict:
+    """Undo :func:`record_slot_order` for a cancelled order of today."""
+    key = _order_slot(order.order_type, order.pickup_time, order.delivery_time)
+    if not key:
+        return {}
+    counts = _slot_counts()
+    if not order.created_at or to_nl(order.created_at).date() != _slot_load['day']:
+        return {}
+    book_slot(*key, _slot_load['day'], -1)
+    load = counts.get(key)
+    if not load:
+        return {}
+    load[0] = max(load[0] - 1, 0)
+    load[1] = max(load[1] - _item_count(order.items), 0)
+    slot_type, slot = key
+    if closed_slots(slot_type).get(slot) != SLOT_AUTO_STATUS or _slot_over_limit(load):
+        return {}
+    set_slot_statuses(slot_type, {slot: None})
+    return {f'{slot_type}_closed_slots': closed_slots(slot_type)}
+
+
+with app.app_context():
+    reseed_slot_load()
+
+
+# ----- Opening schedule -----
+# Opening hours, closed days and closed slots compiled into one object.
+# get_order_schedule() rebuilds it only when the 'settings' content version
+# moves, so order validation is integer comparisons and dict lookups.
+_CLOCK_MINUTES = {f'{h:02d}:{m:02d}': h * 60 + m for h in range(24) for m in range(60)}
+
+
+def clock_minutes(value: str):
+    """Return minutes since midnight for 'HH:MM', or None if it is not a time."""
+    minutes = _CLOCK_MINUTES.get(value)
+    if minutes is None and value and ':' in value:
+        try:
+            h, m = map(int, value.split(':'))
+        except ValueError:
+            return None
+        if 0 <= h < 24 and 0 <= m < 60:
+            minutes = h * 60 + m
+    return minutes
+
+
+class OrderSchedule:
+    """When each order type may be placed, compiled from typed settings."""
+
+    CLOSED_MESSAGES = {
+        'pickup': 'Afhalen is gesloten voor vandaag.',
+        'delivery': 'Bezorging is gesloten voor vandaag.',
+    }
+
+    def __init__(self, settings: dict, closed: dict):
+        self.is_open = settings['is_open']
+        self.closed_days = frozenset(settings['closed_days'])
+        self.windows = {
+            'pickup': (settings['pickup_enabled'], settings['pickup_start'], settings['pickup_end']),
+            'delivery': (settings['delivery_enabled'], settings['delivery_start'], settings['delivery_end']),
+        }
+        self.closed = {t: dict(closed[t]) for t in SLOT_TYPES}
+
+    @staticmethod
+    def slot_type(order_type: str) -> str:
+        return 'pickup' if order_type == 'afhalen' else 'delivery'
+
+    def is_open_now(self, order_type: str, now: datetime) -> bool:
+        if not self.is_open or now.strftime('%A') in self.closed_days:
+            return False
+        enabled, start, end = self.windows[self.slot_type(order_type)]
+        if not enabled:
+            return False
+        if start <= end:
+            return now.hour * 60 + now.minute < end
+        return True
+
+    def check_time(self, order_type: str, chosen: str, now: datetime):
+        """Validate an order due at ``chosen`` ('HH:MM', Z.S.M. or empty).
+
+        Returns ``(error, minutes)``: ``error`` is the message to reject the
+        order with or None, ``minutes`` is the parsed time or None.
+        """
+        slot_type = self.slot_type(order_type)
+        _, start, end = self.windows[slot_type]
+        minutes = clock_minutes(chosen) if chosen else None
+        if minutes is not None and minutes < start:
+            return 'Gekozen tijd valt buiten openingstijden.', minutes
+        if minutes is not None and minutes > end:
+            return self.CLOSED_MESSAGES[slot_type], minutes
+        if (now.hour * 60 + now.minute) * 60 + now.second > end * 60:
+            return self.CLOSED_MESSAGES[slot_type], minutes
+        if chosen:
+            closed = self.closed[slot_type]
+            hour_key = f"{chosen.split(':')[0]}:00" if ':' in chosen else None
+            status = closed.get(chosen) or (hour_key and closed.get(hour_key))
+            if status:
+                return ('Tijdslot vol' if status in ['full', 'closed', SLOT_AUTO_STATUS] else 'Tijdslot gesloten'), minutes
+        return None, minutes
+
+
+_schedule = {'version': None, 'schedule': None}
+
+
+def get_order_schedule() -> OrderSchedule:
+    version = _content_versions['settings']
+    if _schedule['version'] != version:
+        closed = {t: closed_slots(t) for t in SLOT_TYPES}
+        _schedule['schedule'] = OrderSchedule(get_typed_settings(), closed)
+        _schedule['version'] = version
+    return _schedule['schedule']
+
+
+# ----- Query accounting -----
+# In debug mode, or with QUERY_COUNT_HEADER=1, every response carries the
+# number of SQL statements it ran in the X-Query-Count header, e.g.
+# ``curl -sI /dashboard | grep X-Query-Count``.
+QUERY_COUNT_HEADER = os.getenv('QUERY_COUNT_HEADER') == '1'
+
+with app.app_context():
+    @event.listens_for(db.engine, 'before_cursor_execute')
+    def _count_query(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context():
+            g.query_count = g.get('query_count', 0) + 1
+
+
+@app.after_request
+def add_query_count_header(response):
+    if app.debug or QUERY_COUNT_HEADER:
+        response.headers['X-Query-Count'] = str(g.get('query_count', 0))
+    return response
+
+
+# ----- Change broadcasts -----
+# Settings changes are pushed as deltas: {'epoch', 'seq', 'changes'}. seq
+# grows by one per broadcast and epoch changes on every restart, so a client
+# that sees a new epoch or a gap in seq asks for a full copy with the
+# 'settings_resync' event instead of trusting its local state.
+_broadcast_state = {'epoch': uuid.uuid4().hex[:8], 'seq': 0}
+
+
+def settings_wire(keys=None) -> dict:
+    """Settings as browsers expect them: raw strings keyed by setting name.
+
+    A full copy (``keys=None``) also includes the closed-slot maps as
+    '<type>_closed_slots' objects and lists every sold-out item as
+    ``'soldout_<key>': 'true'``; items that are available are left out.
+    """
+    settings = get_settings()
+    if keys is None:
+        wire = dict(settings)
+        for slot_type in SLOT_TYPES:
+            wire[f'{slot_type}_closed_slots'] = closed_slots(slot_type)
+        wire.update({f'soldout_{k}': 'true' for k in sold_out_keys()})
+        return wire
+    return {k: settings.get(k) for k in keys}
+
+
+def emit_settings_delta(before: dict | None = None, extra: dict | None = None):
+    """Broadcast the settings whose raw value differs from ``before``.
+
+    ``extra`` holds further wire-format changes, such as the result of
+    set_sold_out(), to send in the same delta.
+    """
+    changed = []
+    if before is not None:
+        changed = [k for k, v in get_settings().items() if before.get(k) != v]
+    changes = settings_wire(changed) if changed else {}
+    changes.update(extra or {})
+    if not changes:
+        return
+    _broadcast_state['seq'] += 1
+    socketio.emit('settings_delta', {
+        'epoch': _broadcast_state['epoch'],
+        'seq': _broadcast_state['seq'],
+        'changes': changes,
+    })
+
+
+@socketio.on('settings_resync')
+def settings_resync():
+    return {
+        'epoch': _broadcast_state['epoch'],
+        'seq': _broadcast_state['seq'],
+        'settings': settings_wire(),
+    }
+
+
+# ----- Post-commit tasks -----
+# Side work that does not change the response (logging, broadcasts) runs
+# after the commit on one background greenlet fed by a bounded queue. When
+# the queue is full the task runs inline, so a burst slows requests down
+# instead of piling up unbounded work.
+POST_COMMIT_QUEUE_SIZE = int(os.getenv('POST_COMMIT_QUEUE_SIZE', '1000'))
+_post_commit = {'queue': queue.Queue(maxsize=POST_COMMIT_QUEUE_SIZE), 'worker': None, 'inline': 0}
+
+
+def _run_task(fn, args, kwargs):
+    try:
+        with app.app_context():
+            fn(*args, **kwargs)
+    except Exception:
+        import traceback
+        traceback.print_exc()
+
+
+def _post_commit_worker():
+    tasks = _post_commit['queue']
+    while True:
+        fn, args, kwargs = tasks.get()
+        _run_task(fn, args, kwargs)
+        tasks.task_done()
+
+
+def defer(fn, *args, **kwargs):
+    """Run ``fn(*args, **kwargs)`` on the post-commit worker.
+
+    Call only after the data the task depends on has been committed.
+    """
+    if _post_commit['worker'] is None:
+        _post_commit['worker'] = socketio.start_background_task(_post_commit_worker)
+    try:
+        _post_commit['queue'].put_nowait((fn, args, kwargs))
+    except queue.Full:
+        _post_commit['inline'] += 1
+        _run_task(fn, args, kwargs)
+
+
+# ----- Order events -----
+# New orders and status changes are pushed to the POS room as 'new_order'
+# and 'order_updated'. The payload is order_to_dict() plus 'epoch' and
+# 'seq' (shared epoch with settings deltas, own counter). Tills join with
+# 'pos_join', either from a logged-in session or with POS_SOCKET_TOKEN, and
+# send the last epoch/seq they saw; the reply replays the events they
+# missed from a short buffer, or asks for a reload with resync=True when
+# the gap is older than the buffer or the server restarted.
+POS_ROOM = 'pos'
+POS_SOCKET_TOKEN = os.getenv('POS_SOCKET_TOKEN')
+ORDER_EVENT_BUFFER = int(os.getenv('ORDER_EVENT_BUFFER', '200'))
+_order_events = {'seq': 0, 'buffer': deque(maxlen=ORDER_EVENT_BUFFER)}
+
+
+def _emit_order_events(event_name, order_ids):
+    orders = Order.query.filter(Order.id.in_(order_ids)).order_by(Order.id).all()
+    for order in orders:
+        _order_events['seq'] += 1
+        payload = order_to_dict(order)
+        payload.update(epoch=_broadcast_state['epoch'], seq=_order_events['seq'])
+        _order_events['buffer'].append({'event': event_name, 'order': payload})
+        socketio.emit(event_name, payload, to=POS_ROOM)
+
+
+def broadcast_orders(event_name: str, orders):
+    """Queue ``event_name`` for committed orders, given as instances or ids.
+
+    The orders are serialized on the post-commit worker, so the request
+    does not pay for reloading them.
+    """
+    ids = order_ids(orders)
+    if ids:
+        defer(_emit_order_events, event_name, ids)
+
+
+def order_events_since(epoch, seq) -> dict:
+    """Replay position for a till that last saw ``epoch``/``seq``."""
+    state = {'epoch': _broadcast_state['epoch'], 'seq': _order_events['seq'], 'events': [], 'resync': False}
+    if seq is None:
+        return state
+    buffer = _order_events['buffer']
+    oldest = buffer[0]['order']['seq'] if buffer else _order_events['seq'] + 1
+    if epoch != _broadcast_state['epoch'] or not isinstance(seq, int) or seq + 1 < oldest:
+        state['resync'] = True
+        return state
+    state['events'] = [e for e in buffer if e['order']['seq'] > seq]
+    return state
+
+
+@socketio.on('pos_join')
+def pos_join(data=None):
+    data = data if isinstance(data, dict) else {}
+    token = data.get('token')
+    allowed = current_user.is_authenticated or (
+        POS_SOCKET_TOKEN and isinstance(token, str) and hmac.compare_digest(token, POS_SOCKET_TOKEN)
+    )
+    if not allowed:
+        return {'ok': False, 'error': 'unauthorized'}
+    join_room(POS_ROOM)
+    return dict(order_events_since(data.get('epoch'), data.get('seq')), ok=True)
+
+
+# ----- Conditional GET -----
+# Read-mostly API responses carry a strong ETag built from the process epoch
+# and a per-resource version that writers bump after committing. A matching
+# If-None-Match is answered with 304 before any query runs.
+_content_versions = {'settings': 0, 'menu': 0, 'bubble_options': 0, 'xbento_options': 0}
+
+# Seconds a browser or CDN may reuse a response without revalidating.
+CACHE_MAX_AGE = {'settings': 5, 'menu': 60, 'bubble_options': 60, 'xbento_options': 60}
+
+
+def bump_content_version(name: str):
+    _content_versions[name] += 1
+
+
+def conditional_json(name: str, build):
+    """Return ``build()`` as JSON, or 304 when the client's ETag is current.
+
+    ``build`` may return pre-encoded JSON bytes, which are sent as they are.
+    """
+    etag = f"{_broadcast_state['epoch']}-{name}-{_content_versions[name]}"
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+    else:
+        data = build()
+        if isinstance(data, bytes):
+            resp = app.response_class(data, mimetype='application/json')
+        else:
+            resp = jsonify(data)
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = f'public, max-age={CACHE_MAX_AGE[name]}'
+    return resp
+
+
+def menu_item_dict(item) -> dict:
+    return {
+        'id': item.id,
+        'name': item.name,
+        'price': item.price,
+        'section': item.section.name if item.section else None,
+        'image': item.image,
+    }
+
+
+# ----- Menu snapshot -----
+# The serialized menu is kept in memory and rebuilt with one joined query the
+# first time it is read after the 'menu' content version changes.
+_menu_snapshot = {'version': -1, 'items': [], 'body': b'[]'}
+
+
+def get_menu_snapshot() -> dict:
+    """Return ``{'items': [...], 'body': <JSON bytes>}`` for the current menu."""
+    snap = _menu_snapshot
+    version = _content_versions['menu']
+    if snap['version'] != version:
+        rows = MenuItem.query.options(db.joinedload(MenuItem.section)).all()
+        items = [menu_item_dict(i) for i in rows]
+        snap['items'] = items
+        snap['body'] = json.dumps(items).encode()
+        snap['version'] = version
+    return snap
+
+
+# ----- Shared-database invalidation -----
+# The till app (electron-pos/appB.py) writes settings, sold-out flags, the
+# menu, the option lists and orders straight into this database. Each of its
+# commits bumps the matching cache_versions row; requests here read that
+# table at most every CACHE_VERSION_POLL seconds and reload what moved, so
+# ETags change and open browsers get the new values pushed.
+CACHE_VERSION_POLL = float(os.getenv('CACHE_VERSION_POLL', '2'))
+_shared_versions = {'checked': 0.0, 'seen': {}}
+
+
+def read_cache_versions() -> dict:
+    return dict(db.session.query(CacheVersion.name, CacheVersion.version).all())
+
+
+def _reload_settings():
+    before = dict(get_settings())
+    sold_before = set(sold_out_keys())
+    bump_settings_version()
+    reset_availability()
+    reset_slot_state()
+    sold_after = sold_out_keys()
+    extra = {f'soldout_{k}': 'true' for k in sold_after - sold_before}
+    extra.update({f'soldout_{k}': 'false' for k in sold_before - sold_after})
+    emit_settings_delta(before, extra=extra)
+
+
+def _reload_menu():
+    bump_content_version('menu')
+    socketio.emit('menu_update', get_menu_snapshot()['items'])
+
+
+def _reload_options(name, build):
+    bump_content_version(name)
+    socketio.emit(f'{name}_update', build())
+
+
+SHARED_CACHES = {
+    'settings': _reload_settings,
+    'menu': _reload_menu,
+    'bubble_options': lambda: _reload_options('bubble_options', get_bubble_options_dict),
+    'xbento_options': lambda: _reload_options('xbento_options', get_xbento_options_dict),
+    'orders': lambda: _slot_load.update(day=None),
+}
+
+
+@app.before_request
+def check_shared_caches():
+    """Reload the caches whose cache_versions row moved since the last check."""
+    now = time.monotonic()
+    if now - _shared_versions['checked'] < CACHE_VERSION_POLL:
+        return
+    _shared_versions['checked'] = now
+    seen = read_cache_versions()
+    previous, _shared_versions['seen'] = _shared_versions['seen'], seen
+    for name, reload in SHARED_CACHES.items():
+        if seen.get(name, 0) != previous.get(name, 0):
+            reload()
+
+
+with app.app_context():
+    _shared_versions['seen'] = read_cache_versions()
+
+
 class User(UserMixin):
     def __init__(self, user_id: str):
         self.id = user_id
@@ -864,215 +2482,436 @@ def pos():
         data = request.get_json() or {}
         order_number = data.get("order_number") or data.get("orderNumber")
 
-        order = Order(
-            order_type=data.get("order_type") or data.get("orderType"),
-            customer_name=data.get("customer_name") or data.get("name"),
-            phone=data.get("phone"),
-            email=data.get("email") or data.get("customerEmail"),
-            pickup_time=data.get("pickup_time") or data.get("pickupTime"),
-            delivery_time=data.get("delivery_time") or data.get("deliveryTime"),
-            payment_method=data.get("payment_method") or data.get("paymentMethod"),
-            postcode=data.get("postcode"),
-            house_number=data.get("house_number"),
-            street=data.get("street"),
-            city=data.get("city"),
-            opmerking=data.get("opmerking") or data.get("remark"),
-            items=json.dumps(data.get("items", {})),
-            order_number=order_number,
-            status=data.get("status") or "pending"
-        )
-        db.session.add(order)
+        # A retried till submit gets the original response, as in api_orders.
+        if order_number:
+            existing = Order.query.filter_by(order_number=order_number).first()
+            if existing:
+                if not is_same_order(existing, data):
+                    return order_conflict_response()
+                return pos_order_response(existing, replay=True)
+
+        try:
+            order, discount = build_order(data)
+        except ValueError as e:
+            return jsonify({"status": "fail", "error": str(e)}), 400
+        order, replay = store_order(order, discount)
+        if replay and not is_same_order(order, data):
+            return order_conflict_response()
+        return pos_order_response(order, replay=replay)
+
+    # 之前会在此向 POS 页面推送今日订单信息，现已不再需要
+    return render_template("pos.html")
+
+
+
+def build_order(data):
+    """Turn an order payload into an unsaved Order plus its new reward code.
+
+    Returns ``(order, discount)`` where ``discount`` holds the DiscountCode
+    columns to insert, or None. Malformed numbers or items raise ValueError.
+    """
+    order_number = data.get("order_number") or data.get("orderNumber")
+    order_type = data.get("orderType") or data.get("order_type")
+    summary_data = data.get("summary") or {}
+    if not isinstance(data.get("items", {}), dict):
+        raise ValueError("items must be an object")
+    order = Order(
+        order_type=order_type,
+        bron=data.get("bron"),
+        customer_name=data.get("name") or data.get("customer_name"),
+        phone=data.get("phone"),
+        email=data.get("customerEmail") or data.get("email"),
+        pickup_time=data.get("pickup_time") or data.get("pickupTime"),
+        delivery_time=data.get("delivery_time") or data.get("deliveryTime"),
+        tijdslot_display=data.get("tijdslot_display"),
+        payment_method=data.get("paymentMethod") or data.get("payment_method"),
+        postcode=data.get("postcode"),
+        house_number=data.get("house_number"),
+        street=data.get("street"),
+        city=data.get("city"),
+        opmerking=data.get("opmerking") or data.get("remark"),
+        items=json.dumps(data.get("items", {})),
+        order_number=order_number,
+        fooi=float(data.get("tip") or data.get("fooi") or 0),
+        statiegeld=float(data.get("statiegeld") or 0),
+        discount_code=data.get("discount_code"),
+        discount_amount=float(data.get("discount_amount") or 0),
+        discountCode=data.get("discountCode"),
+        discountAmount=float(
+            data.get("discountAmount")
+            or summary_data.get("discount_amount")
+            or summary_data.get("discountAmount")
+            or 0
+        ),
+        status=data.get("status") or "pending"
+    )
+
+    # 2. 计算 subtotal / totaal
+    subtotal = sum(i.price * i.qty for i in order.order_items)
+    order.totaal = float(data.get("totaal") or subtotal)
+
+    order.verpakkingskosten = float(summary_data.get("packaging") or 0)
+    order.bezorgkosten = float(summary_data.get("delivery") or 0)
+
+    order.btw_9 = data.get("btw_9") or summary_data.get("btw_9")
+    order.btw_21 = data.get("btw_21") or summary_data.get("btw_21")
+    order.btw_total = data.get("btw_total") or summary_data.get("btw_total")
+
+    try:
+        order.btw_9 = float(order.btw_9) if order.btw_9 is not None else 0.0
+        order.btw_21 = float(order.btw_21) if order.btw_21 is not None else 0.0
+        if order.btw_total is not None:
+            order.btw_total = float(order.btw_total)
+    except Exception:
+        order.btw_9 = order.btw_9 or 0.0
+        order.btw_21 = order.btw_21 or 0.0
+
+    if order.btw_total is None:
+        order.btw_total = (order.btw_9 or 0) + (order.btw_21 or 0)
+
+    # 3. 处理折扣码（本次使用）
+    if order.discountCode and str(order.discountCode).upper() == "KASSA":
+        order.discountCode = "kassa korting"
+
+    order.set_totals()
+
+    customer_email = (
+        data.get("customer_email")
+        or data.get("customerEmail")
+        or order.email
+    )
+    discount = None
+    if order.discount_code and customer_email:
+        discount = {
+            'code': order.discount_code,
+            'customer_email': customer_email,
+            'discount_percentage': 3.0,
+            'discount_amount': order.discount_amount or 0,
+            'is_used': False,
+        }
+    return order, discount
+
+
+def store_order(order, discount=None, reserved=False):
+    """Commit a built order and its reward code, then queue the post-commit work.
+
+    ``reserved`` is passed on to record_slot_order(). Returns ``(order,
+    replay)``; when a concurrent request stored the same order_number first,
+    that stored order is returned with replay=True and the caller checks
+    it with is_same_order().
+    """
+    # 4. 订单和新折扣码在同一个事务里保存
+    slot_closed = record_slot_order(order, reserved)
+    db.session.add(order)
+    discount_saved = False
+    try:
+        if discount:
+            # A colliding reward code is skipped; it must not cost the order.
+            table = DiscountCode.__table__
+            stmt = _insert_for_dialect()(table).values(**discount)
+            stmt = stmt.on_conflict_do_nothing(index_elements=['code']).returning(table.c.id)
+            discount_saved = db.session.execute(stmt).first() is not None
         db.session.commit()
+    except IntegrityError:
+        # A concurrent retry stored the same order_number first.
+        db.session.rollback()
+        reset_slot_state()
+        existing = Order.query.filter_by(order_number=order.order_number).first() if order.order_number else None
+        if existing is None:
+            raise
+        return existing, True
+    except Exception:
+        db.session.rollback()
+        reset_slot_state()
+        raise
+
+    # 5. 提交后的后台任务
+    broadcast_orders('new_order', [order])
+    refresh_revenue([order])
+    if slot_closed:
+        defer(emit_settings_delta, extra=slot_closed)
+    if discount_saved:
+        defer(print, f"✅ 折扣码保存成功: {discount['code']} for {discount['customer_email']} met korting {discount['discount_amount']}")
+    elif discount:
+        defer(print, f"⚠️ 折扣码已存在，未保存: {discount['code']}")
+    return order, False
+
+
+def is_same_order(existing, data) -> bool:
+    """Whether ``data`` is a retry of ``existing`` and not a new order
+    that happens to reuse its order_number: same phone, items and total."""
+    if (existing.phone or '') != (data.get("phone") or ''):
+        return False
+    if parse_items_text(existing.items) != (data.get("items") or {}):
+        return False
+    totaal = data.get("totaal")
+    if totaal in (None, ''):
+        return True
+    try:
+        return abs(float(totaal) - float(existing.totaal or 0)) < 0.005
+    except (TypeError, ValueError):
+        return False
 
 
-        resp = {"success": True, "status": order.status}
-        if str(order.payment_method).lower() == "online":
-            url = os.getenv("TIKKIE_URL")
-            if url:
-                resp["paymentLink"] = url
+def order_conflict_response():
+    """The 409 for an order_number already used by a different order."""
+    return jsonify({"status": "fail", "error": "order_number already used for a different order"}), 409
 
-        return jsonify(resp)
 
-    # 之前会在此向 POS 页面推送今日订单信息，现已不再需要
-    return render_template("pos.html")
+def order_response(order, replay=False):
+    """The api_orders success body for a stored order."""
+    resp = {"status": "ok", "created_at": order.created_at.isoformat() if order.created_at else None}
+    if str(order.payment_method).lower() == "online":
+        pay_url = os.getenv("TIKKIE_URL")
+        if pay_url:
+            resp["paymentLink"] = pay_url
+    response = jsonify(resp)
+    if replay:
+        response.headers['X-Idempotent-Replay'] = 'true'
+    return response, 200
+
 
+def pos_order_response(order, replay=False):
+    """The /pos success body for a stored order."""
+    resp = {"success": True, "status": order.status}
+    if str(order.payment_method).lower() == "online":
+        url = os.getenv("TIKKIE_URL")
+        if url:
+            resp["paymentLink"] = url
+    response = jsonify(resp)
+    if replay:
+        response.headers['X-Idempotent-Replay'] = 'true'
+    return response
 
 
 # 接收前端订单提交
 @app.route('/api/orders', methods=["POST"])
+@admission('orders')
 def api_orders():
     try:
         data = request.get_json() or {}
         order_number = data.get("order_number") or data.get("orderNumber")
 
+        # Retries of an order that was already stored get the original response.
+        if order_number:
+            existing = Order.query.filter_by(order_number=order_number).first()
+            if existing:
+                if not is_same_order(existing, data):
+                    return order_conflict_response()
+                return order_response(existing, replay=True)
+
+        if not isinstance(data.get("items", {}), dict):
+            return jsonify({"status": "fail", "error": "items must be an object"}), 400
+
         # ===== 新时间判断逻辑开始 =====
         from datetime import datetime
 
         order_type = data.get("orderType") or data.get("order_type")
-        settings = {s.key: s.value for s in Setting.query.all()}
         now = datetime.now(NL_TZ)
         source = (data.get("source") or "").lower()
         is_zsm = str(data.get("is_zsm")).lower() == "true"
 
+        reserved = False
         if not (source == "pos" and is_zsm):
-            if order_type == 'afhalen':
-                start_str = settings.get('pickup_start', '00:00')
-                end_str = settings.get('pickup_end', '23:59')
+            schedule = get_order_schedule()
+            slot_type = schedule.slot_type(order_type)
+            if slot_type == 'pickup':
                 gekozen = data.get("pickup_time") or data.get("pickupTime") or ""
-                gesloten_message = "Afhalen is gesloten voor vandaag."
             else:
-                start_str = settings.get('delivery_start', '00:00')
-                end_str = settings.get('delivery_end', '23:59')
                 gekozen = data.get("delivery_time") or data.get("deliveryTime") or ""
-                gesloten_message = "Bezorging is gesloten voor vandaag."
+            error, chosen_min = schedule.check_time(order_type, gekozen, now)
+            if error:
+                return jsonify({"status": "fail", "error": error}), 403
+            if chosen_min is not None and slot_is_full(slot_type, gekozen):
+                return jsonify({"status": "fail", "error": "Tijdslot vol"}), 403
+            # Only capped slots need the row-locking reservation; the rest
+            # are counted by record_slot_order() in store_order().
+            if chosen_min is not None and slot_capacity(slot_type, gekozen) is not None:
+                if not reserve_slot(slot_type, gekozen, now.date()):
+                    db.session.rollback()
+                    return jsonify({"status": "fail", "error": "Tijdslot vol"}), 403
+                reserved = True
+        # ===== 新时间判断逻辑结束 =====
 
-            start_hour, start_minute = map(int, start_str.split(':'))
-            end_hour, end_minute = map(int, end_str.split(':'))
+        if source != "pos":
+            sold = sold_out_names().intersection(data.get("items") or {})
+            if sold:
+                return jsonify({"status": "fail", "error": f"Uitverkocht: {', '.join(sorted(sold))}"}), 403
 
-            start_today = now.replace(hour=start_hour, minute=start_minute, second=0, microsecond=0)
-            end_today = now.replace(hour=end_hour, minute=end_minute, second=0, microsecond=0)
+        try:
+            order, discount = build_order(data)
+        except ValueError as e:
+            db.session.rollback()
+            reset_slot_state()
+            return jsonify({"status": "fail", "error": str(e)}), 400
+        order, replay = store_order(order, discount, reserved)
+        if replay and not is_same_order(order, data):
+            return order_conflict_response()
+        if not replay:
+            defer(print, "✅ 接收到订单:", data)
 
-            chosen_dt = None
-            if gekozen:
-                try:
-                    ch, cm = map(int, gekozen.split(':'))
-                    chosen_dt = now.replace(hour=ch, minute=cm, second=0, microsecond=0)
-                except Exception:
-                    pass
+        # 6. 返回响应
+        return order_response(order, replay=replay)
 
-            if chosen_dt and chosen_dt < start_today:
-                return jsonify({"status": "fail", "error": "Gekozen tijd valt buiten openingstijden."}), 403
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"status": "fail", "error": str(e)}), 500
 
-            if chosen_dt and chosen_dt > end_today:
-                return jsonify({"status": "fail", "error": gesloten_message}), 403
 
-            if now > end_today:
-                return jsonify({"status": "fail", "error": gesloten_message}), 403
-            try:
-                pickup_closed = json.loads(settings.get('pickup_closed_slots') or '{}')
-                delivery_closed = json.loads(settings.get('delivery_closed_slots') or '{}')
-            except Exception:
-                pickup_closed, delivery_closed = {}, {}
-            closed_map = pickup_closed if order_type == 'afhalen' else delivery_closed
-            if gekozen:
-                hour_key = f"{gekozen.split(':')[0]}:00" if ':' in gekozen else None
-                status = closed_map.get(gekozen) or (hour_key and closed_map.get(hour_key))
-                if status:
-                    msg = 'Tijdslot vol' if status in ['full', 'closed'] else 'Tijdslot gesloten'
-                    return jsonify({"status": "fail", "error": msg}), 403
-        # ===== 新时间判断逻辑结束 =====
+@app.route('/submit_order', methods=["POST"])
+def submit_order():
+    # 兼容旧接口，转发数据到现有逻辑
+    return api_orders()
 
-        summary_data = data.get("summary") or {}
-        order = Order(
-            order_type=order_type,
-            bron=data.get("bron"),
-            customer_name=data.get("name") or data.get("customer_name"),
-            phone=data.get("phone"),
-            email=data.get("customerEmail") or data.get("email"),
-            pickup_time=data.get("pickup_time") or data.get("pickupTime"),
-            delivery_time=data.get("delivery_time") or data.get("deliveryTime"),
-            tijdslot_display=data.get("tijdslot_display"),
-            payment_method=data.get("paymentMethod") or data.get("payment_method"),
-            postcode=data.get("postcode"),
-            house_number=data.get("house_number"),
-            street=data.get("street"),
-            city=data.get("city"),
-            opmerking=data.get("opmerking") or data.get("remark"),
-            items=json.dumps(data.get("items", {})),
-            order_number=order_number,
-            fooi=float(data.get("tip") or data.get("fooi") or 0),
-            statiegeld=float(data.get("statiegeld") or 0),
-            discount_code=data.get("discount_code"),
-            discount_amount=float(data.get("discount_amount") or 0),
-            discountCode=data.get("discountCode"),
-            discountAmount=float(
-                data.get("discountAmount")
-                or summary_data.get("discount_amount")
-                or summary_data.get("discountAmount")
-                or 0
-            ),
-            status=data.get("status") or "pending"
-        )
 
-        # 2. 计算 subtotal / totaal
-        items = json.loads(order.items or "{}")
-        subtotal = sum(
-            float(i.get("price", 0)) * int(i.get("qty", 0))
-            for i in items.values()
-        )
-        order.totaal = float(data.get("totaal") or subtotal)
+# ----- Bulk order upload -----
+# A till that was offline uploads its queued orders in one request. They
+# were accepted at the till already, so opening hours and slot limits are
+# not re-checked; duplicates are skipped by order_number.
+BULK_ORDER_LIMIT = 500
+_order_number_unique = {}
 
-        order.verpakkingskosten = float(summary_data.get("packaging") or 0)
-        order.bezorgkosten = float(summary_data.get("delivery") or 0)
 
-        order.btw_9 = data.get("btw_9") or summary_data.get("btw_9")
-        order.btw_21 = data.get("btw_21") or summary_data.get("btw_21")
-        order.btw_total = data.get("btw_total") or summary_data.get("btw_total")
+def order_number_is_unique() -> bool:
+    """Whether orders.order_number has a unique index.
 
-        try:
-            order.btw_9 = float(order.btw_9) if order.btw_9 is not None else 0.0
-            order.btw_21 = float(order.btw_21) if order.btw_21 is not None else 0.0
-            if order.btw_total is not None:
-                order.btw_total = float(order.btw_total)
-        except Exception:
-            order.btw_9 = order.btw_9 or 0.0
-            order.btw_21 = order.btw_21 or 0.0
+    The startup migration falls back to a plain index while duplicate
+    order numbers exist, and ON CONFLICT needs the unique one.
+    """
+    if 'value' not in _order_number_unique:
+        _order_number_unique['value'] = any(
+            i['unique'] and i['column_names'] == ['order_number']
+            for i in db.inspect(db.engine).get_indexes('orders')
+        )
+    return _order_number_unique['value']
 
-        if order.btw_total is None:
-            order.btw_total = (order.btw_9 or 0) + (order.btw_21 or 0)
 
-        # 3. 处理折扣码（本次使用）
-        if order.discountCode and str(order.discountCode).upper() == "KASSA":
-            order.discountCode = "kassa korting"
+def _client_datetime(value):
+    """Parse an ISO timestamp from a till into naive UTC (naive means NL time)."""
+    if not value:
+        return datetime.utcnow()
+    dt = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=NL_TZ)
+    return dt.astimezone(UTC).replace(tzinfo=None)
 
-        # 4. 保存订单到数据库
-        db.session.add(order)
-        db.session.commit()
 
-        # 5. 如有新折扣码，记录到 discount_codes 表
-        customer_email = (
-            data.get("customer_email")
-            or data.get("customerEmail")
-            or order.email
+def _order_row(order) -> dict:
+    """Column values of an unsaved Order, with scalar defaults filled in."""
+    row = {}
+    for column in Order.__table__.columns:
+        if column.primary_key:
+            continue
+        value = getattr(order, column.key)
+        if value is None and column.default is not None and column.default.is_scalar:
+            value = column.default.arg
+        row[column.key] = value
+    return row
+
+
+@app.route('/api/orders/bulk', methods=['POST'])
+@admission('orders')
+def api_orders_bulk():
+    """Store a batch of orders: ``{"orders": [...]}`` or a bare list.
+
+    Each order needs an order_number. The response lists one result per
+    order in input order: ``{"order_number", "status": "ok" | "duplicate"
+    | "fail", "error"?}``.
+    """
+    payload = request.get_json(silent=True)
+    orders = payload.get('orders') if isinstance(payload, dict) else payload
+    if not isinstance(orders, list):
+        return jsonify({"status": "fail", "error": "orders must be a list"}), 400
+    if len(orders) > BULK_ORDER_LIMIT:
+        return jsonify({"status": "fail", "error": f"max {BULK_ORDER_LIMIT} orders per request"}), 400
+
+    numbers = [
+        (o.get("order_number") or o.get("orderNumber")) if isinstance(o, dict) else None
+        for o in orders
+    ]
+    existing = {
+        n for (n,) in db.session.query(Order.order_number).filter(
+            Order.order_number.in_([n for n in numbers if n])
         )
-        new_code = order.discount_code
-        new_amount = order.discount_amount or 0
-
-        if new_code and customer_email:
-            disc = DiscountCode(
-                code=new_code,
-                customer_email=customer_email,
-                discount_percentage=3.0,
-                discount_amount=new_amount,
-                is_used=False,
-            )
-            db.session.add(disc)
+    }
+    _slot_counts()  # reseed before this transaction starts, if the day changed
+
+    results, rows, discounts, built = [], [], [], []
+    seen = set()
+    for data, number in zip(orders, numbers):
+        result = {"order_number": number}
+        results.append(result)
+        if not number:
+            result.update(status="fail", error="order_number required")
+            continue
+        if number in existing or number in seen:
+            result["status"] = "duplicate"
+            continue
+        try:
+            order, discount = build_order(data)
+            order.created_at = _client_datetime(data.get("created_at"))
+            order.updated_at = datetime.utcnow()
+        except (AttributeError, TypeError, ValueError) as e:
+            result.update(status="fail", error=str(e))
+            continue
+        seen.add(number)
+        rows.append(_order_row(order))
+        built.append(order)
+        if discount:
+            discounts.append(discount)
+
+    inserted, ids = {}, {}
+    slot_changes = {}
+    if rows:
+        insert = _insert_for_dialect()
+        table = Order.__table__
+        try:
+            stmt = insert(table)
+            if order_number_is_unique():
+                stmt = stmt.on_conflict_do_nothing(index_elements=['order_number'])
+            # Without the unique index only the pre-select above skips duplicates.
+            stmt = stmt.returning(table.c.order_number, table.c.id, table.c.created_at)
+            for number, order_id, created_at in db.session.execute(stmt, rows):
+                ids[number] = order_id
+                inserted[number] = created_at
+            item_rows = [
+                dict(row, order_id=ids[order.order_number])
+                for order in built if order.order_number in ids
+                for row in order_item_rows(parse_items_text(order.items))
+            ]
+            if item_rows:
+                db.session.execute(OrderItem.__table__.insert(), item_rows)
+            if discounts:
+                db.session.execute(
+                    insert(DiscountCode.__table__).on_conflict_do_nothing(index_elements=['code']),
+                    discounts,
+                )
+            for order in built:
+                if order.order_number in inserted:
+                    slot_changes.update(record_slot_order(order))
             db.session.commit()
-            print(
-                f"✅ 折扣码保存成功: {new_code} for {customer_email} met korting {new_amount}"
-            )
-
-        print("✅ 接收到订单:", data)
-
-        # 6. 返回响应
-        resp = {"status": "ok", "created_at": order.created_at.isoformat() if order.created_at else None}
-        if str(order.payment_method).lower() == "online":
-            pay_url = os.getenv("TIKKIE_URL")
-            if pay_url:
-                resp["paymentLink"] = pay_url
-
-        return jsonify(resp), 200
-
-    except Exception as e:
-        import traceback
-        traceback.print_exc()
-        return jsonify({"status": "fail", "error": str(e)}), 500
-
+        except Exception as e:
+            db.session.rollback()
+            reset_slot_state()
+            import traceback
+            traceback.print_exc()
+            return jsonify({"status": "fail", "error": str(e)}), 500
+
+    for result in results:
+        if "status" not in result:
+            created_at = inserted.get(result["order_number"])
+            if created_at is None:
+                result["status"] = "duplicate"
+            else:
+                result.update(status="ok", created_at=created_at.isoformat())
 
-@app.route('/submit_order', methods=["POST"])
-def submit_order():
-    # 兼容旧接口，转发数据到现有逻辑
-    return api_orders()
+    broadcast_orders('new_order', list(ids.values()))
+    refresh_revenue(list(ids.values()))
+    if slot_changes:
+        defer(emit_settings_delta, extra=slot_changes)
+    defer(print, f"✅ 批量接收订单: {len(inserted)} nieuw, {len(results) - len(inserted)} overgeslagen")
+    return jsonify({"status": "ok", "results": results}), 200
 
 
 
@@ -1094,21 +2933,27 @@ def validate_discount():
                 "note": "kassa korting"
             }), 200
 
-        disc = DiscountCode.query.filter_by(code=code, is_used=False).first()
-        if not disc:
-            return jsonify({"valid": False, "error": "Invalid or used code"}), 400
-
+        table = DiscountCode.__table__
+        unused = and_(table.c.code == code, table.c.is_used == False)
         if order_total < 20:
+            if db.session.execute(db.select(table.c.id).where(unused)).first() is None:
+                return jsonify({"valid": False, "error": "Invalid or used code"}), 400
             return jsonify({"valid": False, "error": "Minimum order total not met"}), 400
 
-        # ✅ 改成使用数据库折扣金额
-        discount_amount = disc.discount_amount
+        # One conditional UPDATE on the unique code index: of two tills
+        # redeeming the same code, only one gets a row back.
+        row = db.session.execute(
+            table.update().where(unused).values(is_used=True).returning(table.c.discount_amount)
+        ).first()
+        if row is None:
+            db.session.rollback()
+            return jsonify({"valid": False, "error": "Invalid or used code"}), 400
+        db.session.commit()
 
+        # ✅ 改成使用数据库折扣金额
+        discount_amount = row.discount_amount or 0.0
         new_total = max(0, order_total - discount_amount)
 
-        disc.is_used = True
-        db.session.commit()
-
         return jsonify({
             "valid": True,
             "discount_amount": discount_amount,
@@ -1122,49 +2967,29 @@ def validate_discount():
 # 获取设置
 @app.route('/api/settings/<key>')
 def get_setting(key):
-    s = Setting.query.filter_by(key=key).first()
-    return jsonify({key: s.value if s else None})
+    return jsonify({key: get_settings().get(key)})
 
 @app.route('/api/settings')
 def get_all_settings():
-    settings = {s.key: s.value for s in Setting.query.all()}
-    for k in ['pickup_closed_slots', 'delivery_closed_slots']:
-        try:
-            settings[k] = json.loads(settings.get(k) or '{}')
-        except Exception:
-            settings[k] = {}
-    return jsonify(settings)
+    resp = conditional_json('settings', settings_wire)
+    resp.headers['X-Settings-Epoch'] = _broadcast_state['epoch']
+    resp.headers['X-Settings-Seq'] = str(_broadcast_state['seq'])
+    return resp
 
 
 @app.route('/api/closed_slots')
 def get_closed_slots():
-    keys = ['pickup_closed_slots', 'delivery_closed_slots']
-    settings = {s.key: s.value for s in Setting.query.filter(Setting.key.in_(keys)).all()}
-    def parse(val):
-        try:
-            return json.loads(val or '{}')
-        except Exception:
-            return {}
-    return jsonify({
-        'pickup': parse(settings.get('pickup_closed_slots')),
-        'delivery': parse(settings.get('delivery_closed_slots'))
-    })
+    def build():
+        return {
+            'pickup': closed_slots('pickup'),
+            'delivery': closed_slots('delivery')
+        }
+    return conditional_json('settings', build)
 
 # ----- Menu API -----
 @app.route('/api/menu')
 def api_menu():
-    items = MenuItem.query.all()
-    data = [
-        {
-            'id': i.id,
-            'name': i.name,
-            'price': i.price,
-            'section': i.section.name if i.section else None,
-            'image': i.image,
-        }
-        for i in items
-    ]
-    return jsonify(data)
+    return conditional_json('menu', lambda: get_menu_snapshot()['body'])
 
 
 @app.route('/api/update_item', methods=['POST'])
@@ -1174,42 +2999,38 @@ def api_update_item():
     item = MenuItem.query.get(item_id)
     if not item:
         return jsonify({'success': False, 'error': 'not_found'}), 404
+    price_changed = False
     if 'price' in data:
         try:
             item.price = float(data['price'])
+            price_changed = True
         except (TypeError, ValueError):
             pass
     soldout_key = data.get('soldout_key')
-    if soldout_key is not None and 'sold_out' in data:
-        val = 'true' if data.get('sold_out') else 'false'
-        s = Setting.query.filter_by(key=soldout_key).first()
-        if not s:
-            s = Setting(key=soldout_key, value=val)
-            db.session.add(s)
-        else:
-            s.value = val
-    db.session.commit()
-    items = [
-        {
-            'id': i.id,
-            'name': i.name,
-            'price': i.price,
-            'section': i.section.name if i.section else None,
-            'image': i.image,
-        } for i in MenuItem.query.all()
-    ]
-    socketio.emit('menu_update', items)
-    settings = {s.key: s.value for s in Setting.query.all()}
-    socketio.emit('setting_update', settings)
+    flipped = {}
+    try:
+        if soldout_key is not None and 'sold_out' in data:
+            key = soldout_key[len('soldout_'):] if soldout_key.startswith('soldout_') else soldout_key
+            flipped = set_sold_out({key: bool(data.get('sold_out'))})
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        reset_availability()
+        raise
+    if price_changed:
+        bump_content_version('menu')
+        socketio.emit('menu_update', [menu_item_dict(item)])
+    if flipped:
+        emit_settings_delta(extra=flipped)
     return jsonify({'success': True})
 
 @app.route('/api/bubble_options')
 def api_bubble_options():
-    return jsonify(get_bubble_options_dict())
+    return conditional_json('bubble_options', get_bubble_options_dict)
 
 @app.route('/api/xbento_options')
 def api_xbento_options():
-    return jsonify(get_xbento_options_dict())
+    return conditional_json('xbento_options', get_xbento_options_dict)
 
 @app.route('/api/orders/<int:order_id>/status', methods=['POST'])
 @login_required
@@ -1218,11 +3039,20 @@ def update_order_status(order_id: int):
     order = Order.query.get_or_404(order_id)
     if 'is_completed' in data:
         order.is_completed = bool(data['is_completed'])
+    slot_changes = {}
     if 'is_cancelled' in data:
-        order.is_cancelled = bool(data['is_cancelled'])
+        cancelled = bool(data['is_cancelled'])
+        if cancelled != bool(order.is_cancelled):
+            slot_changes = release_slot_order(order) if cancelled else record_slot_order(order)
+        order.is_cancelled = cancelled
     if 'status' in data:
         order.status = data['status']
     db.session.commit()
+    broadcast_orders('order_updated', [order])
+    if 'is_cancelled' in data:
+        refresh_revenue([order])
+    if slot_changes:
+        emit_settings_delta(extra=slot_changes)
     return jsonify({'success': True, 'is_completed': order.is_completed, 'is_cancelled': order.is_cancelled, 'status': order.status})
 
 
@@ -1242,14 +3072,18 @@ def webhook_update_order_status():
             'error': 'order_number and status/payment_status required'
         }), 400
 
-    order = Order.query.filter_by(order_number=order_number).first()
-    if not order:
+    # One indexed UPDATE instead of a SELECT followed by an UPDATE.
+    updated = db.session.execute(
+        update(Order).where(Order.order_number == order_number)
+        .values(status=status).returning(Order.id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    if not updated:
         return jsonify({'success': False, 'error': 'order not found'}), 404
-
-    order.status = status
     db.session.commit()
+    broadcast_orders('order_updated', updated)
 
-    return jsonify({'success': True, 'status': order.status}), 200
+    return jsonify({'success': True, 'status': status}), 200
 
 
 @app.route('/api/orders/<int:order_id>', methods=['PUT', 'PATCH'])
@@ -1285,7 +3119,10 @@ def edit_order(order_id: int):
             order.fooi = float(data['tip'])
         except (TypeError, ValueError):
             order.fooi = 0.0
+    order.set_totals()
     db.session.commit()
+    broadcast_orders('order_updated', [order])
+    refresh_revenue([order])
     return jsonify({'success': True})
 
 # ----- Review API -----
@@ -1381,339 +3218,74 @@ def delete_review(review_id: int):
 
 
 
+# Template variables for the dashboard and their fallbacks when a row is missing.
+DASHBOARD_DEFAULTS = {key: default for key, (kind, default) in SETTINGS_REGISTRY.items()}
+
+
 # Mijn Nova Asia 管理后台
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    def get_value(key, default):
-        s = Setting.query.filter_by(key=key).first()
-        return s.value if s else default
-
-    sections = MenuSection.query.all()
-    bases = BubbleOption.query.filter_by(category='base').all()
-    smaken = BubbleOption.query.filter_by(category='smaak').all()
-    toppings = BubbleOption.query.filter_by(category='topping').all()
-    xbento_main = XbentoOption.query.filter_by(category='main').all()
-    xbento_side = XbentoOption.query.filter_by(category='side').all()
-    xbento_rice = XbentoOption.query.filter_by(category='rice').all()
-    xbento_groente = XbentoOption.query.filter_by(category='groente').all()
+    settings = get_settings()
+    context = {key: settings.get(key, default) for key, default in DASHBOARD_DEFAULTS.items()}
+    for slot_type in SLOT_TYPES:
+        context[f'{slot_type}_closed_slots'] = closed_slots(slot_type)
+    sold_out = sold_out_keys()
+    for key in SOLDOUT_ITEMS:
+        context[f'soldout_{key}'] = 'true' if key in sold_out else 'false'
+
+    bubble = get_bubble_options_dict()
+    xbento = get_xbento_options_dict()
     return render_template(
         'dashboard.html',
-        is_open=get_value('is_open', 'true'),
-        open_time=get_value('open_time', '11:00'),
-        close_time=get_value('close_time', '21:00'),
-        closed_days=get_value('closed_days', ''),
-        pickup_enabled=get_value('pickup_enabled', 'true'),
-        delivery_enabled=get_value('delivery_enabled', 'true'),
-        pickup_start=get_value('pickup_start', '11:00'),
-        pickup_end=get_value('pickup_end', '21:00'),
-        pickup_address=get_value('pickup_address', ''),
-        delivery_start=get_value('delivery_start', '11:00'),
-        delivery_end=get_value('delivery_end', '21:00'),
-        delivery_postcodes=get_value('delivery_postcodes', ''),
-        pickup_closed_slots=json.loads(get_value('pickup_closed_slots', '{}') or '{}'),
-        delivery_closed_slots=json.loads(get_value('delivery_closed_slots', '{}') or '{}'),
-        time_interval=get_value('time_interval', '15'),
-        show_zsm_option=get_value('show_zsm_option', 'true'),
-        milktea_soldout=get_value('milktea_soldout', 'false'),
-        milktea_price=get_value('milktea_price', '5'),
-        price_zalm_crispy_rice_sandwich=get_value('price_zalm_crispy_rice_sandwich', '7'),
-        price_spicytuna_crispy_rice_sandwich=get_value('price_spicytuna_crispy_rice_sandwich', '7'),
-        price_ebi_crispy_rice_sandwich=get_value('price_ebi_crispy_rice_sandwich', '7'),
-        price_beef_crispy_rice_sandwich=get_value('price_beef_crispy_rice_sandwich', '7.5'),
-        price_california_crispy_rice_sandwich=get_value('price_california_crispy_rice_sandwich', '7.5'),
-        price_chicken_crispy_rice_sandwich=get_value('price_chicken_crispy_rice_sandwich', '7'),
-        soldout_japans_chicken_bento=get_value('soldout_japans_chicken_bento', 'false'),
-        soldout_korean_chicken_bento=get_value('soldout_korean_chicken_bento', 'false'),
-        soldout_korean_beef_bento=get_value('soldout_korean_beef_bento', 'false'),
-        soldout_meatlover_bento=get_value('soldout_meatlover_bento', 'false'),
-        soldout_zalm_lover_bento=get_value('soldout_zalm_lover_bento', 'false'),
-        soldout_ebi_lover_bento=get_value('soldout_ebi_lover_bento', 'false'),
-        soldout_surf_turf_bento=get_value('soldout_surf_turf_bento', 'false'),
-        soldout_dimsum_bento=get_value('soldout_dimsum_bento', 'false'),
-        soldout_lamskotelet_bento=get_value('soldout_lamskotelet_bento', 'false'),
-        soldout_unagi_bento=get_value('soldout_unagi_bento', 'false'),
-        soldout_veggie_bento=get_value('soldout_veggie_bento', 'false'),
-        soldout_sushi_bento=get_value('soldout_sushi_bento', 'false'),
-        soldout_salmon_roll=get_value('soldout_salmon_roll', 'false'),
-        soldout_dragon_roll=get_value('soldout_dragon_roll', 'false'),
-        soldout_beef_roll=get_value('soldout_beef_roll', 'false'),
-        soldout_chicken_roll=get_value('soldout_chicken_roll', 'false'),
-        soldout_nigiri_box=get_value('soldout_nigiri_box', 'false'),
-        soldout_salmon_sashimi=get_value('soldout_salmon_sashimi', 'false'),
-        soldout_flamed_salmon_sashimi=get_value('soldout_flamed_salmon_sashimi', 'false'),
-        soldout_tonijn_sashimi=get_value('soldout_tonijn_sashimi', 'false'),
-        soldout_flamed_tonijn_sashimi=get_value('soldout_flamed_tonijn_sashimi', 'false'),
-        soldout_beef_sashimi=get_value('soldout_beef_sashimi', 'false'),
-        soldout_zalm_crispy_rice_sandwich=get_value('soldout_zalm_crispy_rice_sandwich', 'false'),
-        soldout_spicytuna_crispy_rice_sandwich=get_value('soldout_spicytuna_crispy_rice_sandwich', 'false'),
-        soldout_ebi_crispy_rice_sandwich=get_value('soldout_ebi_crispy_rice_sandwich', 'false'),
-        soldout_beef_crispy_rice_sandwich=get_value('soldout_beef_crispy_rice_sandwich', 'false'),
-        soldout_california_crispy_rice_sandwich=get_value('soldout_california_crispy_rice_sandwich', 'false'),
-        soldout_chicken_crispy_rice_sandwich=get_value('soldout_chicken_crispy_rice_sandwich', 'false'),
-        soldout_xbento=get_value('soldout_xbento', 'false'),
-        soldout_zalm_bowl=get_value('soldout_zalm_bowl', 'false'),
-        soldout_tuna_bowl=get_value('soldout_tuna_bowl', 'false'),
-        soldout_ebi_fry_bowl=get_value('soldout_ebi_fry_bowl', 'false'),
-        soldout_chicken_karaage_bowl=get_value('soldout_chicken_karaage_bowl', 'false'),
-        soldout_spicy_chicken_bowl=get_value('soldout_spicy_chicken_bowl', 'false'),
-        soldout_teriyaki_chicken_bowl=get_value('soldout_teriyaki_chicken_bowl', 'false'),
-        soldout_teriyaki_beef_bowl=get_value('soldout_teriyaki_beef_bowl', 'false'),
-        soldout_california_bowl=get_value('soldout_california_bowl', 'false'),
-        soldout_vega_bowl=get_value('soldout_vega_bowl', 'false'),
-        soldout_meatlover_bowl=get_value('soldout_meatlover_bowl', 'false'),
-        soldout_rainbow_bowl=get_value('soldout_rainbow_bowl', 'false'),
-        soldout_spicy_tuna_bowl=get_value('soldout_spicy_tuna_bowl', 'false'),
-        soldout_flamed_zalm_bowl=get_value('soldout_flamed_zalm_bowl', 'false'),
-        soldout_flamed_tuna_bowl=get_value('soldout_flamed_tuna_bowl', 'false'),
-        soldout_x_bowl=get_value('soldout_x_bowl', 'false'),
-        soldout_ebi_ramen=get_value('soldout_ebi_ramen', 'false'),
-        soldout_chicken_ramen=get_value('soldout_chicken_ramen', 'false'),
-        soldout_beef_ramen=get_value('soldout_beef_ramen', 'false'),
-        soldout_ribeye_ramen=get_value('soldout_ribeye_ramen', 'false'),
-        soldout_chasiu_ramen=get_value('soldout_chasiu_ramen', 'false'),
-        soldout_karaage=get_value('soldout_karaage', 'false'),
-        soldout_ebi_fry=get_value('soldout_ebi_fry', 'false'),
-        soldout_spicy_crispy_chicken=get_value('soldout_spicy_crispy_chicken', 'false'),
-        soldout_chicken_loempia=get_value('soldout_chicken_loempia', 'false'),
-        soldout_gyoza=get_value('soldout_gyoza', 'false'),
-        soldout_inktvis_ringen=get_value('soldout_inktvis_ringen', 'false'),
-        soldout_sesambal=get_value('soldout_sesambal', 'false'),
-        soldout_yakitori=get_value('soldout_yakitori', 'false'),
-        soldout_mini_loempia=get_value('soldout_mini_loempia', 'false'),
-        soldout_edamame=get_value('soldout_edamame', 'false'),
-        soldout_kimchi_komkommer=get_value('soldout_kimchi_komkommer', 'false'),
-        soldout_kimchi_kool=get_value('soldout_kimchi_kool', 'false'),
-        soldout_zeewiersalade=get_value('soldout_zeewiersalade', 'false'),
-        soldout_mochi_mango=get_value('soldout_mochi_mango', 'false'),
-        soldout_mochi_aardbei=get_value('soldout_mochi_aardbei', 'false'),
-        soldout_mochi_matcha=get_value('soldout_mochi_matcha', 'false'),
-        soldout_mochi_pistachio=get_value('soldout_mochi_pistachio', 'false'),
-        soldout_cola=get_value('soldout_cola', 'false'),
-        soldout_cola_zero=get_value('soldout_cola_zero', 'false'),
-        soldout_spa_blauw=get_value('soldout_spa_blauw', 'false'),
-        soldout_spa_rood=get_value('soldout_spa_rood', 'false'),
-        soldout_red_bull=get_value('soldout_red_bull', 'false'),
-        sections=sections,
-        base_options=bases,
-        smaak_options=smaken,
-        topping_options=toppings,
-        xbento_main=xbento_main,
-        xbento_side=xbento_side,
-        xbento_rice=xbento_rice,
-        xbento_groente=xbento_groente,
+        sections=MenuSection.query.all(),
+        base_options=bubble['base'],
+        smaak_options=bubble['smaak'],
+        topping_options=bubble['topping'],
+        xbento_main=xbento['main'],
+        xbento_side=xbento['side'],
+        xbento_rice=xbento['rice'],
+        xbento_groente=xbento['groente'],
+        **context,
     )
 
 
 @app.route('/dashboard/update', methods=['POST'])
 @login_required
 def update_setting():
-    data = request.get_json()
-    is_open_val = data.get('is_open', 'true')
-    open_time_val = data.get('open_time', '11:00')
-    close_time_val = data.get('close_time', '21:00')
-    closed_days_val = data.get('closed_days', '')
-    pickup_enabled_val = data.get('pickup_enabled', 'true')
-    delivery_enabled_val = data.get('delivery_enabled', 'true')
-    pickup_start_val = data.get('pickup_start', '11:00')
-    pickup_end_val = data.get('pickup_end', '21:00')
-    pickup_address_val = data.get('pickup_address', '')
-    delivery_start_val = data.get('delivery_start', '11:00')
-    delivery_end_val = data.get('delivery_end', '21:00')
-    delivery_postcodes_val = data.get('delivery_postcodes', '')
-    pickup_closed_slots_val = json.dumps(data.get('pickup_closed_slots', {}))
-    delivery_closed_slots_val = json.dumps(data.get('delivery_closed_slots', {}))
-    time_interval_val = data.get('time_interval', '15')
-    show_zsm_option_val = data.get('show_zsm_option', 'true')
-    milktea_soldout_val = data.get('milktea_soldout', 'false')
-    soldout_japans_chicken_bento_val = data.get('soldout_japans_chicken_bento', 'false')
-    soldout_korean_chicken_bento_val = data.get('soldout_korean_chicken_bento', 'false')
-    soldout_korean_beef_bento_val = data.get('soldout_korean_beef_bento', 'false')
-    soldout_meatlover_bento_val = data.get('soldout_meatlover_bento', 'false')
-    soldout_zalm_lover_bento_val = data.get('soldout_zalm_lover_bento', 'false')
-    soldout_ebi_lover_bento_val = data.get('soldout_ebi_lover_bento', 'false')
-    soldout_surf_turf_bento_val = data.get('soldout_surf_turf_bento', 'false')
-    soldout_dimsum_bento_val = data.get('soldout_dimsum_bento', 'false')
-    soldout_lamskotelet_bento_val = data.get('soldout_lamskotelet_bento', 'false')
-    soldout_unagi_bento_val = data.get('soldout_unagi_bento', 'false')
-    soldout_veggie_bento_val = data.get('soldout_veggie_bento', 'false')
-    soldout_sushi_bento_val = data.get('soldout_sushi_bento', 'false')
-    soldout_salmon_roll_val = data.get('soldout_salmon_roll', 'false')
-    soldout_dragon_roll_val = data.get('soldout_dragon_roll', 'false')
-    soldout_beef_roll_val = data.get('soldout_beef_roll', 'false')
-    soldout_chicken_roll_val = data.get('soldout_chicken_roll', 'false')
-    soldout_nigiri_box_val = data.get('soldout_nigiri_box', 'false')
-    soldout_salmon_sashimi_val = data.get('soldout_salmon_sashimi', 'false')
-    soldout_flamed_salmon_sashimi_val = data.get('soldout_flamed_salmon_sashimi', 'false')
-    soldout_tonijn_sashimi_val = data.get('soldout_tonijn_sashimi', 'false')
-    soldout_flamed_tonijn_sashimi_val = data.get('soldout_flamed_tonijn_sashimi', 'false')
-    soldout_beef_sashimi_val = data.get('soldout_beef_sashimi', 'false')
-    soldout_zalm_crispy_rice_sandwich_val = data.get('soldout_zalm_crispy_rice_sandwich', 'false')
-    soldout_spicytuna_crispy_rice_sandwich_val = data.get('soldout_spicytuna_crispy_rice_sandwich', 'false')
-    soldout_ebi_crispy_rice_sandwich_val = data.get('soldout_ebi_crispy_rice_sandwich', 'false')
-    soldout_beef_crispy_rice_sandwich_val = data.get('soldout_beef_crispy_rice_sandwich', 'false')
-    soldout_california_crispy_rice_sandwich_val = data.get('soldout_california_crispy_rice_sandwich', 'false')
-    soldout_chicken_crispy_rice_sandwich_val = data.get('soldout_chicken_crispy_rice_sandwich', 'false')
-    soldout_xbento_val = data.get('soldout_xbento', 'false')
-    soldout_zalm_bowl_val = data.get('soldout_zalm_bowl', 'false')
-    soldout_tuna_bowl_val = data.get('soldout_tuna_bowl', 'false')
-    soldout_ebi_fry_bowl_val = data.get('soldout_ebi_fry_bowl', 'false')
-    soldout_chicken_karaage_bowl_val = data.get('soldout_chicken_karaage_bowl', 'false')
-    soldout_spicy_chicken_bowl_val = data.get('soldout_spicy_chicken_bowl', 'false')
-    soldout_teriyaki_chicken_bowl_val = data.get('soldout_teriyaki_chicken_bowl', 'false')
-    soldout_teriyaki_beef_bowl_val = data.get('soldout_teriyaki_beef_bowl', 'false')
-    soldout_california_bowl_val = data.get('soldout_california_bowl', 'false')
-    soldout_vega_bowl_val = data.get('soldout_vega_bowl', 'false')
-    soldout_meatlover_bowl_val = data.get('soldout_meatlover_bowl', 'false')
-    soldout_rainbow_bowl_val = data.get('soldout_rainbow_bowl', 'false')
-    soldout_spicy_tuna_bowl_val = data.get('soldout_spicy_tuna_bowl', 'false')
-    soldout_flamed_zalm_bowl_val = data.get('soldout_flamed_zalm_bowl', 'false')
-    soldout_flamed_tuna_bowl_val = data.get('soldout_flamed_tuna_bowl', 'false')
-    soldout_x_bowl_val = data.get('soldout_x_bowl', 'false')
-    soldout_ebi_ramen_val = data.get('soldout_ebi_ramen', 'false')
-    soldout_chicken_ramen_val = data.get('soldout_chicken_ramen', 'false')
-    soldout_beef_ramen_val = data.get('soldout_beef_ramen', 'false')
-    soldout_ribeye_ramen_val = data.get('soldout_ribeye_ramen', 'false')
-    soldout_chasiu_ramen_val = data.get('soldout_chasiu_ramen', 'false')
-    soldout_karaage_val = data.get('soldout_karaage', 'false')
-    soldout_ebi_fry_val = data.get('soldout_ebi_fry', 'false')
-    soldout_spicy_crispy_chicken_val = data.get('soldout_spicy_crispy_chicken', 'false')
-    soldout_chicken_loempia_val = data.get('soldout_chicken_loempia', 'false')
-    soldout_gyoza_val = data.get('soldout_gyoza', 'false')
-    soldout_inktvis_ringen_val = data.get('soldout_inktvis_ringen', 'false')
-    soldout_sesambal_val = data.get('soldout_sesambal', 'false')
-    soldout_yakitori_val = data.get('soldout_yakitori', 'false')
-    soldout_mini_loempia_val = data.get('soldout_mini_loempia', 'false')
-    soldout_edamame_val = data.get('soldout_edamame', 'false')
-    soldout_kimchi_komkommer_val = data.get('soldout_kimchi_komkommer', 'false')
-    soldout_kimchi_kool_val = data.get('soldout_kimchi_kool', 'false')
-    soldout_zeewiersalade_val = data.get('soldout_zeewiersalade', 'false')
-    soldout_mochi_mango_val = data.get('soldout_mochi_mango', 'false')
-    soldout_mochi_aardbei_val = data.get('soldout_mochi_aardbei', 'false')
-    soldout_mochi_matcha_val = data.get('soldout_mochi_matcha', 'false')
-    soldout_mochi_pistachio_val = data.get('soldout_mochi_pistachio', 'false')
-    soldout_cola_val = data.get('soldout_cola', 'false')
-    soldout_cola_zero_val = data.get('soldout_cola_zero', 'false')
-    soldout_spa_blauw_val = data.get('soldout_spa_blauw', 'false')
-    soldout_spa_rood_val = data.get('soldout_spa_rood', 'false')
-    soldout_red_bull_val = data.get('soldout_red_bull', 'false')
-    
-    for key, val in [
-        ('is_open', is_open_val),
-        ('open_time', open_time_val),
-        ('close_time', close_time_val),
-        ('closed_days', closed_days_val),
-        ('pickup_enabled', pickup_enabled_val),
-        ('delivery_enabled', delivery_enabled_val),
-        ('pickup_start', pickup_start_val),
-        ('pickup_end', pickup_end_val),
-        ('pickup_address', pickup_address_val),
-        ('delivery_start', delivery_start_val),
-        ('delivery_end', delivery_end_val),
-        ('delivery_postcodes', delivery_postcodes_val),
-        ('pickup_closed_slots', pickup_closed_slots_val),
-        ('delivery_closed_slots', delivery_closed_slots_val),
-        ('time_interval', time_interval_val),
-        ('show_zsm_option', show_zsm_option_val),
-        ('milktea_soldout', milktea_soldout_val),
-        ('soldout_japans_chicken_bento', soldout_japans_chicken_bento_val),
-        ('soldout_korean_chicken_bento', soldout_korean_chicken_bento_val),
-        ('soldout_korean_beef_bento', soldout_korean_beef_bento_val),
-        ('soldout_meatlover_bento', soldout_meatlover_bento_val),
-        ('soldout_zalm_lover_bento', soldout_zalm_lover_bento_val),
-        ('soldout_ebi_lover_bento', soldout_ebi_lover_bento_val),
-        ('soldout_surf_turf_bento', soldout_surf_turf_bento_val),
-        ('soldout_dimsum_bento', soldout_dimsum_bento_val),
-        ('soldout_lamskotelet_bento', soldout_lamskotelet_bento_val),
-        ('soldout_unagi_bento', soldout_unagi_bento_val),
-        ('soldout_veggie_bento', soldout_veggie_bento_val),
-        ('soldout_sushi_bento', soldout_sushi_bento_val),
-        ('soldout_salmon_roll', soldout_salmon_roll_val),
-        ('soldout_dragon_roll', soldout_dragon_roll_val),
-        ('soldout_beef_roll', soldout_beef_roll_val),
-        ('soldout_chicken_roll', soldout_chicken_roll_val),
-        ('soldout_nigiri_box', soldout_nigiri_box_val),
-        ('soldout_salmon_sashimi', soldout_salmon_sashimi_val),
-        ('soldout_flamed_salmon_sashimi', soldout_flamed_salmon_sashimi_val),
-        ('soldout_tonijn_sashimi', soldout_tonijn_sashimi_val),
-        ('soldout_flamed_tonijn_sashimi', soldout_flamed_tonijn_sashimi_val),
-        ('soldout_beef_sashimi', soldout_beef_sashimi_val),
-        ('soldout_zalm_crispy_rice_sandwich', soldout_zalm_crispy_rice_sandwich_val),
-        ('soldout_spicytuna_crispy_rice_sandwich', soldout_spicytuna_crispy_rice_sandwich_val),
-        ('soldout_ebi_crispy_rice_sandwich', soldout_ebi_crispy_rice_sandwich_val),
-        ('soldout_beef_crispy_rice_sandwich', soldout_beef_crispy_rice_sandwich_val),
-        ('soldout_california_crispy_rice_sandwich', soldout_california_crispy_rice_sandwich_val),
-        ('soldout_chicken_crispy_rice_sandwich', soldout_chicken_crispy_rice_sandwich_val),
-        ('soldout_xbento', soldout_xbento_val),
-        ('soldout_zalm_bowl', soldout_zalm_bowl_val),
-        ('soldout_tuna_bowl', soldout_tuna_bowl_val),
-        ('soldout_ebi_fry_bowl', soldout_ebi_fry_bowl_val),
-        ('soldout_chicken_karaage_bowl', soldout_chicken_karaage_bowl_val),
-        ('soldout_spicy_chicken_bowl', soldout_spicy_chicken_bowl_val),
-        ('soldout_teriyaki_chicken_bowl', soldout_teriyaki_chicken_bowl_val),
-        ('soldout_teriyaki_beef_bowl', soldout_teriyaki_beef_bowl_val),
-        ('soldout_california_bowl', soldout_california_bowl_val),
-        ('soldout_vega_bowl', soldout_vega_bowl_val),
-        ('soldout_meatlover_bowl', soldout_meatlover_bowl_val),
-        ('soldout_rainbow_bowl', soldout_rainbow_bowl_val),
-        ('soldout_spicy_tuna_bowl', soldout_spicy_tuna_bowl_val),
-        ('soldout_flamed_zalm_bowl', soldout_flamed_zalm_bowl_val),
-        ('soldout_flamed_tuna_bowl', soldout_flamed_tuna_bowl_val),
-        ('soldout_x_bowl', soldout_x_bowl_val),
-        ('soldout_ebi_ramen', soldout_ebi_ramen_val),
-        ('soldout_chicken_ramen', soldout_chicken_ramen_val),
-        ('soldout_beef_ramen', soldout_beef_ramen_val),
-        ('soldout_ribeye_ramen', soldout_ribeye_ramen_val),
-        ('soldout_chasiu_ramen', soldout_chasiu_ramen_val),
-        ('soldout_karaage', soldout_karaage_val),
-        ('soldout_ebi_fry', soldout_ebi_fry_val),
-        ('soldout_spicy_crispy_chicken', soldout_spicy_crispy_chicken_val),
-        ('soldout_chicken_loempia', soldout_chicken_loempia_val),
-        ('soldout_gyoza', soldout_gyoza_val),
-        ('soldout_inktvis_ringen', soldout_inktvis_ringen_val),
-        ('soldout_sesambal', soldout_sesambal_val),
-        ('soldout_yakitori', soldout_yakitori_val),
-        ('soldout_mini_loempia', soldout_mini_loempia_val),
-        ('soldout_edamame', soldout_edamame_val),
-        ('soldout_kimchi_komkommer', soldout_kimchi_komkommer_val),
-        ('soldout_kimchi_kool', soldout_kimchi_kool_val),
-        ('soldout_zeewiersalade', soldout_zeewiersalade_val),
-        ('soldout_mochi_mango', soldout_mochi_mango_val),
-        ('soldout_mochi_aardbei', soldout_mochi_aardbei_val),
-        ('soldout_mochi_matcha', soldout_mochi_matcha_val),
-        ('soldout_mochi_pistachio', soldout_mochi_pistachio_val),
-        ('soldout_cola', soldout_cola_val),
-        ('soldout_cola_zero', soldout_cola_zero_val),
-        ('soldout_spa_blauw', soldout_spa_blauw_val),
-        ('soldout_spa_rood', soldout_spa_rood_val),
-        ('soldout_red_bull', soldout_red_bull_val),
-        
-    ]:
-        s = Setting.query.filter_by(key=key).first()
-        if not s:
-            db.session.add(Setting(key=key, value=val))
-        else:
-            s.value = val
-
-    db.session.commit()
-    settings = {s.key: s.value for s in Setting.query.all()}
-    parsed_settings = settings.copy()
-    for k in ['pickup_closed_slots', 'delivery_closed_slots']:
-        try:
-            parsed_settings[k] = json.loads(settings.get(k) or '{}')
-        except Exception:
-            parsed_settings[k] = {}
-    socketio.emit('setting_update', parsed_settings)
-    time_settings = {
-        'pickup_start': settings.get('pickup_start'),
-        'pickup_end': settings.get('pickup_end'),
-        'delivery_start': settings.get('delivery_start'),
-        'delivery_end': settings.get('delivery_end'),
-        'time_interval': settings.get('time_interval'),
-        'pickup_closed_slots': parsed_settings['pickup_closed_slots'],
-        'delivery_closed_slots': parsed_settings['delivery_closed_slots']
-    }
-    socketio.emit('time_update', time_settings)
+    data = request.get_json() or {}
+    before = dict(get_settings())
+    try:
+        upsert_settings({
+            key: data.get(key, default)
+            for key, (kind, default) in SETTINGS_REGISTRY.items()
+            if kind != 'price'
+        })
+        extra = set_sold_out({
+            key: _parse_bool(data.get(f'soldout_{key}', 'false'), 'false')
+            for key in SOLDOUT_ITEMS
+        })
+        for slot_type in SLOT_TYPES:
+            key = f'{slot_type}_closed_slots'
+            mapping = dict(data.get(key) or {})
+            # 'auto' closures belong to the throttle, not to the dashboard form.
+            mapping.update({
+                slot: status for slot, status in closed_slots(slot_type).items()
+                if status == SLOT_AUTO_STATUS
+            })
+            if replace_closed_slots(slot_type, mapping):
+                extra[key] = closed_slots(slot_type)
+        bump_settings_version()  # so apply_slot_limits sees the new limits
+        extra.update(apply_slot_limits())
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        reset_availability()
+        reset_slot_state()
+        bump_settings_version()
+        raise
+    bump_settings_version()
+    emit_settings_delta(before, extra)
     return jsonify({'success': True})
 
 
@@ -1727,40 +3299,25 @@ def toggle_slot():
     action = data.get('action', 'close')
     if slot_type not in ['pickup', 'delivery'] or not slot:
         return jsonify({'success': False, 'error': 'invalid parameters'}), 400
+    # Validate everything first: set_slot_statuses() also updates the cache.
+    if 'capacity' in data:
+        try:
+            capacity = int(data['capacity']) if data['capacity'] not in (None, '') else None
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'invalid capacity'}), 400
     key = f"{slot_type}_closed_slots"
-    s = Setting.query.filter_by(key=key).first()
     try:
-        slots = json.loads(s.value) if s and s.value else {}
+        set_slot_statuses(slot_type, {slot: None if action == 'open' else status})
+        if 'capacity' in data:
+            set_slot_capacity(slot_type, slot, capacity)
+        db.session.commit()
     except Exception:
-        slots = {}
-    if action == 'open':
-        slots.pop(slot, None)
-    else:
-        slots[slot] = status
-    new_val = json.dumps(slots)
-    if not s:
-        db.session.add(Setting(key=key, value=new_val))
-    else:
-        s.value = new_val
-    db.session.commit()
-    settings = {s.key: s.value for s in Setting.query.all()}
-    parsed_settings = settings.copy()
-    for k in ['pickup_closed_slots', 'delivery_closed_slots']:
-        try:
-            parsed_settings[k] = json.loads(settings.get(k) or '{}')
-        except Exception:
-            parsed_settings[k] = {}
-    time_settings = {
-        'pickup_start': settings.get('pickup_start'),
-        'pickup_end': settings.get('pickup_end'),
-        'delivery_start': settings.get('delivery_start'),
-        'delivery_end': settings.get('delivery_end'),
-        'time_interval': settings.get('time_interval'),
-        'pickup_closed_slots': parsed_settings['pickup_closed_slots'],
-        'delivery_closed_slots': parsed_settings['delivery_closed_slots']
-    }
-    socketio.emit('time_update', time_settings)
-    return jsonify({'success': True, key: new_val})
+        db.session.rollback()
+        reset_slot_state()
+        raise
+    slots = closed_slots(slot_type)
+    emit_settings_delta(extra={key: slots})
+    return jsonify({'success': True, key: json.dumps(slots)})
 
 
 
@@ -1801,17 +3358,8 @@ def add_item():
         )
         db.session.add(item)
         db.session.commit()
-        items = [
-            {
-                'id': i.id,
-                'name': i.name,
-                'price': i.price,
-                'section': i.section.name if i.section else None,
-                'image': i.image,
-            }
-            for i in MenuItem.query.all()
-        ]
-        socketio.emit('menu_update', items)
+        bump_content_version('menu')
+        socketio.emit('menu_update', [menu_item_dict(item)])
     return redirect(url_for('dashboard'))
 
 
@@ -1826,17 +3374,8 @@ def update_item(item_id):
     item = MenuItem.query.get_or_404(item_id)
     item.price = price_value
     db.session.commit()
-    items = [
-        {
-            'id': i.id,
-            'name': i.name,
-            'price': i.price,
-            'section': i.section.name if i.section else None,
-            'image': i.image,
-        }
-        for i in MenuItem.query.all()
-    ]
-    socketio.emit('menu_update', items)
+    bump_content_version('menu')
+    socketio.emit('menu_update', [menu_item_dict(item)])
     return redirect(url_for('dashboard'))
 
 
@@ -1849,13 +3388,11 @@ def update_milktea_price():
     except (TypeError, ValueError):
         return jsonify({'success': False, 'error': 'invalid_price'}), 400
 
-    setting = Setting.query.filter_by(key='milktea_price').first()
-    if not setting:
-        setting = Setting(key='milktea_price', value=str(price_val))
-        db.session.add(setting)
-    else:
-        setting.value = str(price_val)
+    before = dict(get_settings())
+    upsert_settings({'milktea_price': price_val})
     db.session.commit()
+    bump_settings_version()
+    emit_settings_delta(before)
     socketio.emit('milktea_price_update', {'price': price_val})
     return jsonify({'success': True})
 
@@ -1879,14 +3416,12 @@ def update_crispy_prices():
                 price_val = float(data[k])
             except (TypeError, ValueError):
                 continue
-            setting = Setting.query.filter_by(key=setting_key).first()
-            if not setting:
-                setting = Setting(key=setting_key, value=str(price_val))
-                db.session.add(setting)
-            else:
-                setting.value = str(price_val)
             updated[setting_key] = price_val
+    before = dict(get_settings())
+    upsert_settings(updated)
     db.session.commit()
+    bump_settings_version()
+    emit_settings_delta(before)
     if updated:
         socketio.emit('crispy_price_update', updated)
     return jsonify({'success': True})
@@ -1906,6 +3441,7 @@ def add_bubble_option():
         opt = BubbleOption(name=name, category=category, price=price_val)
         db.session.add(opt)
         db.session.commit()
+        bump_content_version('bubble_options')
         socketio.emit('bubble_options_update', get_bubble_options_dict())
     return redirect(url_for('dashboard'))
 
@@ -1920,6 +3456,7 @@ def update_bubble_option(opt_id):
     except ValueError:
         pass
     db.session.commit()
+    bump_content_version('bubble_options')
     socketio.emit('bubble_options_update', get_bubble_options_dict())
     return redirect(url_for('dashboard'))
 
@@ -1930,6 +3467,7 @@ def delete_bubble_option(opt_id):
     opt = BubbleOption.query.get_or_404(opt_id)
     db.session.delete(opt)
     db.session.commit()
+    bump_content_version('bubble_options')
     socketio.emit('bubble_options_update', get_bubble_options_dict())
     return redirect(url_for('dashboard'))
 
@@ -1948,6 +3486,7 @@ def add_xbento_option():
         opt = XbentoOption(name=name, category=category, price=price_val)
         db.session.add(opt)
         db.session.commit()
+        bump_content_version('xbento_options')
         socketio.emit('xbento_options_update', get_xbento_options_dict())
     return redirect(url_for('dashboard'))
 
@@ -1962,6 +3501,7 @@ def update_xbento_option(opt_id):
     except ValueError:
         pass
     db.session.commit()
+    bump_content_version('xbento_options')
     socketio.emit('xbento_options_update', get_xbento_options_dict())
     return redirect(url_for('dashboard'))
 
@@ -1972,6 +3512,7 @@ def delete_xbento_option(opt_id):
     opt = XbentoOption.query.get_or_404(opt_id)
     db.session.delete(opt)
     db.session.commit()
+    bump_content_version('xbento_options')
     socketio.emit('xbento_options_update', get_xbento_options_dict())
     return redirect(url_for('dashboard'))
 
@@ -1990,14 +3531,7 @@ def admin_orders():
     order_data = []
 
     for o in orders:
-        try:
-            items = json.loads(o.items or "{}")
-        except Exception:
-            try:
-                import ast
-                items = ast.literal_eval(o.items)
-            except Exception:
-                items = {}
+        items = o.items_data
 
         o.created_at_local = to_nl(o.created_at)
         # 不再重新计算 o.totaal，而是使用数据库字段的原值
@@ -2067,17 +3601,38 @@ def thuisbezorgd_api():
     return jsonify({'btw9': 0, 'btw21': 0, 'totaal': 0, 'orders': 0, 'statiegeld': 0})
 
 
+@app.route('/admin/revenue', methods=['GET', 'POST'])
+@login_required
+def revenue_api():
+    """GET: daily_revenue totals for ?date= or ?start=&end= (default today).
+
+    POST {"start", "end"} or {"date"}: rebuild those days from the orders.
+    """
+    args = (request.get_json(silent=True) or {}) if request.method == 'POST' else request.args
+    first = args.get('date') or args.get('start')
+    last = args.get('date') or args.get('end') or first
+    try:
+        if first:
+            first = datetime.strptime(first, '%Y-%m-%d').date()
+            last = datetime.strptime(last, '%Y-%m-%d').date()
+        else:
+            first = last = datetime.now(NL_TZ).date()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid date'}), 400
+    if last < first:
+        return jsonify({'error': 'end before start'}), 400
+    if request.method == 'POST':
+        return jsonify({'status': 'ok', 'days': rebuild_daily_revenue(first, last)})
+    return jsonify(dict(period_revenue(first, last), start=first.isoformat(), end=last.isoformat()))
+
+
 @app.route('/pos/orders_today')
 @login_required
 def pos_orders_today():
-    today = datetime.now(NL_TZ).date()
-    start_local = datetime.combine(today, datetime.min.time(), tzinfo=NL_TZ)
-    start = start_local.astimezone(UTC).replace(tzinfo=None)
-
     # Ensure we fetch the latest order data, including updated payment status
     db.session.expire_all()
     orders = (Order.query
-              .filter(Order.created_at >= start)
+              .filter(created_between(datetime.now(NL_TZ).date()))
               .order_by(Order.created_at.desc())
               .all())
     order_dicts = orders_to_dicts(orders)
@@ -2088,6 +3643,59 @@ def pos_orders_today():
     return render_template("pos_orders.html", orders=orders)
 
 
+# ----- Incremental order lists -----
+# Polling tills ask /pos/orders?since=<cursor> for today's orders created or
+# changed after the cursor and keep the returned cursor for the next call.
+# updated_at is stamped at flush time, so a transaction that commits late
+# can land just behind a cursor already handed out; each poll looks
+# ORDER_CURSOR_OVERLAP further back and clients merge the rows by id.
+# A full page hands out an "<updated_at>~<id>" keyset cursor instead, so
+# the follow-up pages continue after the last row without the overlap.
+ORDER_CURSOR_OVERLAP = timedelta(seconds=5)
+ORDER_CURSOR_PAGE = 500
+ORDER_CURSOR_SEP = '~'
+
+
+def orders_since(cursor, page=ORDER_CURSOR_PAGE):
+    """Today's orders changed after ``cursor`` (None for all of today).
+
+    Returns ``(orders, next_cursor, more)``; ``more`` is True when the page
+    was full and the caller should ask again right away with the returned
+    cursor. Raises ValueError for a malformed cursor.
+    """
+    query = Order.query.filter(created_between(datetime.now(NL_TZ).date()))
+    if cursor and ORDER_CURSOR_SEP in cursor:
+        # Continuation page: resume exactly after the last row sent.
+        stamp, last_id = cursor.split(ORDER_CURSOR_SEP, 1)
+        stamp, last_id = datetime.fromisoformat(stamp), int(last_id)
+        query = query.filter(or_(Order.updated_at > stamp,
+                                 and_(Order.updated_at == stamp, Order.id > last_id)))
+    elif cursor:
+        query = query.filter(Order.updated_at > datetime.fromisoformat(cursor) - ORDER_CURSOR_OVERLAP)
+    orders = query.order_by(Order.updated_at, Order.id).limit(page + 1).all()
+    more = len(orders) > page
+    orders = orders[:page]
+    if more:
+        last = orders[-1]
+        next_cursor = f"{last.updated_at.isoformat()}{ORDER_CURSOR_SEP}{last.id}"
+    elif orders:
+        next_cursor = orders[-1].updated_at.isoformat()
+    else:
+        next_cursor = datetime.utcnow().isoformat() if not cursor else cursor.split(ORDER_CURSOR_SEP)[0]
+    return orders, next_cursor, more
+
+
+@app.route('/pos/orders')
+@login_required
+def pos_orders():
+    """``{"cursor", "more", "orders"}`` with orders in orders_today format."""
+    try:
+        orders, cursor, more = orders_since(request.args.get('since'))
+    except ValueError:
+        return jsonify({"status": "fail", "error": "invalid cursor"}), 400
+    return jsonify({"cursor": cursor, "more": more, "orders": orders_to_dicts(orders)})
+
+
 @app.route('/pos/orders_by_date')
 @login_required
 def pos_orders_by_date():
@@ -2097,20 +3705,9 @@ def pos_orders_by_date():
     except Exception:
         return jsonify([])
 
-    start_local = datetime.combine(qdate, datetime.min.time(), tzinfo=NL_TZ)
-    end_local = datetime.combine(qdate, datetime.max.time(), tzinfo=NL_TZ)
-    start = start_local.astimezone(UTC).replace(tzinfo=None)
-    end = end_local.astimezone(UTC).replace(tzinfo=None)
-    orders = Order.query.filter(Order.created_at >= start, Order.created_at <= end).order_by(Order.created_at.desc()).all()
+    orders = Order.query.filter(created_between(qdate)).order_by(Order.created_at.desc()).all()
     for o in orders:
-        try:
-            o.items_dict = json.loads(o.items or '{}')
-        except Exception:
-            try:
-                import ast
-                o.items_dict = ast.literal_eval(o.items)
-            except Exception:
-                o.items_dict = {}
+        o.items_dict = o.items_data
         o.created_at_local = to_nl(o.created_at)
         o.maps_link = build_maps_link(o.street, o.house_number, o.postcode, o.city)
 
@@ -2131,20 +3728,9 @@ def pos_orders_range():
     except Exception:
         return jsonify([])
 
-    start_local = datetime.combine(sdate, datetime.min.time(), tzinfo=NL_TZ)
-    end_local = datetime.combine(edate, datetime.max.time(), tzinfo=NL_TZ)
-    start = start_local.astimezone(UTC).replace(tzinfo=None)
-    end = end_local.astimezone(UTC).replace(tzinfo=None)
-    orders = Order.query.filter(Order.created_at >= start, Order.created_at <= end).order_by(Order.created_at.desc()).all()
+    orders = Order.query.filter(created_between(sdate, edate)).order_by(Order.created_at.desc()).all()
     for o in orders:
-        try:
-            o.items_dict = json.loads(o.items or '{}')
-        except Exception:
-            try:
-                import ast
-                o.items_dict = ast.literal_eval(o.items)
-            except Exception:
-                o.items_dict = {}
+        o.items_dict = o.items_data
         o.created_at_local = to_nl(o.created_at)
         o.maps_link = build_maps_link(o.street, o.house_number, o.postcode, o.city)
 
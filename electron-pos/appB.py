@@ -13,10 +13,11 @@ from flask_login import (
     login_required,
 )
 from flask_socketio import SocketIO
-from sqlalchemy import text
+from sqlalchemy import text, event, and_, or_, case
+from sqlalchemy.exc import IntegrityError
 import eventlet
 eventlet.monkey_patch()
-from datetime import datetime, timezone
+from datetime import datetime, timezone, timedelta
 from zoneinfo import ZoneInfo
 import os
 import json
@@ -40,6 +41,7 @@ from flask import Flask, send_from_directory
 from playsound import playsound
 import threading
 from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from flask import Flask, request, jsonify
 from flask_socketio import SocketIO
 import traceback
@@ -93,6 +95,17 @@ with app.app_context():
         if "btw_total" not in cols:
             with db.engine.begin() as conn:
                 conn.execute(text("ALTER TABLE orders ADD COLUMN btw_total FLOAT DEFAULT 0"))
+        if "subtotal" not in cols:
+            with db.engine.begin() as conn:
+                conn.execute(text("ALTER TABLE orders ADD COLUMN subtotal FLOAT"))
+        if "bezorging" not in cols:
+            with db.engine.begin() as conn:
+                conn.execute(text("ALTER TABLE orders ADD COLUMN bezorging FLOAT"))
+        # Last write time, the cursor for /pos/orders?since=
+        if "updated_at" not in cols:
+            with db.engine.begin() as conn:
+                conn.execute(text("ALTER TABLE orders ADD COLUMN updated_at TIMESTAMP"))
+                conn.execute(text("UPDATE orders SET updated_at = created_at WHERE updated_at IS NULL"))
         cols = {c["name"] for c in inspector.get_columns("reviews")}
         if "rating" not in cols:
             with db.engine.begin() as conn:
@@ -104,6 +117,9 @@ with app.app_context():
         if "idx_orders_created_at" not in idx_names:
             with db.engine.begin() as conn:
                 conn.execute(text("CREATE INDEX idx_orders_created_at ON orders (created_at)"))
+        if "idx_orders_updated_at" not in idx_names:
+            with db.engine.begin() as conn:
+                conn.execute(text("CREATE INDEX idx_orders_updated_at ON orders (updated_at)"))
     except Exception as e:
         print(f"DB init error: {e}")
 
@@ -134,21 +150,41 @@ def to_nl(dt: datetime) -> datetime:
     if dt.tzinfo is None:
         dt = dt.replace(tzinfo=UTC)
     return dt.astimezone(NL_TZ)
-def generate_excel_today(include_cancelled: bool = False):
-    today = datetime.now(NL_TZ).date()
-    start_local = datetime.combine(today, datetime.min.time(), tzinfo=NL_TZ)
-    start = start_local.astimezone(UTC).replace(tzinfo=None)
 
-    q = Order.query.filter(Order.created_at >= start)
+
+def nl_day_bounds(first, last=None) -> tuple:
+    """Naive-UTC ``(start, end)`` covering the Amsterdam days first..last.
+
+    Takes dates or 'YYYY-MM-DD' strings; ``last`` defaults to ``first`` and
+    a bad string raises ValueError. ``end`` is exclusive (next midnight).
+    """
+    days = []
+    for day in (first, first if last is None else last):
+        if isinstance(day, str):
+            day = datetime.strptime(day, '%Y-%m-%d').date()
+        days.append(day)
+    start_local = datetime.combine(days[0], datetime.min.time(), tzinfo=NL_TZ)
+    end_local = datetime.combine(days[1] + timedelta(days=1), datetime.min.time(), tzinfo=NL_TZ)
+    return start_local.astimezone(UTC).replace(tzinfo=None), end_local.astimezone(UTC).replace(tzinfo=None)
+
+
+def created_between(first, last=None):
+    """Filter for orders placed on the NL days first..last.
+
+    Compares the raw created_at column so idx_orders_created_at is used.
+    """
+    start, end = nl_day_bounds(first, last)
+    return and_(Order.created_at >= start, Order.created_at < end)
+
+
+def generate_excel_today(include_cancelled: bool = False):
+    q = Order.query.filter(created_between(datetime.now(NL_TZ).date()))
     if not include_cancelled:
         q = q.filter(Order.is_cancelled == False)
     orders = q.order_by(Order.created_at.desc()).all()
     data = []
     for o in orders:
-        try:
-            items = json.loads(o.items or "{}")
-        except Exception:
-            items = {}
+        items = o.items_data
 
         summary = ", ".join(f"{k} x {v.get('qty')}" for k, v in items.items())
         status = "Geannuleerd" if o.is_cancelled else ("Voltooid" if o.is_completed else "Open")
@@ -194,22 +230,8 @@ def get_order_by_number(order_number):
         return jsonify({"error": "Order not found"}), 404
 
 def order_to_dict(order):
-    try:
-        items = json.loads(order.items or '{}')
-    except Exception:
-        try:
-            import ast
-            items = ast.literal_eval(order.items)
-        except Exception:
-            items = {}
-
-    subtotal = sum(
-        float(i.get("price", 0)) * int(i.get("qty", 0))
-        for i in items.values()
-    )
-    delivery_calc = order.totaal + (order.discountAmount or 0) - subtotal - order.verpakkingskosten - (order.fooi or 0) - (order.statiegeld or 0)
-    delivery_calc = round(delivery_calc, 2)
-    delivery = order.bezorgkosten if order.bezorgkosten not in [None, 0] else max(delivery_calc, 0)
+    items = order.items_data
+    subtotal, delivery = order.stored_totals()
 
     return {
         "id": order.id,
@@ -252,11 +274,7 @@ def order_to_dict(order):
     }
 
 def generate_pdf_today(include_cancelled: bool = False):
-    today = datetime.now(NL_TZ).date()
-    start_local = datetime.combine(today, datetime.min.time(), tzinfo=NL_TZ)
-    start = start_local.astimezone(UTC).replace(tzinfo=None)
-
-    q = Order.query.filter(Order.created_at >= start)
+    q = Order.query.filter(created_between(datetime.now(NL_TZ).date()))
     if not include_cancelled:
         q = q.filter(Order.is_cancelled == False)
     orders = q.order_by(Order.created_at.desc()).all()
@@ -267,10 +285,7 @@ def generate_pdf_today(include_cancelled: bool = False):
 
     data = [["Datum", "Tijd", "Naam", "Fooi", "Statiegeld", "Totaal", "Items", "Status"]]
     for o in orders:
-        try:
-            items = json.loads(o.items or "{}")
-        except Exception:
-            items = {}
+        items = o.items_data
 
         summary = ", ".join(f"{k} x {v.get('qty')}" for k, v in items.items())
         status = "Geannuleerd" if o.is_cancelled else ("Voltooid" if o.is_completed else "Open")
@@ -319,12 +334,15 @@ def download_excel():
     start = request.args.get('start')
     end = request.args.get('end')
 
-    if date:
-        output = generate_excel_by_date(date, include_cancelled)
-    elif start and end:
-        output = generate_excel_by_range(start, end, include_cancelled)
-    else:
-        output = generate_excel_today(include_cancelled)
+    try:
+        if date:
+            output = generate_excel_by_date(date, include_cancelled)
+        elif start and end:
+            output = generate_excel_by_range(start, end, include_cancelled)
+        else:
+            output = generate_excel_today(include_cancelled)
+    except ValueError:
+        return jsonify({"status": "fail", "error": "invalid date"}), 400
 
     return send_file(
         output,
@@ -341,58 +359,38 @@ def download_overview_pdf():
     start = request.args.get('start')
     end = request.args.get('end')
     tb_totals = {"totaal": 0, "btw9": 0, "btw21": 0, "orders": 0}
-    period_start = None
-    period_end = None
 
-    if date:
-        query = Order.query.filter(func.date(Order.created_at) == date)
-        try:
-            qdate = datetime.strptime(date, '%Y-%m-%d').date()
-            period_start = period_end = qdate
-            tb_rec = Thuisbezorgd.query.filter_by(date=qdate).first()
-            if tb_rec:
-                tb_totals = tb_rec.to_dict()
-        except Exception:
-            pass
-    elif start and end:
-        query = Order.query.filter(
-            func.date(Order.created_at) >= start,
-            func.date(Order.created_at) <= end
-        )
-        try:
-            s = datetime.strptime(start, '%Y-%m-%d').date()
-            e = datetime.strptime(end, '%Y-%m-%d').date()
-            period_start = s
-            period_end = e
-            records = Thuisbezorgd.query.filter(
-                Thuisbezorgd.date >= s, Thuisbezorgd.date <= e).all()
-            if records:
-                tb_totals = {
-                    'totaal': sum(r.total_incl or 0 for r in records),
-                    'btw9': sum(r.btw_9 or 0 for r in records),
-                    'btw21': sum(r.btw_21 or 0 for r in records),
-                    'orders': sum(r.order_count or 0 for r in records)
-                }
-        except Exception:
-            pass
-    else:
-        today = datetime.now(NL_TZ).date()
-        period_start = period_end = today
-        start_local = datetime.combine(today, datetime.min.time(), tzinfo=NL_TZ)
-        start = start_local.astimezone(UTC).replace(tzinfo=None)
-        query = Order.query.filter(Order.created_at >= start)
-        tb_rec = Thuisbezorgd.query.filter_by(date=today).first()
+    try:
+        if date:
+            period_start = period_end = datetime.strptime(date, '%Y-%m-%d').date()
+        elif start and end:
+            period_start = datetime.strptime(start, '%Y-%m-%d').date()
+            period_end = datetime.strptime(end, '%Y-%m-%d').date()
+        else:
+            period_start = period_end = datetime.now(NL_TZ).date()
+    except ValueError:
+        return jsonify({"status": "fail", "error": "invalid date"}), 400
+
+    if period_start == period_end:
+        tb_rec = Thuisbezorgd.query.filter_by(date=period_start).first()
         if tb_rec:
             tb_totals = tb_rec.to_dict()
+    else:
+        records = Thuisbezorgd.query.filter(
+            Thuisbezorgd.date >= period_start, Thuisbezorgd.date <= period_end).all()
+        if records:
+            tb_totals = {
+                'totaal': sum(r.total_incl or 0 for r in records),
+                'btw9': sum(r.btw_9 or 0 for r in records),
+                'btw21': sum(r.btw_21 or 0 for r in records),
+                'orders': sum(r.order_count or 0 for r in records)
+            }
 
+    summary = period_revenue(period_start, period_end)
     if not include_cancelled:
-        query = query.filter(Order.is_cancelled == False)
-
-    orders = query.order_by(Order.created_at.asc()).all()
-    period_str = None
-    if period_start and period_end:
-        period_str = f"{period_start.strftime('%d/%m/%Y')} – {period_end.strftime('%d/%m/%Y')}"
-    output = build_overview_pdf(orders, tb_totals, period_str)
+        summary.update(cancelled_count=0, cancelled_total=0.0)
+    period_str = f"{period_start.strftime('%d/%m/%Y')} – {period_end.strftime('%d/%m/%Y')}"
+    output = build_overview_pdf(summary, tb_totals, period_str)
     return send_file(
         output,
         mimetype='application/pdf',
@@ -400,21 +398,21 @@ def download_overview_pdf():
         download_name='omzet_overzicht.pdf'
     )
 def generate_excel_by_date(date, include_cancelled=False):
-    query = Order.query.filter(func.date(Order.created_at) == date)
+    period = created_between(date)
+    query = Order.query.filter(period)
     if not include_cancelled:
         query = query.filter(Order.is_cancelled == False)
     orders = query.order_by(Order.created_at.asc()).all()
-    return build_excel(orders)
+    return build_excel(orders, revenue_totals(period))
 def generate_excel_by_range(start, end, include_cancelled=False):
-    query = Order.query.filter(
-        func.date(Order.created_at) >= start,
-        func.date(Order.created_at) <= end
-    )
+    period = created_between(start, end)
+    query = Order.query.filter(period)
     if not include_cancelled:
         query = query.filter(Order.is_cancelled == False)
     orders = query.order_by(Order.created_at.asc()).all()
-    return build_excel(orders)
-def build_excel(orders):
+    return build_excel(orders, revenue_totals(period))
+def build_excel(orders, totals):
+    """Orders sheet plus an 'Omzet Overzicht' sheet from revenue_totals()."""
     order_dicts = orders_to_dicts(orders)
 
     if not order_dicts:
@@ -422,16 +420,9 @@ def build_excel(orders):
     else:
         df = pd.DataFrame(order_dicts)
 
-    # Omzet overzicht berekenen
-    total = sum(float(o['totaal']) for o in order_dicts if not o['is_cancelled'])
-    pin = sum(float(o['totaal']) for o in order_dicts if 'pin' in (o['payment_method'] or '').lower() and not o['is_cancelled'])
-    online = sum(float(o['totaal']) for o in order_dicts if 'online' in (o['payment_method'] or '').lower() and not o['is_cancelled'])
-    contant = sum(float(o['totaal']) for o in order_dicts if 'contant' in (o['payment_method'] or '').lower() and not o['is_cancelled'])
-    credit = sum(float(o['totaal']) for o in order_dicts if 'rekening' in (o['payment_method'] or '').lower() and not o['is_cancelled'])
-
     omzet_data = {
         'Omschrijving': ['Totale omzet', 'Pin betaling', 'Online betaling', 'Contant', 'Op rekening'],
-        'Bedrag': [total, pin, online, contant, credit]
+        'Bedrag': [totals['total'], totals['pin'], totals['online'], totals['contant'], totals['rekening']]
     }
     omzet_df = pd.DataFrame(omzet_data)
 
@@ -483,31 +474,16 @@ def build_maps_link(street: str, house_number: str, postcode: str, city: str) ->
 def orders_to_dicts(orders):
     result = []
     for o in orders:
-        try:
-            o.items_dict = json.loads(o.items or '{}')
-        except Exception:
-            try:
-                import ast
-                o.items_dict = ast.literal_eval(o.items)
-            except Exception:
-                o.items_dict = {}
+        o.items_dict = o.items_data
         totaal = o.totaal or 0
-        subtotal = sum(
-            float(i.get("price", 0)) * int(i.get("qty", 0))
-            for i in o.items_dict.values()
-        )
-        statiegeld = getattr(o, 'statiegeld', 0) or 0
-        delivery_calc = totaal + (o.discountAmount or 0) - subtotal - o.verpakkingskosten - (o.fooi or 0) - statiegeld
-        delivery_calc = round(delivery_calc, 2)
-        delivery = o.bezorgkosten if o.bezorgkosten not in [None, 0] else max(delivery_calc, 0)
-        o.bezorgkosten = delivery
+        statiegeld = o.statiegeld or 0
+        subtotal, delivery = o.stored_totals()
         discount_val = (
             getattr(o, "discount_amount", None)
             or getattr(o, "discountAmount", 0)
             or 0
         )
-        if o.btw_total is None:
-            o.btw_total = (o.btw_9 or 0) + (o.btw_21 or 0)
+        btw_total = o.btw_total if o.btw_total is not None else (o.btw_9 or 0) + (o.btw_21 or 0)
         result.append({
             "id": o.id,
             "order_type": o.order_type,
@@ -538,7 +514,7 @@ def orders_to_dicts(orders):
             "delivery_fee": delivery,
             "btw_9": o.btw_9 or 0,
             "btw_21": o.btw_21 or 0,
-            "btw_total": o.btw_total or 0,
+            "btw_total": btw_total,
             "fooi": o.fooi or 0,
             "tip": o.fooi or 0,
             "statiegeld": statiegeld,
@@ -555,35 +531,30 @@ def orders_to_dicts(orders):
     return result
 
 
-def build_overview_pdf(orders, tb=None, period=None):
+def build_overview_pdf(summary, tb=None, period=None):
+    """Omzet overview PDF from revenue_summary() totals plus Thuisbezorgd."""
     tb = tb or {"totaal": 0, "btw9": 0, "btw21": 0, "orders": 0}
-    order_dicts = orders_to_dicts(orders)
 
-    non_cancelled = [o for o in order_dicts if not o['is_cancelled']]
+    total = summary['total']
+    pin = summary['pin']
+    online = summary['online']
+    contant = summary['contant']
+    credit = summary['rekening']
 
-    total = sum(float(o['totaal']) for o in non_cancelled)
-    pin = sum(float(o['totaal']) for o in non_cancelled if 'pin' in (o['payment_method'] or '').lower())
-    online = sum(float(o['totaal']) for o in non_cancelled if 'online' in (o['payment_method'] or '').lower())
-    contant = sum(float(o['totaal']) for o in non_cancelled if 'contant' in (o['payment_method'] or '').lower())
-    credit = sum(float(o['totaal']) for o in non_cancelled if 'rekening' in (o['payment_method'] or '').lower())
+    total_discount = summary['korting']
+    total_tip = summary['fooi']
+    total_statiegeld = summary['statiegeld']
 
-    btw9 = sum(float(o.get('btw_9', 0)) for o in non_cancelled)
-    btw21 = sum(float(o.get('btw_21', 0)) for o in non_cancelled)
+    delivery_fee_total = summary['bezorgkosten']
+    delivery_count = summary['delivery_count']
 
-    total_discount = sum(float(o.get('korting', 0)) for o in non_cancelled)
-    total_tip = sum(float(o.get('fooi', 0)) for o in non_cancelled)
-    total_statiegeld = sum(float(o.get('statiegeld', 0)) for o in non_cancelled)
-
-    delivery_fee_total = sum(float(o.get('bezorgkosten') or 0) for o in non_cancelled)
-    delivery_count = sum(1 for o in non_cancelled if float(o.get('bezorgkosten') or 0) > 0)
-
-    cancelled_count = sum(1 for o in order_dicts if o['is_cancelled'])
-    cancelled_amount = sum(float(o['totaal']) for o in order_dicts if o['is_cancelled'])
+    cancelled_count = summary['cancelled_count']
+    cancelled_amount = summary['cancelled_total']
 
     total_combined = total + float(tb.get('totaal') or 0)
-    btw9_combined = btw9 + float(tb.get('btw9') or tb.get('btw_9') or 0)
-    btw21_combined = btw21 + float(tb.get('btw21') or tb.get('btw_21') or 0)
-    orders_combined = len(non_cancelled) + int(tb.get('orders') or 0)
+    btw9_combined = summary['btw_9'] + float(tb.get('btw9') or tb.get('btw_9') or 0)
+    btw21_combined = summary['btw_21'] + float(tb.get('btw21') or tb.get('btw_21') or 0)
+    orders_combined = summary['order_count'] + int(tb.get('orders') or 0)
     avg_order = total_combined / orders_combined if orders_combined else 0
 
     def fmt(v):
@@ -700,6 +671,19 @@ socketio = SocketIO(app, cors_allowed_origins="*", async_mode="eventlet")
 login_manager = LoginManager(app)
 login_manager.login_view = "login"
 
+def parse_items_text(text_value) -> dict:
+    """Parse the legacy orders.items text (JSON, or a Python repr from old clients)."""
+    try:
+        items = json.loads(text_value or '{}')
+    except Exception:
+        try:
+            import ast
+            items = ast.literal_eval(text_value)
+        except Exception:
+            items = {}
+    return items if isinstance(items, dict) else {}
+
+
 # 数据模型
 class Order(db.Model):
     __tablename__ = 'orders'
@@ -721,6 +705,7 @@ class Order(db.Model):
     opmerking = db.Column(db.Text)
     items = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     totaal = db.Column(db.Float)
     verpakkingskosten = db.Column(db.Float, default=0.0)
     fooi = db.Column(db.Float, default=0.0)
@@ -736,6 +721,44 @@ class Order(db.Model):
     is_completed = db.Column(db.Boolean, default=False)
     is_cancelled = db.Column(db.Boolean, default=False)
     status = db.Column(db.String(20), default='pending')
+    subtotal = db.Column(db.Float)  # sum of item lines
+    bezorging = db.Column(db.Float)  # delivery fee shown to staff, see set_totals()
+    order_items = db.relationship(
+        'OrderItem', lazy='selectin', order_by='OrderItem.id',
+        cascade='all, delete-orphan', backref='order',
+    )
+
+    @property
+    def items_data(self) -> dict:
+        """Items from order_items, falling back to the legacy text column.
+
+        Assigning ``items`` through the ORM rebuilds order_items; raw SQL
+        writers must update both.
+        """
+        if self.order_items:
+            return {i.name: i.to_item() for i in self.order_items}
+        return parse_items_text(self.items)
+
+    def derived_totals(self):
+        """Return ``(subtotal, bezorging)`` computed from the items and amounts."""
+        subtotal = round(sum(r['price'] * r['qty'] for r in order_item_rows(self.items_data)), 2)
+        if self.bezorgkosten not in [None, 0]:
+            return subtotal, self.bezorgkosten
+        delivery_calc = (
+            (self.totaal or 0) + (self.discountAmount or 0) - subtotal
+            - (self.verpakkingskosten or 0) - (self.fooi or 0) - (self.statiegeld or 0)
+        )
+        return subtotal, max(round(delivery_calc, 2), 0)
+
+    def set_totals(self):
+        """Store the derived money fields; call after any amount or item change."""
+        self.subtotal, self.bezorging = self.derived_totals()
+
+    def stored_totals(self):
+        """``(subtotal, bezorging)`` as stored, computed only for unfilled rows."""
+        if self.bezorging is None or self.subtotal is None:
+            return self.derived_totals()
+        return self.subtotal, self.bezorging
 
 # ✅ 添加的位置
     def to_dict(self):
@@ -756,7 +779,7 @@ class Order(db.Model):
             "street": self.street,
             "city": self.city,
             "opmerking": self.opmerking,
-            "items": json.loads(self.items or '{}'),
+            "items": self.items_data,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "totaal": self.totaal,
             "verpakkingskosten": self.verpakkingskosten,
@@ -776,6 +799,55 @@ class Order(db.Model):
             "status": self.status
         }
 
+class OrderItem(db.Model):
+    """One line of an order; orders.items keeps a JSON copy for older clients."""
+    __tablename__ = 'order_items'
+    id = db.Column(db.Integer, primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.id', ondelete='CASCADE'), nullable=False, index=True)
+    name = db.Column(db.String(200), nullable=False)
+    qty = db.Column(db.Integer, nullable=False, default=0)
+    price = db.Column(db.Float, nullable=False, default=0.0)
+    extra = db.Column(db.Text)  # JSON of any other per-item fields
+
+    def to_item(self) -> dict:
+        item = {'qty': self.qty, 'price': self.price}
+        if self.extra:
+            item.update(json.loads(self.extra))
+        return item
+
+
+def order_item_rows(items) -> list:
+    """Column values for the order_items rows of an items dict; none for a non-dict."""
+    if not isinstance(items, dict):
+        return []
+    rows = []
+    for name, item in items.items():
+        if not isinstance(item, dict):
+            item = {}
+        try:
+            qty = int(float(item.get('qty') or 0))
+        except (TypeError, ValueError):
+            qty = 0
+        try:
+            price = float(item.get('price') or 0)
+        except (TypeError, ValueError):
+            price = 0.0
+        extra = {k: v for k, v in item.items() if k not in ('qty', 'price')}
+        rows.append({
+            'name': str(name)[:200],
+            'qty': qty,
+            'price': price,
+            'extra': json.dumps(extra) if extra else None,
+        })
+    return rows
+
+
+@event.listens_for(Order.items, 'set')
+def _sync_order_items(order, value, oldvalue, initiator):
+    """Keep order_items in step with the items text on every assignment."""
+    order.order_items = [OrderItem(**row) for row in order_item_rows(parse_items_text(value))]
+
+
 class Thuisbezorgd(db.Model):
     __tablename__ = 'thuisbezorgd'
     id = db.Column(db.Integer, primary_key=True)
@@ -796,6 +868,180 @@ class Thuisbezorgd(db.Model):
             "statiegeld": self.statiegeld or 0.0,
         }
 
+
+# ----- Daily revenue -----
+# Same table and rules as in app.py: one row of omzet totals per Amsterdam
+# day, recomputed from the orders after every insert, edit or cancel.
+REVENUE_METHODS = ('pin', 'online', 'contant', 'rekening')
+REVENUE_FIELDS = (
+    'order_count', 'total', *REVENUE_METHODS, 'btw_9', 'btw_21', 'korting', 'fooi',
+    'statiegeld', 'bezorgkosten', 'delivery_count', 'cancelled_count', 'cancelled_total',
+)
+REVENUE_COUNTS = ('order_count', 'delivery_count', 'cancelled_count')
+
+
+class DailyRevenue(db.Model):
+    __tablename__ = 'daily_revenue'
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, unique=True, nullable=False)
+    order_count = db.Column(db.Integer, default=0)
+    total = db.Column(db.Float, default=0.0)
+    pin = db.Column(db.Float, default=0.0)
+    online = db.Column(db.Float, default=0.0)
+    contant = db.Column(db.Float, default=0.0)
+    rekening = db.Column(db.Float, default=0.0)
+    btw_9 = db.Column(db.Float, default=0.0)
+    btw_21 = db.Column(db.Float, default=0.0)
+    korting = db.Column(db.Float, default=0.0)
+    fooi = db.Column(db.Float, default=0.0)
+    statiegeld = db.Column(db.Float, default=0.0)
+    bezorgkosten = db.Column(db.Float, default=0.0)
+    delivery_count = db.Column(db.Integer, default=0)
+    cancelled_count = db.Column(db.Integer, default=0)
+    cancelled_total = db.Column(db.Float, default=0.0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    def to_dict(self):
+        return dict({f: getattr(self, f) or 0 for f in REVENUE_FIELDS}, date=self.date.isoformat())
+
+
+def fold_daily_revenue(rows) -> dict:
+    """Sum slim order rows (see _revenue_rows) into ``{nl_date: fields}``."""
+    days = {}
+    for created_at, totaal, method, btw_9, btw_21, korting, fooi, statiegeld, bezorg, cancelled in rows:
+        day = to_nl(created_at).date()
+        r = days.get(day)
+        if r is None:
+            r = days[day] = dict.fromkeys(REVENUE_FIELDS, 0)
+        totaal = float(totaal or 0)
+        if cancelled:
+            r['cancelled_count'] += 1
+            r['cancelled_total'] += totaal
+            continue
+        r['order_count'] += 1
+        r['total'] += totaal
+        method = (method or '').lower()
+        for key in REVENUE_METHODS:
+            if key in method:
+                r[key] += totaal
+        r['btw_9'] += float(btw_9 or 0)
+        r['btw_21'] += float(btw_21 or 0)
+        r['korting'] += float(korting or 0)
+        r['fooi'] += float(fooi or 0)
+        r['statiegeld'] += float(statiegeld or 0)
+        bezorg = float(bezorg or 0)
+        r['bezorgkosten'] += bezorg
+        if bezorg > 0:
+            r['delivery_count'] += 1
+    for r in days.values():
+        for key, value in r.items():
+            if isinstance(value, float):
+                r[key] = round(value, 2)
+    return days
+
+
+def _revenue_rows(first, last):
+    start, end = nl_day_bounds(first, last)
+    return db.session.query(
+        Order.created_at, Order.totaal, Order.payment_method, Order.btw_9, Order.btw_21,
+        Order.discountAmount, Order.fooi, Order.statiegeld,
+        func.coalesce(Order.bezorging, Order.bezorgkosten), Order.is_cancelled,
+    ).filter(Order.created_at >= start, Order.created_at < end)
+
+
+def rebuild_daily_revenue(first, last=None) -> int:
+    """Recompute daily_revenue for the NL dates first..last and commit."""
+    last = first if last is None else last
+    days = fold_daily_revenue(_revenue_rows(first, last))
+    empty = DailyRevenue.query.filter(DailyRevenue.date >= first, DailyRevenue.date <= last)
+    if days:
+        empty = empty.filter(DailyRevenue.date.notin_(list(days)))
+    empty.delete(synchronize_session=False)
+    if days:
+        stmt = pg_insert(DailyRevenue.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['date'],
+            set_={f: stmt.excluded[f] for f in (*REVENUE_FIELDS, 'updated_at')},
+        )
+        now = datetime.utcnow()
+        db.session.execute(stmt, [dict(r, date=day, updated_at=now) for day, r in days.items()])
+    db.session.commit()
+    return len(days)
+
+
+def revenue_summary(first, last=None) -> dict:
+    """daily_revenue fields summed over the NL dates first..last."""
+    last = first if last is None else last
+    row = db.session.query(
+        *[func.coalesce(func.sum(getattr(DailyRevenue, f)), 0) for f in REVENUE_FIELDS]
+    ).filter(DailyRevenue.date >= first, DailyRevenue.date <= last).one()
+    return {f: round(v, 2) if isinstance(v, float) else v for f, v in zip(REVENUE_FIELDS, row)}
+
+
+def revenue_totals(*criteria) -> dict:
+    """REVENUE_FIELDS for the orders matching ``criteria`` in one query.
+
+    Each field is a SUM(CASE ...) over the same scan, so any period comes
+    back as a single row; used where daily_revenue cannot answer.
+    """
+    cancelled = Order.is_cancelled == True
+    live = or_(Order.is_cancelled.is_(None), Order.is_cancelled == False)
+    method = func.lower(Order.payment_method)
+    totaal = func.coalesce(Order.totaal, 0)
+    bezorg = func.coalesce(Order.bezorging, Order.bezorgkosten, 0)
+
+    def amount(value, *conds):
+        return func.coalesce(func.sum(case((and_(live, *conds), func.coalesce(value, 0)), else_=0)), 0)
+
+    def count(*conds):
+        return func.coalesce(func.sum(case((and_(*conds), 1), else_=0)), 0)
+
+    columns = {
+        'order_count': count(live),
+        'total': amount(totaal),
+        **{key: amount(totaal, method.contains(key)) for key in REVENUE_METHODS},
+        'btw_9': amount(Order.btw_9),
+        'btw_21': amount(Order.btw_21),
+        'korting': amount(Order.discountAmount),
+        'fooi': amount(Order.fooi),
+        'statiegeld': amount(Order.statiegeld),
+        'bezorgkosten': amount(bezorg),
+        'delivery_count': count(live, bezorg > 0),
+        'cancelled_count': count(cancelled),
+        'cancelled_total': func.coalesce(func.sum(case((cancelled, totaal), else_=0)), 0),
+    }
+    row = db.session.query(*[c.label(k) for k, c in columns.items()]).filter(*criteria).one()
+    return {f: round(float(v), 2) if f not in REVENUE_COUNTS else int(v) for f, v in zip(columns, row)}
+
+
+def period_revenue(first, last=None) -> dict:
+    """Totals for the NL dates first..last.
+
+    Closed days come from daily_revenue; today is still changing, so its
+    share is read live with revenue_totals().
+    """
+    last = first if last is None else last
+    today = datetime.now(NL_TZ).date()
+    closed_last = min(last, today - timedelta(days=1))
+    if first <= closed_last:
+        totals = revenue_summary(first, closed_last)
+    else:
+        totals = dict.fromkeys(REVENUE_FIELDS, 0)
+    if first <= today <= last:
+        live = revenue_totals(created_between(today))
+        totals = {f: round(totals[f] + live[f], 2) for f in REVENUE_FIELDS}
+    return totals
+
+
+def refresh_revenue(order):
+    """Rebuild the daily_revenue row of a committed order's day."""
+    try:
+        rebuild_daily_revenue(to_nl(order.created_at).date())
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ daily_revenue not refreshed: {e}")
+
+
 class Setting(db.Model):
     __tablename__ = 'settings'
     key = db.Column(db.String(50), primary_key=True)
@@ -854,6 +1100,85 @@ class XbentoOption(db.Model):
     price = db.Column(db.Float, default=0.0)
 
 
+class ItemAvailability(db.Model):
+    __tablename__ = 'item_availability'
+    key = db.Column(db.String(60), primary_key=True)
+    name = db.Column(db.String(100))
+    menu_item_id = db.Column(db.Integer, db.ForeignKey('menu_items.id'))
+    sold_out = db.Column(db.Boolean, default=False, nullable=False)
+
+
+class CacheVersion(db.Model):
+    __tablename__ = 'cache_versions'
+    name = db.Column(db.String(30), primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+
+
+# ----- Shared caches -----
+# The web app (app.py) keeps settings, sold-out flags, the menu, the option
+# lists and today's slot load in memory. It polls cache_versions, so every
+# flush here that touches one of those tables bumps the matching row in the
+# same transaction.
+CACHE_TABLES = {
+    'settings': 'settings',
+    'item_availability': 'settings',
+    'menu_sections': 'menu',
+    'menu_items': 'menu',
+    'bubble_options': 'bubble_options',
+    'xbento_options': 'xbento_options',
+    'orders': 'orders',
+}
+
+
+def bump_cache_version(*names, connection=None):
+    """Mark app.py's cached copy of ``names`` stale. Runs in the caller's transaction."""
+    table = CacheVersion.__table__
+    conn = connection if connection is not None else db.session
+    for name in sorted(names):
+        stmt = pg_insert(table).values(name=name, version=1)
+        conn.execute(stmt.on_conflict_do_update(
+            index_elements=['name'], set_={'version': table.c.version + 1}
+        ))
+
+
+@event.listens_for(db.session, 'after_flush')
+def _bump_shared_caches(session, flush_context):
+    names = {
+        CACHE_TABLES.get(obj.__table__.name)
+        for obj in (*session.new, *session.dirty, *session.deleted)
+    }
+    names.discard(None)
+    if names:
+        bump_cache_version(*names, connection=session.connection())
+
+
+def sold_out_flags() -> dict:
+    """Sold-out flags as settings keys: ``{'soldout_<key>': 'true' | 'false'}``."""
+    return {
+        f'soldout_{key}': 'true' if sold_out else 'false'
+        for key, sold_out in db.session.query(ItemAvailability.key, ItemAvailability.sold_out)
+    }
+
+
+def set_sold_out(flags: dict):
+    """Write ``{key: bool}`` sold-out flags to item_availability. The caller commits."""
+    if not flags:
+        return
+    table = ItemAvailability.__table__
+    stmt = pg_insert(table).values([{'key': k, 'sold_out': v} for k, v in flags.items()])
+    db.session.execute(stmt.on_conflict_do_update(
+        index_elements=['key'], set_={'sold_out': stmt.excluded.sold_out}
+    ))
+    bump_cache_version('settings')
+
+
+def settings_dict() -> dict:
+    """All settings rows plus the sold-out flags, as the browsers expect them."""
+    settings = {s.key: s.value for s in Setting.query.all()}
+    settings.update(sold_out_flags())
+    return settings
+
+
 with app.app_context():
     db.create_all()
     defaults = {
@@ -877,77 +1202,6 @@ with app.app_context():
         "price_beef_crispy_rice_sandwich": "7.5",
         "price_california_crispy_rice_sandwich": "7.5",
         "price_chicken_crispy_rice_sandwich": "7",
-        "soldout_japans_chicken_bento": "false",
-        "soldout_korean_chicken_bento": "false",
-        "soldout_korean_beef_bento": "false",
-        "soldout_meatlover_bento": "false",
-        "soldout_zalm_lover_bento": "false",
-        "soldout_ebi_lover_bento": "false",
-        "soldout_surf_turf_bento": "false",
-        "soldout_dimsum_bento": "false",
-        "soldout_lamskotelet_bento": "false",
-        "soldout_unagi_bento": "false",
-        "soldout_veggie_bento": "false",
-        "soldout_sushi_bento": "false",
-        "soldout_salmon_roll": "false",
-        "soldout_dragon_roll": "false",
-        "soldout_beef_roll": "false",
-        "soldout_chicken_roll": "false",
-        "soldout_nigiri_box": "false",
-        "soldout_salmon_sashimi": "false",
-        "soldout_flamed_salmon_sashimi": "false",
-        "soldout_tonijn_sashimi": "false",
-        "soldout_flamed_tonijn_sashimi": "false",
-        "soldout_beef_sashimi": "false",
-        "soldout_zalm_crispy_rice_sandwich": "false",
-        "soldout_spicytuna_crispy_rice_sandwich": "false",
-        "soldout_ebi_crispy_rice_sandwich": "false",
-        "soldout_beef_crispy_rice_sandwich": "false",
-        "soldout_california_crispy_rice_sandwich": "false",
-        "soldout_chicken_crispy_rice_sandwich": "false",
-        "soldout_xbento": "false",
-        "soldout_zalm_bowl": "false",
-        "soldout_tuna_bowl": "false",
-        "soldout_ebi_fry_bowl": "false",
-        "soldout_chicken_karaage_bowl": "false",
-        "soldout_spicy_chicken_bowl": "false",
-        "soldout_teriyaki_chicken_bowl": "false",
-        "soldout_teriyaki_beef_bowl": "false",
-        "soldout_california_bowl": "false",
-        "soldout_vega_bowl": "false",
-        "soldout_meatlover_bowl": "false",
-        "soldout_rainbow_bowl": "false",
-        "soldout_spicy_tuna_bowl": "false",
-        "soldout_flamed_zalm_bowl": "false",
-        "soldout_flamed_tuna_bowl": "false",
-        "soldout_x_bowl": "false",
-        "soldout_ebi_ramen": "false",
-        "soldout_chicken_ramen": "false",
-        "soldout_beef_ramen": "false",
-        "soldout_ribeye_ramen": "false",
-        "soldout_chasiu_ramen": "false",
-        "soldout_karaage": "false",
-        "soldout_ebi_fry": "false",
-        "soldout_spicy_crispy_chicken": "false",
-        "soldout_chicken_loempia": "false",
-        "soldout_gyoza": "false",
-        "soldout_inktvis_ringen": "false",
-        "soldout_sesambal": "false",
-        "soldout_yakitori": "false",
-        "soldout_mini_loempia": "false",
-        "soldout_edamame": "false",
-        "soldout_kimchi_komkommer": "false",
-        "soldout_kimchi_kool": "false",
-        "soldout_zeewiersalade": "false",
-        "soldout_mochi_mango": "false",
-        "soldout_mochi_aardbei": "false",
-        "soldout_mochi_matcha": "false",
-        "soldout_mochi_pistachio": "false",
-        "soldout_cola": "false",
-        "soldout_cola_zero": "false",
-        "soldout_spa_blauw": "false",
-        "soldout_spa_rood": "false",
-        "soldout_red_bull": "false",
     }
     for k, v in defaults.items():
         if not Setting.query.filter_by(key=k).first():
@@ -1001,6 +1255,14 @@ def pos():
         data = request.get_json() or {}
         order_number = data.get("order_number") or data.get("orderNumber")
 
+        # A retried till submit gets the original response.
+        if order_number:
+            existing = Order.query.filter_by(order_number=order_number).first()
+            if existing:
+                if not is_same_order(existing, data):
+                    return order_conflict_response()
+                return pos_order_response(existing, replay=True)
+
         order = Order(
             order_type=data.get("order_type") or data.get("orderType"),
             customer_name=data.get("customer_name") or data.get("name"),
@@ -1018,20 +1280,72 @@ def pos():
             order_number=order_number,
             status=data.get("status") or "pending"
         )
+        order.set_totals()
         db.session.add(order)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent retry stored the same order_number first.
+            db.session.rollback()
+            existing = Order.query.filter_by(order_number=order_number).first() if order_number else None
+            if existing is None:
+                raise
+            if not is_same_order(existing, data):
+                return order_conflict_response()
+            return pos_order_response(existing, replay=True)
+        refresh_revenue(order)
+
+        return pos_order_response(order)
 
+    # 之前会在此向 POS 页面推送今日订单信息，现已不再需要
+    return render_template("pos.html")
 
-        resp = {"success": True, "status": order.status}
-        if str(order.payment_method).lower() == "online":
-            url = os.getenv("TIKKIE_URL")
-            if url:
-                resp["paymentLink"] = url
 
-        return jsonify(resp)
+def pos_order_response(order, replay=False):
+    """The /pos success body for a stored order."""
+    resp = {"success": True, "status": order.status}
+    if str(order.payment_method).lower() == "online":
+        url = os.getenv("TIKKIE_URL")
+        if url:
+            resp["paymentLink"] = url
+    response = jsonify(resp)
+    if replay:
+        response.headers['X-Idempotent-Replay'] = 'true'
+    return response
+
+
+def order_response(order, replay=False):
+    """The api_orders success body for a stored order."""
+    resp = {"status": "ok"}
+    if str(order.payment_method).lower() == "online":
+        pay_url = os.getenv("TIKKIE_URL")
+        if pay_url:
+            resp["paymentLink"] = pay_url
+    response = jsonify(resp)
+    if replay:
+        response.headers['X-Idempotent-Replay'] = 'true'
+    return response, 200
+
+
+def is_same_order(existing, data) -> bool:
+    """Whether ``data`` is a retry of ``existing`` and not a new order
+    that happens to reuse its order_number: same phone, items and total."""
+    if (existing.phone or '') != (data.get("phone") or ''):
+        return False
+    if parse_items_text(existing.items) != (data.get("items") or {}):
+        return False
+    totaal = data.get("totaal")
+    if totaal in (None, ''):
+        return True
+    try:
+        return abs(float(totaal) - float(existing.totaal or 0)) < 0.005
+    except (TypeError, ValueError):
+        return False
 
-    # 之前会在此向 POS 页面推送今日订单信息，现已不再需要
-    return render_template("pos.html")
+
+def order_conflict_response():
+    """The 409 for an order_number already used by a different order."""
+    return jsonify({"status": "fail", "error": "order_number already used for a different order"}), 409
 
 
 
@@ -1042,6 +1356,17 @@ def api_orders():
         data = request.get_json() or {}
         order_number = data.get("order_number") or data.get("orderNumber")
 
+        # Retries of an order that was already stored get the original response.
+        if order_number:
+            existing = Order.query.filter_by(order_number=order_number).first()
+            if existing:
+                if not is_same_order(existing, data):
+                    return order_conflict_response()
+                return order_response(existing, replay=True)
+
+        if not isinstance(data.get("items", {}), dict):
+            return jsonify({"status": "fail", "error": "items must be an object"}), 400
+
         # ===== 新时间判断逻辑开始 =====
         from datetime import datetime
 
@@ -1117,11 +1442,7 @@ def api_orders():
         )
 
         # 2. 计算 subtotal / totaal
-        items = json.loads(order.items or "{}")
-        subtotal = sum(
-            float(i.get("price", 0)) * int(i.get("qty", 0))
-            for i in items.values()
-        )
+        subtotal = sum(i.price * i.qty for i in order.order_items)
         order.totaal = float(data.get("totaal") or subtotal)
 
         order.verpakkingskosten = float(summary_data.get("packaging") or 0)
@@ -1144,9 +1465,22 @@ def api_orders():
         if order.discountCode and str(order.discountCode).upper() == "KASSA":
             order.discountCode = "kassa korting"
 
+        order.set_totals()
+
         # 4. 保存订单到数据库
         db.session.add(order)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # A concurrent retry stored the same order_number first.
+            db.session.rollback()
+            existing = Order.query.filter_by(order_number=order_number).first() if order_number else None
+            if existing is None:
+                raise
+            if not is_same_order(existing, data):
+                return order_conflict_response()
+            return order_response(existing, replay=True)
+        refresh_revenue(order)
 
         # 5. 如有新折扣码，记录到 discount_codes 表
         customer_email = (
@@ -1174,13 +1508,7 @@ def api_orders():
         print("✅ 接收到订单:", data)
 
         # 6. 返回响应
-        resp = {"status": "ok"}
-        if str(order.payment_method).lower() == "online":
-            pay_url = os.getenv("TIKKIE_URL")
-            if pay_url:
-                resp["paymentLink"] = pay_url
-
-        return jsonify(resp), 200
+        return order_response(order)
 
     except Exception as e:
         import traceback
@@ -1241,13 +1569,14 @@ def validate_discount():
 # 获取设置
 @app.route('/api/settings/<key>')
 def get_setting(key):
+    if key.startswith('soldout_'):
+        return jsonify({key: sold_out_flags().get(key)})
     s = Setting.query.filter_by(key=key).first()
     return jsonify({key: s.value if s else None})
 
 @app.route('/api/settings')
 def get_all_settings():
-    settings = {s.key: s.value for s in Setting.query.all()}
-    return jsonify(settings)
+    return jsonify(settings_dict())
 
 # ----- Menu API -----
 @app.route('/api/menu')
@@ -1280,13 +1609,8 @@ def api_update_item():
             pass
     soldout_key = data.get('soldout_key')
     if soldout_key is not None and 'sold_out' in data:
-        val = 'true' if data.get('sold_out') else 'false'
-        s = Setting.query.filter_by(key=soldout_key).first()
-        if not s:
-            s = Setting(key=soldout_key, value=val)
-            db.session.add(s)
-        else:
-            s.value = val
+        key = soldout_key[len('soldout_'):] if soldout_key.startswith('soldout_') else soldout_key
+        set_sold_out({key: bool(data.get('sold_out'))})
     db.session.commit()
     items = [
         {
@@ -1298,8 +1622,7 @@ def api_update_item():
         } for i in MenuItem.query.all()
     ]
     socketio.emit('menu_update', items)
-    settings = {s.key: s.value for s in Setting.query.all()}
-    socketio.emit('setting_update', settings)
+    socketio.emit('setting_update', settings_dict())
     return jsonify({'success': True})
 
 @app.route('/api/bubble_options')
@@ -1321,7 +1644,9 @@ def update_order_status(order_id: int):
         order.is_cancelled = bool(data['is_cancelled'])
     if 'status' in data:
         order.status = data['status']
-    db.session.commit()
+    db.session.commit()
+    if 'is_cancelled' in data:
+        refresh_revenue(order)
     return jsonify({'success': True, 'is_completed': order.is_completed, 'is_cancelled': order.is_cancelled, 'status': order.status})
 
 
@@ -1374,7 +1699,9 @@ def edit_order(order_id: int):
             order.fooi = float(data['tip'])
         except (TypeError, ValueError):
             order.fooi = 0.0
+    order.set_totals()
     db.session.commit()
+    refresh_revenue(order)
     return jsonify({'success': True})
 
 # ----- Review API -----
@@ -1474,7 +1801,11 @@ def delete_review(review_id: int):
 @app.route('/dashboard')
 @login_required
 def dashboard():
+    sold_out = sold_out_flags()
+
     def get_value(key, default):
+        if key.startswith('soldout_'):
+            return sold_out.get(key, default)
         s = Setting.query.filter_by(key=key).first()
         return s.value if s else default
 
@@ -1683,6 +2014,7 @@ def update_setting():
     soldout_spa_rood_val = data.get('soldout_spa_rood', 'false')
     soldout_red_bull_val = data.get('soldout_red_bull', 'false')
     
+    sold_out = {}
     for key, val in [
         ('is_open', is_open_val),
         ('open_time', open_time_val),
@@ -1772,14 +2104,18 @@ def update_setting():
         ('soldout_red_bull', soldout_red_bull_val),
         
     ]:
+        if key.startswith('soldout_'):
+            sold_out[key[len('soldout_'):]] = str(val).lower() == 'true'
+            continue
         s = Setting.query.filter_by(key=key).first()
         if not s:
             db.session.add(Setting(key=key, value=val))
         else:
             s.value = val
+    set_sold_out(sold_out)
 
     db.session.commit()
-    settings = {s.key: s.value for s in Setting.query.all()}
+    settings = settings_dict()
     socketio.emit('setting_update', settings)
     time_settings = {
         'pickup_start': settings.get('pickup_start'),
@@ -2019,14 +2355,7 @@ def admin_orders():
     order_data = []
 
     for o in orders:
-        try:
-            items = json.loads(o.items or "{}")
-        except Exception:
-            try:
-                import ast
-                items = ast.literal_eval(o.items)
-            except Exception:
-                items = {}
+        items = o.items_data
 
         o.created_at_local = to_nl(o.created_at)
         # 不再重新计算 o.totaal，而是使用数据库字段的原值
@@ -2103,34 +2432,21 @@ def admin_review_list():
 @app.route('/pos/orders_today')
 
 def pos_orders_today():
-    today = datetime.now(NL_TZ).date()
-    start_local = datetime.combine(today, datetime.min.time(), tzinfo=NL_TZ)
-    start = start_local.astimezone(UTC).replace(tzinfo=None)
-
     # Refresh session to ensure latest payment status is fetched
     db.session.expire_all()
     orders = (Order.query
-              .filter(Order.created_at >= start)
+              .filter(created_between(datetime.now(NL_TZ).date()))
               .order_by(Order.created_at.desc())
               .all())
     order_dicts = []
 
     for o in orders:
         # --- items 解析 ---
-        try:
-            o.items_dict = json.loads(o.items or "{}")
-        except Exception:
-            try:
-                import ast
-                o.items_dict = ast.literal_eval(o.items)
-            except Exception as e:
-                print(f"❌ JSON解析失败: {e}")
-                o.items_dict = {}
+        o.items_dict = o.items_data
 
         # --- 金额推导（保留你的思路，但别回写 o 的字段，避免副作用）---
         totaal = o.totaal or 0.0
-        subtotal = sum(float(i.get("price", 0)) * int(i.get("qty", 0))
-                       for i in o.items_dict.values())
+        subtotal, delivery = o.stored_totals()
 
         # 严格分流：本次 vs 下次
         this_code = getattr(o, "discountCode", None)
@@ -2144,8 +2460,6 @@ def pos_orders_today():
         statiegeld = getattr(o, 'statiegeld', 0.0) or 0.0
 
         # 仅用于显示的配送费估算（不改写 o.bezorgkosten）
-        delivery_calc = round(totaal - subtotal - verp - fooi - statiegeld + (this_amt or 0.0), 2)
-        delivery = o.bezorgkosten if o.bezorgkosten not in [None, 0] else max(delivery_calc, 0.0)
 
         btw_total = o.btw_total
         btw_21 = o.btw_21
@@ -2217,6 +2531,48 @@ def pos_orders_today():
 
 
 
+# ----- Incremental order lists -----
+# Same contract as /pos/orders in app.py: today's orders created or changed
+# after the cursor, looking ORDER_CURSOR_OVERLAP back for late commits;
+# continuation pages use an "<updated_at>~<id>" keyset cursor.
+ORDER_CURSOR_OVERLAP = timedelta(seconds=5)
+ORDER_CURSOR_PAGE = 500
+ORDER_CURSOR_SEP = '~'
+
+
+def orders_since(cursor, page=ORDER_CURSOR_PAGE):
+    """Today's orders changed after ``cursor``: ``(orders, next_cursor, more)``."""
+    query = Order.query.filter(created_between(datetime.now(NL_TZ).date()))
+    if cursor and ORDER_CURSOR_SEP in cursor:
+        stamp, last_id = cursor.split(ORDER_CURSOR_SEP, 1)
+        stamp, last_id = datetime.fromisoformat(stamp), int(last_id)
+        query = query.filter(or_(Order.updated_at > stamp,
+                                 and_(Order.updated_at == stamp, Order.id > last_id)))
+    elif cursor:
+        query = query.filter(Order.updated_at > datetime.fromisoformat(cursor) - ORDER_CURSOR_OVERLAP)
+    orders = query.order_by(Order.updated_at, Order.id).limit(page + 1).all()
+    more = len(orders) > page
+    orders = orders[:page]
+    if more:
+        last = orders[-1]
+        next_cursor = f"{last.updated_at.isoformat()}{ORDER_CURSOR_SEP}{last.id}"
+    elif orders:
+        next_cursor = orders[-1].updated_at.isoformat()
+    else:
+        next_cursor = datetime.utcnow().isoformat() if not cursor else cursor.split(ORDER_CURSOR_SEP)[0]
+    return orders, next_cursor, more
+
+
+@app.route('/pos/orders')
+@login_required
+def pos_orders():
+    try:
+        orders, cursor, more = orders_since(request.args.get('since'))
+    except ValueError:
+        return jsonify({"status": "fail", "error": "invalid cursor"}), 400
+    return jsonify({"cursor": cursor, "more": more, "orders": orders_to_dicts(orders)})
+
+
 @app.route('/pos/orders_by_date')
 @login_required
 def pos_orders_by_date():
@@ -2226,20 +2582,9 @@ def pos_orders_by_date():
     except Exception:
         return jsonify([])
 
-    start_local = datetime.combine(qdate, datetime.min.time(), tzinfo=NL_TZ)
-    end_local = datetime.combine(qdate, datetime.max.time(), tzinfo=NL_TZ)
-    start = start_local.astimezone(UTC).replace(tzinfo=None)
-    end = end_local.astimezone(UTC).replace(tzinfo=None)
-    orders = Order.query.filter(Order.created_at >= start, Order.created_at <= end).order_by(Order.created_at.desc()).all()
+    orders = Order.query.filter(created_between(qdate)).order_by(Order.created_at.desc()).all()
     for o in orders:
-        try:
-            o.items_dict = json.loads(o.items or '{}')
-        except Exception:
-            try:
-                import ast
-                o.items_dict = ast.literal_eval(o.items)
-            except Exception:
-                o.items_dict = {}
+        o.items_dict = o.items_data
         o.created_at_local = to_nl(o.created_at)
         o.maps_link = build_maps_link(o.street, o.house_number, o.postcode, o.city)
 
@@ -2259,20 +2604,9 @@ def pos_orders_range():
     except Exception:
         return jsonify([])
 
-    start_local = datetime.combine(sdate, datetime.min.time(), tzinfo=NL_TZ)
-    end_local = datetime.combine(edate, datetime.max.time(), tzinfo=NL_TZ)
-    start = start_local.astimezone(UTC).replace(tzinfo=None)
-    end = end_local.astimezone(UTC).replace(tzinfo=None)
-    orders = Order.query.filter(Order.created_at >= start, Order.created_at <= end).order_by(Order.created_at.desc()).all()
+    orders = Order.query.filter(created_between(sdate, edate)).order_by(Order.created_at.desc()).all()
     for o in orders:
-        try:
-            o.items_dict = json.loads(o.items or '{}')
-        except Exception:
-            try:
-                import ast
-                o.items_dict = ast.literal_eval(o.items)
-            except Exception:
-                o.items_dict = {}
+        o.items_dict = o.items_data
         o.created_at_local = to_nl(o.created_at)
         o.maps_link = build_maps_link(o.street, o.house_number, o.postcode, o.city)
 
@@ -103,6 +103,11 @@ ipcMain.handle('get-google-maps-key', () => {
   return '';
 });
 
+// pos_join 用的令牌（与服务器的 POS_SOCKET_TOKEN 相同）
+ipcMain.handle('get-pos-socket-token', () => {
+  return process.env.POS_SOCKET_TOKEN || '';
+});
+
 ipcMain.on('play-ding', async () => {
   stopDing = false;
   const loop = async () => {
@@ -7,6 +7,7 @@ let dingAudio = null;
 
 contextBridge.exposeInMainWorld('api', {
   getGoogleMapsKey: () => ipcRenderer.invoke('get-google-maps-key'),
+  getPosSocketToken: () => ipcRenderer.invoke('get-pos-socket-token'),
 
   // ✅ 补一个通用 invoke/send，和我之前示例保持一致
   invoke: (channel, ...args) => ipcRenderer.invoke(channel, ...args),
@@ -0,0 +1,109 @@
+"""Benchmark the payment webhook against a large orders table.
+
+Fills an EMPTY database with synthetic orders, then times
+POST /api/orders/update_status, and the UPDATE it runs with and without
+the order_number index. The index is dropped inside one transaction that
+is always rolled back, so it is back even if the script is killed.
+Never point this at a database that holds real orders; it refuses to run
+if the orders table is not empty.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python scripts/bench_order_lookup.py
+    DATABASE_URL=sqlite:////tmp/bench.db python scripts/bench_order_lookup.py --orders 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import app as A  # noqa: E402
+from sqlalchemy import text  # noqa: E402
+
+BATCH = 10000
+
+
+def fill(n):
+    start = datetime.utcnow() - timedelta(days=365)
+    rows_done = 0
+    with A.db.engine.begin() as conn:
+        while rows_done < n:
+            batch = [
+                {
+                    'order_number': f'SYN{i:08d}',
+                    'order_type': 'afhalen' if i % 3 else 'bezorgen',
+                    'created_at': start + timedelta(seconds=i * 30),
+                    'items': '{}',
+                    'totaal': 20.0,
+                    'status': 'pending',
+                }
+                for i in range(rows_done, min(rows_done + BATCH, n))
+            ]
+            conn.execute(A.Order.__table__.insert(), batch)
+            rows_done += len(batch)
+
+
+def time_webhook(client, n, calls):
+    samples = []
+    for _ in range(calls):
+        number = f'SYN{random.randrange(n):08d}'
+        t0 = time.perf_counter()
+        r = client.post('/api/orders/update_status', json={'order_number': number, 'status': 'paid'})
+        samples.append(time.perf_counter() - t0)
+        assert r.status_code == 200, r.get_json()
+    return percentiles(samples)
+
+
+def percentiles(samples):
+    samples.sort()
+    return samples[len(samples) // 2], samples[int(len(samples) * 0.99) - 1]
+
+
+def time_update(conn, n, calls):
+    """Time the webhook's UPDATE on ``conn``, inside its open transaction."""
+    table = A.Order.__table__
+    samples = []
+    for _ in range(calls):
+        number = f'SYN{random.randrange(n):08d}'
+        t0 = time.perf_counter()
+        conn.execute(table.update().where(table.c.order_number == number).values(status='paid'))
+        samples.append(time.perf_counter() - t0)
+    return percentiles(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=1_000_000)
+    parser.add_argument('--calls', type=int, default=200)
+    args = parser.parse_args()
+
+    client = A.app.test_client()
+    with A.app.app_context():
+        if A.db.session.query(A.Order.id).first() is not None:
+            sys.exit('orders table is not empty; use a scratch database')
+        t0 = time.perf_counter()
+        fill(args.orders)
+        print(f'inserted {args.orders} orders in {time.perf_counter() - t0:.1f}s')
+
+        p50, p99 = time_webhook(client, args.orders, args.calls)
+        print(f'webhook            p50 {p50 * 1e3:8.2f} ms   p99 {p99 * 1e3:8.2f} ms')
+
+        # DDL is transactional on Postgres and SQLite: the DROP and the
+        # UPDATEs are undone by the rollback. The first UPDATE also opens the
+        # transaction on SQLite, where a leading DROP would autocommit.
+        with A.db.engine.connect() as conn:
+            trans = conn.begin()
+            try:
+                p50, p99 = time_update(conn, args.orders, args.calls)
+                print(f'update, indexed    p50 {p50 * 1e3:8.2f} ms   p99 {p99 * 1e3:8.2f} ms')
+                conn.execute(text('DROP INDEX uq_orders_order_number'))
+                p50, p99 = time_update(conn, args.orders, max(args.calls // 10, 5))
+                print(f'update, no index   p50 {p50 * 1e3:8.2f} ms   p99 {p99 * 1e3:8.2f} ms')
+            finally:
+                trans.rollback()
+
+
+if __name__ == '__main__':
+    main()
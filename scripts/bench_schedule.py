@@ -0,0 +1,93 @@
+"""Micro-benchmark for order-time validation.
+
+Compares the per-request parsing api_orders used to do with
+OrderSchedule.check_time(). Needs DATABASE_URL like the app itself, e.g.
+
+    DATABASE_URL=sqlite:////tmp/bench.db python scripts/bench_schedule.py
+"""
+import os
+import sys
+import timeit
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import app as A  # noqa: E402
+
+SETTINGS = {
+    'is_open': True,
+    'closed_days': ['Monday'],
+    'pickup_enabled': True,
+    'pickup_start': 11 * 60,
+    'pickup_end': 21 * 60 + 30,
+    'delivery_enabled': True,
+    'delivery_start': 16 * 60 + 30,
+    'delivery_end': 21 * 60,
+}
+CLOSED = {'pickup': {'18:00': 'full'}, 'delivery': {'19:00': 'closed', '19:45': 'full'}}
+RAW = {
+    'pickup_start': '11:00', 'pickup_end': '21:30',
+    'delivery_start': '16:30', 'delivery_end': '21:00',
+    'closed_days': 'Monday',
+}
+NOW = datetime(2026, 10, 16, 15, 7, 12, tzinfo=A.NL_TZ)
+TIMES = ['12:15', '18:30', '19:45', '22:00', 'Z.S.M.', '']
+
+
+def legacy_check(order_type, gekozen, now):
+    """The pre-schedule api_orders logic on raw setting strings."""
+    closed_days = [d for d in RAW['closed_days'].split(',') if d]
+    if now.strftime('%A') in closed_days:
+        return 'closed day'
+    prefix = 'pickup' if order_type == 'afhalen' else 'delivery'
+    sh, sm = map(int, RAW[f'{prefix}_start'].split(':'))
+    eh, em = map(int, RAW[f'{prefix}_end'].split(':'))
+    start_today = now.replace(hour=sh, minute=sm, second=0, microsecond=0)
+    end_today = now.replace(hour=eh, minute=em, second=0, microsecond=0)
+    chosen_dt = None
+    if gekozen:
+        try:
+            ch, cm = map(int, gekozen.split(':'))
+            chosen_dt = now.replace(hour=ch, minute=cm, second=0, microsecond=0)
+        except Exception:
+            pass
+    if chosen_dt and (chosen_dt < start_today or chosen_dt > end_today):
+        return 'outside'
+    if now > end_today:
+        return 'closed'
+    if gekozen:
+        closed_map = CLOSED[prefix]
+        hour_key = f"{gekozen.split(':')[0]}:00" if ':' in gekozen else None
+        if closed_map.get(gekozen) or (hour_key and closed_map.get(hour_key)):
+            return 'full'
+    return None
+
+
+def main():
+    schedule = A.OrderSchedule(SETTINGS, CLOSED)
+    number = 20000
+    cases = [(t, ot) for t in TIMES for ot in ('afhalen', 'bezorgen')]
+
+    def run_legacy():
+        for t, ot in cases:
+            legacy_check(ot, t, NOW)
+
+    def run_schedule():
+        for t, ot in cases:
+            schedule.is_open_now(ot, NOW)
+            schedule.check_time(ot, t, NOW)
+
+    def run_compile():
+        A.OrderSchedule(SETTINGS, CLOSED)
+
+    for name, fn in [('legacy', run_legacy), ('schedule', run_schedule), ('compile', run_compile)]:
+        per_call = min(timeit.repeat(fn, number=number, repeat=5)) / number
+        unit = 'build'
+        if name != 'compile':
+            per_call /= len(cases)
+            unit = 'check'
+        print(f'{name:10s} {per_call * 1e6:8.2f} us/{unit}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Check the SQL omzet totals against the old Python sums.
+
+Fills an EMPTY database with synthetic orders and compares, field by
+field:
+
+  legacy   the per-dict sums build_excel / build_overview_pdf used to do
+  sql      revenue_totals(), one SUM(CASE ...) query
+  daily    rebuild_daily_revenue() + revenue_summary()
+
+The synthetic orders are deleted again afterwards. Exits non-zero on any
+difference above one cent.
+
+    DATABASE_URL=sqlite:////tmp/parity.db python scripts/check_revenue_parity.py
+    DATABASE_URL=sqlite:////tmp/parity.db python scripts/check_revenue_parity.py --orders 20000
+"""
+import argparse
+import os
+import random
+import sys
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import app as A  # noqa: E402
+
+METHODS = ['pin', 'PIN', 'Pin ', 'online', 'Online', 'contant', 'Contant', 'op rekening',
+           'Rekening', 'tikkie', '', None]
+FIRST = date(2026, 3, 25)  # spans the switch to summer time
+LAST = date(2026, 4, 3)
+
+
+def legacy_totals(order_dicts) -> dict:
+    """The sums as build_excel and build_overview_pdf computed them."""
+    non_cancelled = [o for o in order_dicts if not o['is_cancelled']]
+
+    def method_sum(key):
+        return sum(float(o['totaal']) for o in non_cancelled if key in (o['payment_method'] or '').lower())
+
+    return {
+        'order_count': len(non_cancelled),
+        'total': sum(float(o['totaal']) for o in non_cancelled),
+        'pin': method_sum('pin'),
+        'online': method_sum('online'),
+        'contant': method_sum('contant'),
+        'rekening': method_sum('rekening'),
+        'btw_9': sum(float(o.get('btw_9', 0)) for o in non_cancelled),
+        'btw_21': sum(float(o.get('btw_21', 0)) for o in non_cancelled),
+        'korting': sum(float(o.get('korting', 0)) for o in non_cancelled),
+        'fooi': sum(float(o.get('fooi', 0)) for o in non_cancelled),
+        'statiegeld': sum(float(o.get('statiegeld', 0)) for o in non_cancelled),
+        'bezorgkosten': sum(float(o.get('bezorgkosten') or 0) for o in non_cancelled),
+        'delivery_count': sum(1 for o in non_cancelled if float(o.get('bezorgkosten') or 0) > 0),
+        'cancelled_count': sum(1 for o in order_dicts if o['is_cancelled']),
+        'cancelled_total': sum(float(o['totaal']) for o in order_dicts if o['is_cancelled']),
+    }
+
+
+def synthetic_order(i, rng):
+    start = datetime.combine(FIRST, datetime.min.time()) - timedelta(hours=2)
+    span = (LAST - FIRST).days + 2
+    delivery = rng.random() < 0.4
+    price = round(rng.uniform(5, 40), 2)
+    qty = rng.randint(1, 4)
+    order = A.Order(
+        order_number=f'PAR{i:07d}',
+        order_type='bezorgen' if delivery else 'afhalen',
+        created_at=start + timedelta(seconds=rng.randrange(span * 86400)),
+        items=f'{{"Item {i % 7}": {{"qty": {qty}, "price": {price}}}}}',
+        payment_method=rng.choice(METHODS),
+        totaal=round(price * qty + (2.5 if delivery else 0), 2) if rng.random() > 0.02 else None,
+        btw_9=round(rng.uniform(0, 4), 2),
+        btw_21=round(rng.uniform(0, 1), 2) if rng.random() < 0.3 else None,
+        discountAmount=round(rng.uniform(0, 3), 2) if rng.random() < 0.2 else None,
+        fooi=round(rng.uniform(0, 2), 2) if rng.random() < 0.3 else 0.0,
+        statiegeld=0.15 * rng.randint(0, 2),
+        bezorgkosten=2.5 if delivery and rng.random() < 0.7 else 0.0,
+        is_cancelled=rng.choice([False, False, False, False, True, None]),
+    )
+    order.set_totals()
+    return order
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    with A.app.app_context():
+        if A.db.session.query(A.Order.id).first() is not None:
+            sys.exit('orders table is not empty; use a scratch database')
+        try:
+            A.db.session.add_all(synthetic_order(i, rng) for i in range(args.orders))
+            A.db.session.commit()
+
+            orders = A.Order.query.filter(A.created_between(FIRST, LAST)).all()
+            legacy = legacy_totals(A.orders_to_dicts(orders))
+            sql = A.revenue_totals(A.created_between(FIRST, LAST))
+            A.rebuild_daily_revenue(FIRST - timedelta(days=1), LAST + timedelta(days=1))
+            daily = A.revenue_summary(FIRST, LAST)
+        finally:
+            A.db.session.rollback()
+            A.DailyRevenue.query.delete()
+            A.OrderItem.query.delete()
+            A.Order.query.filter(A.Order.order_number.like('PAR%')).delete(synchronize_session=False)
+            A.db.session.commit()
+
+    failed = False
+    print(f'{"field":16s} {"legacy":>12s} {"sql":>12s} {"daily":>12s}')
+    for field in A.REVENUE_FIELDS:
+        values = (legacy[field], sql[field], daily[field])
+        bad = max(values) - min(values) > 0.01
+        failed |= bad
+        print(f'{field:16s} {values[0]:12.2f} {values[1]:12.2f} {values[2]:12.2f}{"  MISMATCH" if bad else ""}')
+    print(f'{len(orders)} orders in {FIRST} .. {LAST}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()